@@ -0,0 +1,55 @@
+"""add report indexes
+
+Revision ID: 3f1a9c2d7e45
+Revises: c464bedbf2fd
+Create Date: 2026-10-18 09:12:31.402117
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = "3f1a9c2d7e45"
+down_revision = "c464bedbf2fd"
+branch_labels = None
+depends_on = None
+
+
+# (table, columns) for every index used by the report time filters and interval joins
+_INDEXES = [
+    ("start", ["timestamp"]),
+    ("stop", ["timestamp"]),
+    ("start", ["mesin_id", "timestamp"]),
+    ("stop", ["mesin_id", "timestamp"]),
+    ("utility_mesin", ["start_time_id"]),
+    ("utility_mesin", ["stop_time_id"]),
+    ("last_downtime_mesin", ["start_time_id"]),
+    ("last_downtime_mesin", ["stop_time_id"]),
+    ("continued_downtime_mesin", ["start_time_id"]),
+    ("continued_downtime_mesin", ["stop_time_id"]),
+]
+
+
+def _index_name(table, columns):
+    return f"ix_{table}_{'_'.join(columns)}"
+
+
+def upgrade():
+    # Build concurrently on Postgres so a long event history does not block /activity writes
+    with op.get_context().autocommit_block():
+        for table, columns in _INDEXES:
+            op.create_index(
+                _index_name(table, columns),
+                table,
+                columns,
+                unique=False,
+                postgresql_concurrently=True,
+            )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table, columns in reversed(_INDEXES):
+            op.drop_index(
+                _index_name(table, columns), table_name=table, postgresql_concurrently=True
+            )
@@ -0,0 +1,77 @@
+"""add downtime category codes
+
+Revision ID: 5b8e1f0c2a67
+Revises: 8d2e4b6a1c93
+Create Date: 2026-10-18 15:02:44.518309
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "5b8e1f0c2a67"
+down_revision = "8d2e4b6a1c93"
+branch_labels = None
+depends_on = None
+
+
+# (table, name column, code column) of every table that held the category name
+_COLUMNS = [
+    ("stop", "downtime_category", "downtime_category_id"),
+    ("last_downtime_mesin", "downtime_category", "downtime_category_id"),
+    ("continued_downtime_mesin", "downtime_category", "downtime_category_id"),
+    ("mesin_status", "category_downtime", "category_downtime_id"),
+]
+
+
+def _foreign_key_name(table, code_column):
+    return f"fk_{table}_{code_column}_downtime_category"
+
+
+def upgrade():
+    op.create_table(
+        "downtime_category",
+        sa.Column(
+            "id",
+            sa.SmallInteger().with_variant(sa.Integer(), "sqlite"),
+            autoincrement=True,
+            nullable=False,
+        ),
+        sa.Column("name", sa.String(), nullable=False),
+        sa.PrimaryKeyConstraint("id"),
+        sa.UniqueConstraint("name"),
+    )
+    names = " UNION ".join(
+        f"SELECT {name_column} AS name FROM {table} WHERE {name_column} IS NOT NULL"
+        for table, name_column, _ in _COLUMNS
+    )
+    op.execute(
+        f"INSERT INTO downtime_category (name) SELECT name FROM ({names}) AS names ORDER BY name"
+    )
+
+    # Batches, so SQLite copies the tables instead of failing on the dropped columns
+    for table, name_column, code_column in _COLUMNS:
+        op.add_column(table, sa.Column(code_column, sa.SmallInteger(), nullable=True))
+        op.execute(
+            f"UPDATE {table} SET {code_column} = (SELECT id FROM downtime_category "
+            f"WHERE downtime_category.name = {table}.{name_column})"
+        )
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column(name_column)
+            batch_op.create_foreign_key(
+                _foreign_key_name(table, code_column), "downtime_category", [code_column], ["id"]
+            )
+
+
+def downgrade():
+    for table, name_column, code_column in reversed(_COLUMNS):
+        op.add_column(table, sa.Column(name_column, sa.String(), nullable=True))
+        op.execute(
+            f"UPDATE {table} SET {name_column} = (SELECT name FROM downtime_category "
+            f"WHERE downtime_category.id = {table}.{code_column})"
+        )
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_constraint(_foreign_key_name(table, code_column), type_="foreignkey")
+            batch_op.drop_column(code_column)
+    op.drop_table("downtime_category")
@@ -0,0 +1,43 @@
+"""add shift rollup
+
+Revision ID: 8d2e4b6a1c93
+Revises: 3f1a9c2d7e45
+Create Date: 2026-10-18 11:40:07.215836
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "8d2e4b6a1c93"
+down_revision = "3f1a9c2d7e45"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "shift_rollup",
+        sa.Column("shift_date", sa.Date(), nullable=False),
+        sa.Column("shift", sa.Integer(), nullable=False),
+        sa.Column("mesin_id", sa.String(), nullable=False),
+        sa.Column("operator_id", sa.String(), nullable=False),
+        sa.Column("tooling_id", sa.String(), nullable=False),
+        sa.Column("downtime_category", sa.String(), nullable=False),
+        sa.Column("duration", sa.Integer(), nullable=False),
+        sa.Column("output", sa.Integer(), nullable=False),
+        sa.Column("reject", sa.Integer(), nullable=False),
+        sa.Column("rework", sa.Integer(), nullable=False),
+        sa.Column("interval_count", sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(["mesin_id"], ["mesin.id"]),
+        sa.ForeignKeyConstraint(["operator_id"], ["operator.id"]),
+        sa.PrimaryKeyConstraint(
+            "shift_date", "shift", "mesin_id", "operator_id", "tooling_id", "downtime_category"
+        ),
+    )
+    # Existing history is summed by running `python3 rollup.py` once after upgrading
+
+
+def downgrade():
+    op.drop_table("shift_rollup")
@@ -0,0 +1,34 @@
+"""add archive part
+
+Revision ID: a4d7c3e9b512
+Revises: 5b8e1f0c2a67
+Create Date: 2026-10-18 17:26:51.730244
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "a4d7c3e9b512"
+down_revision = "5b8e1f0c2a67"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "archive_part",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("month", sa.Date(), nullable=False),
+        sa.Column(
+            "time_created", sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True
+        ),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(op.f("ix_archive_part_month"), "archive_part", ["month"], unique=False)
+
+
+def downgrade():
+    op.drop_index(op.f("ix_archive_part_month"), table_name="archive_part")
+    op.drop_table("archive_part")
@@ -0,0 +1,97 @@
+"""add production interval
+
+Revision ID: e62b9d4f8a10
+Revises: a4d7c3e9b512
+Create Date: 2026-10-18 19:48:13.604927
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = "e62b9d4f8a10"
+down_revision = "a4d7c3e9b512"
+branch_labels = None
+depends_on = None
+
+
+_UTILITY = "U : Utility"
+
+# (kind, interval table, table of its starting event, table of its stopping event)
+_SOURCES = [
+    ("UTILITY", "utility_mesin", "start", "stop"),
+    ("CONTINUED_DOWNTIME", "continued_downtime_mesin", "stop", "stop"),
+    ("LAST_DOWNTIME", "last_downtime_mesin", "stop", "start"),
+]
+
+
+def upgrade():
+    op.create_table(
+        "production_interval",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column(
+            "kind",
+            sa.Enum("UTILITY", "LAST_DOWNTIME", "CONTINUED_DOWNTIME", name="interval_kind"),
+            nullable=False,
+        ),
+        sa.Column("mesin_id", sa.String(), nullable=False),
+        sa.Column("operator_id", sa.String(), nullable=False),
+        sa.Column("start_operator_id", sa.String(), nullable=True),
+        sa.Column("tooling_id", sa.String(), nullable=True),
+        sa.Column("start_timestamp", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("stop_timestamp", sa.DateTime(timezone=True), nullable=False),
+        sa.Column("downtime_category_id", sa.SmallInteger(), nullable=True),
+        sa.Column("output", sa.Integer(), nullable=True),
+        sa.Column("reject", sa.Integer(), nullable=True),
+        sa.Column("rework", sa.Integer(), nullable=True),
+        sa.Column("coil_no", sa.String(), nullable=True),
+        sa.Column("lot_no", sa.String(), nullable=True),
+        sa.Column("pack_no", sa.String(), nullable=True),
+        sa.ForeignKeyConstraint(["downtime_category_id"], ["downtime_category.id"]),
+        sa.ForeignKeyConstraint(["mesin_id"], ["mesin.id"]),
+        sa.ForeignKeyConstraint(["operator_id"], ["operator.id"]),
+        sa.ForeignKeyConstraint(["start_operator_id"], ["operator.id"]),
+        sa.ForeignKeyConstraint(["tooling_id"], ["tooling.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+
+    # Utility intervals carry the Utility category like the downtime ones carry theirs
+    op.execute(
+        f"INSERT INTO downtime_category (name) SELECT '{_UTILITY}' WHERE NOT EXISTS "
+        f"(SELECT 1 FROM downtime_category WHERE name = '{_UTILITY}')"
+    )
+    for kind, interval, start, stop in _SOURCES:
+        if kind == "UTILITY":
+            category = f"(SELECT id FROM downtime_category WHERE name = '{_UTILITY}')"
+            measures = "i.output, i.reject, i.rework, i.coil_no, i.lot_no, i.pack_no"
+        else:
+            category = "i.downtime_category_id"
+            measures = "0, i.reject, i.rework, NULL, NULL, NULL"
+        op.execute(
+            "INSERT INTO production_interval (kind, mesin_id, operator_id, start_operator_id, "
+            "tooling_id, start_timestamp, stop_timestamp, downtime_category_id, output, reject, "
+            "rework, coil_no, lot_no, pack_no) "
+            f"SELECT '{kind}', i.mesin_id, i.operator_id, b.operator_id, b.tooling_id, "
+            f"b.timestamp, e.timestamp, {category}, {measures} "
+            f"FROM {interval} AS i "
+            f"JOIN {start} AS b ON b.id = i.start_time_id "
+            f"JOIN {stop} AS e ON e.id = i.stop_time_id "
+            "ORDER BY b.timestamp"
+        )
+
+    # Built after the backfill, one sort instead of an index update per row
+    op.create_index(
+        op.f("ix_production_interval_start_timestamp"),
+        "production_interval",
+        ["start_timestamp"],
+        unique=False,
+    )
+
+
+def downgrade():
+    op.drop_index(
+        op.f("ix_production_interval_start_timestamp"), table_name="production_interval"
+    )
+    op.drop_table("production_interval")
+    sa.Enum(name="interval_kind").drop(op.get_bind(), checkfirst=True)
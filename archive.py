@@ -0,0 +1,245 @@
+import argparse
+import logging
+import os
+from datetime import date, datetime, timedelta, timezone
+
+import pandas
+import pytz
+import sqlalchemy as sa
+
+import database
+import models
+import report_cache
+import report_query
+
+"""
+Whole months of start, stop, interval and production interval history moved out of
+the database into compressed Parquet files, so the live tables and their indexes only
+hold recent months however long the factory has been running. A month is kept as its
+report source rows, one file per report view under ARCHIVE_DIRECTORY, and reports
+read the archived part of a range from those files and the rest from the database.
+
+Months are local calendar months, archived oldest first once they are more than
+ARCHIVE_KEEP_MONTHS months old, and only when no machine's current interval started
+in them: that interval is only written when the machine's next event arrives.
+Each archive run of a month is an archive_part row committed with the deletes, so
+files of a run that did not commit are never read. Rows written for a month after it
+was archived, by a very late offline tablet, are read from the database like any
+other until the next run makes them another part.
+Archived rows keep the master names they had when they were archived.
+"""
+_TIMEZONE = pytz.timezone("Asia/Jakarta")
+
+_ARCHIVE_DIRECTORY = os.environ.get("ARCHIVE_DIRECTORY", "data/archive")
+_KEEP_MONTHS = int(os.environ.get("ARCHIVE_KEEP_MONTHS", 13))
+
+# Interval tables with the event table their start_time_id points to, a report
+# books an interval on the month its starting event falls in
+_INTERVALS = [
+    (models.UtilityMesin.__table__, models.Start.__table__),
+    (models.ContinuedDowntimeMesin.__table__, models.Stop.__table__),
+    (models.LastDowntimeMesin.__table__, models.Stop.__table__),
+]
+_EVENTS = [models.Start.__table__, models.Stop.__table__]
+
+
+def _to_utc(date_time):
+    # Naive datetimes are already UTC, as the report ranges and SQLite timestamps are
+    if date_time.tzinfo is not None:
+        date_time = date_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return date_time
+
+
+def _month_of(date_time):
+    """First day of the local month of a naive UTC datetime."""
+    return pytz.utc.localize(date_time).astimezone(_TIMEZONE).date().replace(day=1)
+
+
+def _next_month(month):
+    return (month + timedelta(days=31)).replace(day=1)
+
+
+def _month_range(month):
+    """Naive UTC bounds of a local month."""
+    return tuple(
+        _TIMEZONE.localize(datetime(day.year, day.month, 1))
+        .astimezone(timezone.utc)
+        .replace(tzinfo=None)
+        for day in [month, _next_month(month)]
+    )
+
+
+def _path(view, part_id, month):
+    return os.path.join(_ARCHIVE_DIRECTORY, view, f"{month:%Y-%m}_{part_id}.parquet")
+
+
+def _parts(conn):
+    """(id, month) of every committed archive part, oldest month first."""
+    table = models.ArchivePart.__table__
+    return conn.execute(
+        sa.select(table.c.id, table.c.month).order_by(table.c.month, table.c.id)
+    ).all()
+
+
+def _end(parts):
+    return _month_range(parts[-1].month)[1] if parts else None
+
+
+def horizon(conn):
+    """Naive UTC end of the archived history, None when nothing is archived."""
+    return _end(_parts(conn))
+
+
+def read_report_source(view, time_from, time_to, loader):
+    """
+    Report source rows for [time_from, time_to): archived months from their files and
+    the rows still in the database, archived months included, through loader(view,
+    time_from, time_to). Rows are returned in the view's sort order.
+    """
+    time_from, time_to = _to_utc(time_from), _to_utc(time_to)
+    engine = database.get_engine()
+    with engine.connect() as conn:
+        parts = _parts(conn)
+    while True:
+        live = loader(view, time_from, time_to)
+        with engine.connect() as conn:
+            current = _parts(conn)
+        if current == parts:
+            break
+        # An archive run committed meanwhile, the rows it deleted are in its files now
+        parts = current
+
+    end = _end(parts)
+    if end is None or time_from >= end or time_from >= time_to:
+        return live
+
+    bound_from = pandas.Timestamp(time_from, tz="UTC")
+    bound_to = pandas.Timestamp(min(time_to, end), tz="UTC")
+    frames = []
+    for part_id, month in parts:
+        month_from, month_to = _month_range(month)
+        if month_to <= time_from or month_from >= time_to:
+            continue
+        df = pandas.read_parquet(_path(view, part_id, month))
+        is_in_range = (df["Start"] >= bound_from) & (df["Start"] < bound_to)
+        frames.append(df[is_in_range].reset_index(drop=True))
+    frames.append(live)
+    return report_query.combine_frames(view, frames)
+
+
+def _delete_month(session, time_from, time_to):
+    """Delete the intervals starting in the range, then its events nothing refers to."""
+    deleted = 0
+    for interval, start in _INTERVALS:
+        starts = sa.select(start.c.id).where(
+            start.c.timestamp >= time_from, start.c.timestamp < time_to
+        )
+        deleted += session.execute(
+            interval.delete().where(interval.c.start_time_id.in_(starts))
+        ).rowcount
+
+    facts = models.ProductionInterval.__table__
+    deleted += session.execute(
+        facts.delete().where(
+            facts.c.start_timestamp >= time_from, facts.c.start_timestamp < time_to
+        )
+    ).rowcount
+
+    for event in _EVENTS:
+        references = [
+            foreign_key.parent
+            for table in models.Base.metadata.sorted_tables
+            for foreign_key in table.foreign_keys
+            if foreign_key.column.table is event
+        ]
+        deleted += session.execute(
+            event.delete()
+            .where(event.c.timestamp >= time_from, event.c.timestamp < time_to)
+            .where(*[~sa.exists().where(column == event.c.id) for column in references])
+        ).rowcount
+    return deleted
+
+
+def _archive_month(session, month):
+    """Write a month's report source rows to a new part and delete them, returns deleted rows."""
+    time_from, time_to = _month_range(month)
+    part = models.ArchivePart(month=month)
+    session.add(part)
+    session.flush()
+
+    paths, rows = [], 0
+    for view in report_query.VIEWS:
+        result = report_query.execute_report_query(session.connection(), view, time_from, time_to)
+        df = report_query.to_frame(list(result.keys()), result.fetchall())
+        path = _path(view, part.id, month)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        df.to_parquet(path + ".tmp", compression="zstd", index=False)
+        os.replace(path + ".tmp", path)
+        paths.append(path)
+        rows += len(df)
+
+    deleted = _delete_month(session, time_from, time_to)
+    if not rows and not deleted:
+        # Nothing left of this month in the database, e.g. only events still referenced
+        session.rollback()
+        for path in paths:
+            os.remove(path)
+        return 0
+    session.commit()
+    # Cached report tiles of the month hold the rows now read from its files
+    report_cache.invalidate_all()
+    return deleted
+
+
+def _first_open_interval(session):
+    """Naive UTC start of the earliest interval a machine has not closed yet."""
+    last_start = sa.orm.aliased(models.Start)
+    last_stop = sa.orm.aliased(models.Stop)
+    rows = (
+        session.query(last_start.timestamp, last_stop.timestamp)
+        .select_from(models.MesinStatus)
+        .join(last_start, last_start.id == models.MesinStatus.last_start_id)
+        .join(last_stop, last_stop.id == models.MesinStatus.last_stop_id)
+        .all()
+    )
+    return min((max(_to_utc(start), _to_utc(stop)) for start, stop in rows), default=None)
+
+
+def _oldest_event(session):
+    timestamps = [
+        session.execute(sa.select(sa.func.min(event.c.timestamp))).scalar() for event in _EVENTS
+    ]
+    return min((_to_utc(timestamp) for timestamp in timestamps if timestamp), default=None)
+
+
+def archive_months(session, keep_months=_KEEP_MONTHS):
+    """
+    Archive every month older than keep_months months that can be, oldest first,
+    committing each one. Returns the rows deleted by month.
+    """
+    today = datetime.now(_TIMEZONE).date()
+    months_ago = today.year * 12 + today.month - 1 - keep_months
+    cutoff = date(months_ago // 12, months_ago % 12 + 1, 1)
+    open_from = _first_open_interval(session)
+    oldest = _oldest_event(session)
+
+    archived = {}
+    month = cutoff if oldest is None else _month_of(oldest)
+    while month < cutoff:
+        if open_from is not None and _month_range(month)[1] > open_from:
+            logging.warning(f"Not archiving {month:%Y-%m} yet, a machine's interval is open")
+            break
+        deleted = _archive_month(session, month)
+        if deleted:
+            archived[month] = deleted
+        month = _next_month(month)
+    return archived
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive old months of activity history.")
+    parser.add_argument("--keep-months", type=int, default=_KEEP_MONTHS)
+    args = parser.parse_args()
+    with database.session_scope() as session:
+        for month, deleted in archive_months(session, args.keep_months).items():
+            print(f"{month:%Y-%m} archived, {deleted} rows deleted")
@@ -0,0 +1,156 @@
+"""
+Measure POST /activity latency on an idle server and again while report exports
+run, against a real uvicorn process. Reports run on the REPORT_JOB_WORKERS
+processes, so /activity should stay close to its idle latency.
+
+The script drops and recreates every table, so only point it at a scratch database:
+
+    $ python3 benchmarks/activity_during_reports.py --url sqlite:///load_test.db
+    $ python3 benchmarks/activity_during_reports.py --url postgresql+psycopg2://...
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+
+import httpx
+import sqlalchemy as sa
+
+from explain_report_queries import BASE_DIR, populate
+
+import models
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def wait_until_up(client):
+    for _ in range(100):
+        try:
+            client.get("/")
+            return
+        except httpx.TransportError:
+            time.sleep(0.1)
+    raise RuntimeError("Server did not come up")
+
+
+def post_activities(client, mesin, stop_at, latencies, counts):
+    ids = {"tooling_id": f"TL-{mesin}", "mesin_id": f"MC-{mesin}", "operator_id": f"OP-{mesin}"}
+    events = [
+        {"type": "start", "category_downtime": None, **ids},
+        {"type": "first_stop", "category_downtime": "TP : Tool Preparation", "output": 1, **ids},
+    ]
+    while time.monotonic() < stop_at:
+        begin = time.perf_counter()
+        client.post("/activity", json=events[counts[mesin] % 2]).raise_for_status()
+        latencies.append(time.perf_counter() - begin)
+        counts[mesin] += 1
+
+
+def _export_reports(client, request, stop_at, durations):
+    while time.monotonic() < stop_at:
+        begin = time.perf_counter()
+        with client.stream("POST", "/report/mesin", json=request) as response:
+            for _ in response.iter_bytes():
+                pass
+        durations.append(time.perf_counter() - begin)
+
+
+def _run_phase(base_url, args, counts, report_request):
+    stop_at = time.monotonic() + args.seconds
+    latencies, durations, threads = [], [], []
+    timeout = httpx.Timeout(None)
+    for mesin in range(args.clients):
+        client = httpx.Client(base_url=base_url, timeout=timeout)
+        threads.append(
+            threading.Thread(
+                target=post_activities, args=(client, mesin, stop_at, latencies, counts)
+            )
+        )
+    for _ in range(args.reports if report_request else 0):
+        client = httpx.Client(base_url=base_url, timeout=timeout)
+        threads.append(
+            threading.Thread(
+                target=_export_reports, args=(client, report_request, stop_at, durations)
+            )
+        )
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, durations
+
+
+def _print_phase(label, latencies, durations):
+    print(
+        f"{label}: {len(latencies)} activities, "
+        f"p50 {percentile(latencies, 50) * 1000:.1f} ms, "
+        f"p95 {percentile(latencies, 95) * 1000:.1f} ms, "
+        f"p99 {percentile(latencies, 99) * 1000:.1f} ms, "
+        f"max {max(latencies) * 1000:.1f} ms"
+    )
+    if durations:
+        print(f"  {len(durations)} reports, mean {statistics.mean(durations):.2f} s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="sqlite:///activity_during_reports.db")
+    parser.add_argument("--mesin", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--clients", type=int, default=8, help="tablets posting /activity")
+    parser.add_argument("--reports", type=int, default=4, help="concurrent report exports")
+    parser.add_argument("--report-workers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    engine = sa.create_engine(args.url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    populate(engine, args.mesin, args.days)
+    if engine.dialect.name == "sqlite":
+        # Like Postgres, let the report readers and the /activity writers not block each other
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+    engine.dispose()
+
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port)],
+        cwd=BASE_DIR,
+        env={
+            **os.environ,
+            "DATABASE_URL": args.url,
+            "REPORT_JOB_WORKERS": str(args.report_workers),
+        },
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        wait_until_up(httpx.Client(base_url=base_url))
+        report_request = {
+            "date_from": "2023-01-01",
+            "shift_from": 1,
+            "date_to": str(date(2023, 1, 1) + timedelta(days=args.days)),
+            "shift_to": 3,
+            "stream": True,
+        }
+        # Events alternate start and first_stop per machine, carried across both phases
+        counts = [0] * args.clients
+        _print_phase("idle", *_run_phase(base_url, args, counts, None))
+        _print_phase("during reports", *_run_phase(base_url, args, counts, report_request))
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,219 @@
+"""
+Print the EXPLAIN plans and timings of the mesin and operator report queries,
+first without and then with the report indexes added in 3f1a9c2d7e45 and the
+production_interval one.
+
+The script drops and recreates every table, so only point it at a scratch database:
+
+    $ python3 benchmarks/explain_report_queries.py --url sqlite:///explain.db --days 60
+    $ python3 benchmarks/explain_report_queries.py --url postgresql+psycopg2://...
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta
+
+import sqlalchemy as sa
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import models
+import report_query
+
+_REPORT_INDEXES = [
+    "ix_start_timestamp",
+    "ix_stop_timestamp",
+    "ix_start_mesin_id_timestamp",
+    "ix_stop_mesin_id_timestamp",
+    "ix_utility_mesin_start_time_id",
+    "ix_utility_mesin_stop_time_id",
+    "ix_last_downtime_mesin_start_time_id",
+    "ix_last_downtime_mesin_stop_time_id",
+    "ix_continued_downtime_mesin_start_time_id",
+    "ix_continued_downtime_mesin_stop_time_id",
+    "ix_production_interval_start_timestamp",
+]
+
+
+class Explain(Executable, ClauseElement):
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(Explain)
+def _compile_explain(element, compiler, **kw):
+    if compiler.dialect.name == "sqlite":
+        prefix = "EXPLAIN QUERY PLAN "
+    else:
+        prefix = "EXPLAIN ANALYZE "
+    return prefix + compiler.process(element.statement, **kw)
+
+
+def _report_indexes():
+    return [
+        index
+        for table in models.Base.metadata.sorted_tables
+        for index in table.indexes
+        if index.name in _REPORT_INDEXES
+    ]
+
+
+def populate(engine, mesin_count, days):
+    random.seed(0)
+    with engine.begin() as conn:
+        conn.execute(
+            models.Mesin.__table__.insert(),
+            [{"id": f"MC-{i}", "name": f"MC {i}", "tonase": 110} for i in range(mesin_count)],
+        )
+        conn.execute(
+            models.Operator.__table__.insert(),
+            [{"id": f"OP-{i}", "name": f"Operator {i}"} for i in range(mesin_count)],
+        )
+        conn.execute(
+            models.Tooling.__table__.insert(),
+            [{"id": f"TL-{i}", "kode_tooling": f"TL {i}"} for i in range(mesin_count)],
+        )
+        conn.execute(
+            models.DowntimeCategory.__table__.insert(),
+            [{"id": 1, "name": "TP : Tool Preparation"}, {"id": 2, "name": "U : Utility"}],
+        )
+
+    start_id = stop_id = 0
+    previous_stop = None
+    time_to = datetime(2023, 1, 1) + timedelta(days=days)
+    for mesin in range(mesin_count):
+        starts, stops, utilities, last_downtimes, facts = [], [], [], [], []
+        timestamp = datetime(2023, 1, 1)
+        ids = {"mesin_id": f"MC-{mesin}", "operator_id": f"OP-{mesin}", "tooling_id": f"TL-{mesin}"}
+        while timestamp < time_to:
+            start_id += 1
+            starts.append({"id": start_id, "timestamp": timestamp, **ids})
+            if stop_id:
+                last_downtimes.append(
+                    {
+                        "mesin_id": ids["mesin_id"],
+                        "operator_id": ids["operator_id"],
+                        "start_time_id": stop_id,
+                        "stop_time_id": start_id,
+                        "downtime_category_id": 1,
+                    }
+                )
+                facts.append(
+                    {
+                        "kind": models.IntervalKind.LAST_DOWNTIME,
+                        "mesin_id": ids["mesin_id"],
+                        "operator_id": ids["operator_id"],
+                        "start_operator_id": previous_stop["operator_id"],
+                        "tooling_id": previous_stop["tooling_id"],
+                        "start_timestamp": previous_stop["timestamp"],
+                        "stop_timestamp": timestamp,
+                        "downtime_category_id": 1,
+                        "output": 0,
+                    }
+                )
+            start_timestamp = timestamp
+            timestamp += timedelta(minutes=random.randint(20, 90))
+
+            stop_id += 1
+            stops.append(
+                {
+                    "id": stop_id,
+                    "timestamp": timestamp,
+                    "output": 100,
+                    "downtime_category_id": 1,
+                    **ids,
+                }
+            )
+            utilities.append(
+                {
+                    "mesin_id": ids["mesin_id"],
+                    "operator_id": ids["operator_id"],
+                    "start_time_id": start_id,
+                    "stop_time_id": stop_id,
+                    "output": 100,
+                }
+            )
+            facts.append(
+                {
+                    "kind": models.IntervalKind.UTILITY,
+                    "start_operator_id": ids["operator_id"],
+                    "start_timestamp": start_timestamp,
+                    "stop_timestamp": timestamp,
+                    "downtime_category_id": 2,
+                    "output": 100,
+                    **ids,
+                }
+            )
+            previous_stop = stops[-1]
+            timestamp += timedelta(minutes=random.randint(5, 30))
+
+        with engine.begin() as conn:
+            conn.execute(models.Start.__table__.insert(), starts)
+            conn.execute(models.Stop.__table__.insert(), stops)
+            conn.execute(models.UtilityMesin.__table__.insert(), utilities)
+            if last_downtimes:
+                conn.execute(models.LastDowntimeMesin.__table__.insert(), last_downtimes)
+            conn.execute(models.ProductionInterval.__table__.insert(), facts)
+
+    return start_id
+
+
+def _explain(engine, label, time_from, time_to, repeat):
+    print(f"===== {label} =====")
+    for view in report_query.VIEWS:
+        query = report_query.build_report_query(view, time_from, time_to)
+        with engine.connect() as conn:
+            plan = conn.execute(Explain(query)).fetchall()
+
+            timings = []
+            for _ in range(repeat):
+                begin = time.perf_counter()
+                conn.execute(query).fetchall()
+                timings.append(time.perf_counter() - begin)
+
+        print(f"--- {view} report, median {statistics.median(timings) * 1000:.1f} ms ---")
+        for row in plan:
+            print("  " + " | ".join(str(column) for column in row))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="sqlite:///explain_report_queries.db")
+    parser.add_argument("--mesin", type=int, default=20)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    engine = sa.create_engine(args.url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    for index in _report_indexes():
+        index.drop(engine)
+
+    rows = populate(engine, args.mesin, args.days)
+    print(f"Populated {rows} start events for {args.mesin} machines over {args.days} days")
+
+    # Report the last day, the common case of a single shift or day report
+    time_to = datetime(2023, 1, 1) + timedelta(days=args.days)
+    time_from = time_to - timedelta(days=1)
+
+    _explain(engine, "before report indexes", time_from, time_to, args.repeat)
+
+    for index in _report_indexes():
+        index.create(engine)
+    with engine.begin() as conn:
+        conn.execute(sa.text("ANALYZE"))
+
+    _explain(engine, "after report indexes", time_from, time_to, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Time the report processing that follows the query, serially and split by machine or
+operator over a growing number of worker processes, and check every run produces
+the same report as the serial one. Run it from the repository root.
+
+The script drops and recreates every table, so only point it at a scratch database:
+
+    $ python3 benchmarks/report_partition_scaling.py --url sqlite:///scaling.db --workers 1,2,4,8,16
+"""
+import argparse
+import os
+import statistics
+import time
+from datetime import datetime, timedelta
+
+import pandas
+import sqlalchemy as sa
+
+from explain_report_queries import populate
+
+import generate_report
+import models
+import report_query
+
+
+def _time(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        begin = time.perf_counter()
+        result = function()
+        timings.append(time.perf_counter() - begin)
+    return statistics.median(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="sqlite:///report_partition_scaling.db")
+    parser.add_argument("--mesin", type=int, default=64)
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--workers", default=f"1,2,4,{os.cpu_count()}")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    workers = sorted({int(count) for count in args.workers.split(",")})
+
+    engine = sa.create_engine(args.url)
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    populate(engine, args.mesin, args.days)
+
+    time_from = datetime(2023, 1, 1)
+    time_to = time_from + timedelta(days=args.days)
+    print(f"{os.cpu_count()} cores, {args.mesin} machines over {args.days} days")
+    for view in report_query.VIEWS:
+        with engine.connect() as conn:
+            result = report_query.execute_report_query(conn, view, time_from, time_to)
+            source = report_query.to_frame(list(result.keys()), result.fetchall())
+        serial, expected = _time(
+            lambda: generate_report.process_report(source.copy(), view), args.repeat
+        )
+        print(f"--- {view} report, {len(source)} rows, serial {serial:.2f} s ---")
+
+        for count in workers:
+            # Start the worker processes outside the timed runs
+            generate_report.process_report(source.copy(), view, count)
+            elapsed, result = _time(
+                lambda: generate_report.process_report(source.copy(), view, count), args.repeat
+            )
+            pandas.testing.assert_frame_equal(result, expected)
+            print(f"  {count:>3} workers: {elapsed:.2f} s, speedup {serial / elapsed:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
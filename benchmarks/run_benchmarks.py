@@ -0,0 +1,240 @@
+"""
+Benchmark report generation and the tablet-facing endpoints on a synthetic factory,
+and write the results as JSON to compare between versions or between SQLite and
+Postgres. Run it from the repository root.
+
+The database is filled by synthetic_factory through business_logic, then this times
+get_mesin_report and get_operator_report over a shift, a day and the whole range
+(first run and the median of the following ones), POST /activity throughput from
+concurrent tablets and GET /mesin-status-all/ latency against a real uvicorn process.
+
+The script drops and recreates every table, so only point it at a scratch database:
+
+    $ python3 benchmarks/run_benchmarks.py --url sqlite:///benchmark.db --output sqlite.json
+    $ python3 benchmarks/run_benchmarks.py --url postgresql+psycopg2://... --output pg.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from activity_during_reports import percentile, post_activities, wait_until_up
+from explain_report_queries import BASE_DIR
+
+# Cached reports would turn every warm run into a file read
+os.environ["REPORT_CACHE_DIRECTORY"] = tempfile.mkdtemp(prefix="report-cache-")
+
+import database
+import generate_report
+import models
+import synthetic_factory
+
+
+def _latencies(values):
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "max_ms": max(values) * 1000,
+    }
+
+
+def _time_report(get_report, date_from, shift_from, date_to, shift_to, repeat):
+    timings = []
+    for _ in range(repeat + 1):
+        begin = time.perf_counter()
+        df, _ = get_report(
+            date_time_from=date_from,
+            shift_from=shift_from,
+            date_time_to=date_to,
+            shift_to=shift_to,
+        )
+        timings.append(time.perf_counter() - begin)
+    return {
+        "rows": len(df),
+        "first_s": timings[0],
+        "median_s": statistics.median(timings[1:]) if repeat else timings[0],
+    }
+
+
+def _benchmark_reports(days, repeat):
+    start = synthetic_factory.START.date()
+    ranges = {
+        "shift": (start, 1, start, 1),
+        "day": (start, 1, start, 3),
+        "all": (start, 1, start + timedelta(days=days - 1), 3),
+    }
+    results = {}
+    for view, get_report in [
+        ("mesin", generate_report.get_mesin_report),
+        ("operator", generate_report.get_operator_report),
+    ]:
+        for label, report_range in ranges.items():
+            results[f"{view}_{label}"] = result = _time_report(get_report, *report_range, repeat)
+            print(
+                f"{view} report, {label}: {result['rows']} rows, "
+                f"first {result['first_s']:.2f} s, median {result['median_s']:.2f} s"
+            )
+    return results
+
+
+def _poll_status(client, stop_at, latencies):
+    while time.monotonic() < stop_at:
+        begin = time.perf_counter()
+        client.get("/mesin-status-all/").raise_for_status()
+        latencies.append(time.perf_counter() - begin)
+
+
+def _benchmark_endpoints(args):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port)],
+        cwd=BASE_DIR,
+        env={**os.environ, "DATABASE_URL": args.url},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    timeout = httpx.Timeout(None)
+    try:
+        wait_until_up(httpx.Client(base_url=base_url))
+
+        idle = []
+        _poll_status(httpx.Client(base_url=base_url), time.monotonic() + args.seconds / 4, idle)
+
+        # The tablets post on their own machines, with the load test toolings added in main
+        stop_at = time.monotonic() + args.seconds
+        activity, during_activity, counts = [], [], [0] * args.clients
+        threads = [
+            threading.Thread(
+                target=post_activities,
+                args=(
+                    httpx.Client(base_url=base_url, timeout=timeout),
+                    mesin,
+                    stop_at,
+                    activity,
+                    counts,
+                ),
+            )
+            for mesin in range(args.clients)
+        ]
+        threads.append(
+            threading.Thread(
+                target=_poll_status,
+                args=(httpx.Client(base_url=base_url, timeout=timeout), stop_at, during_activity),
+            )
+        )
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    results = {
+        "activity": {**_latencies(activity), "per_second": len(activity) / args.seconds},
+        "mesin_status_all_idle": _latencies(idle),
+        "mesin_status_all_during_activity": _latencies(during_activity),
+    }
+    print(
+        f"/activity: {results['activity']['per_second']:.0f}/s from {args.clients} clients, "
+        f"p50 {results['activity']['p50_ms']:.1f} ms, p99 {results['activity']['p99_ms']:.1f} ms"
+    )
+    for label in ["idle", "during_activity"]:
+        result = results[f"mesin_status_all_{label}"]
+        print(
+            f"/mesin-status-all/ {label.replace('_', ' ')}: "
+            f"p50 {result['p50_ms']:.1f} ms, p99 {result['p99_ms']:.1f} ms"
+        )
+    return results
+
+
+def _revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=BASE_DIR,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="sqlite:///benchmark.db")
+    parser.add_argument("--mesin", type=int, default=20)
+    parser.add_argument("--operators", type=int, default=30)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3, help="report runs after the first")
+    parser.add_argument("--clients", type=int, default=8, help="tablets posting /activity")
+    parser.add_argument("--seconds", type=float, default=20)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+    if args.clients > args.mesin:
+        parser.error("--clients can not be more than --mesin, every client is one machine")
+
+    os.environ["DATABASE_URL"] = args.url
+    engine = database.get_engine()
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+    if engine.dialect.name == "sqlite":
+        # Like Postgres, let the report readers and the /activity writers not block each other
+        with engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA journal_mode=WAL")
+
+    begin = time.perf_counter()
+    with database.session_scope() as session:
+        events, rejected = synthetic_factory.generate(
+            session, args.mesin, args.operators, args.days, args.seed
+        )
+        session.execute(
+            models.Tooling.__table__.insert(),
+            [{"id": f"TL-{mesin}", "kode_tooling": f"K{mesin}"} for mesin in range(args.clients)],
+        )
+    elapsed = time.perf_counter() - begin
+    print(f"Generated {events} events ({rejected} rejected) in {elapsed:.1f} s")
+
+    results = {
+        "generate": {"events": events, "rejected": rejected, "per_second": events / elapsed},
+        "reports": _benchmark_reports(args.days, args.repeat),
+    }
+    # The server process opens its own connections
+    engine.dispose()
+    results["endpoints"] = _benchmark_endpoints(args)
+
+    with open(args.output, "w") as f:
+        json.dump(
+            {
+                "revision": _revision(),
+                "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+                "dialect": engine.dialect.name,
+                "python": platform.python_version(),
+                "cpu_count": os.cpu_count(),
+                "config": {
+                    key: value for key, value in vars(args).items() if key not in ("url", "output")
+                },
+                "results": results,
+            },
+            f,
+            indent=2,
+        )
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Fill a database with a synthetic factory: machines, operators and toolings, and days of
+start, stop and downtime events applied through business_logic's state machine, so
+statuses, intervals and the shift rollup are exactly what the tablets would produce.
+
+Machines run in every configured shift and stand still with No Plan outside them.
+Each shift, machines get a different operator, and a tool change follows every
+Tool Preparation downtime. Timestamps are local Jakarta time stored as UTC.
+
+The script drops and recreates every table, so only point it at a scratch database:
+
+    $ python3 benchmarks/synthetic_factory.py --url sqlite:///factory.db --mesin 20 --days 30
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(BASE_DIR)
+
+import business_logic
+import database
+import models
+import report_cache
+import schema
+import shift_calendar
+
+_TIMEZONE = pytz.timezone("Asia/Jakarta")
+START = datetime(2023, 1, 2, 7)  # A Monday, at the start of shift 1
+_TOOLINGS_PER_MESIN = 4
+
+# (category, weight, minimum and maximum minutes)
+_DOWNTIMES = [
+    ("TP : Tool Preparation", 15, 10, 40),
+    ("TS : Tool Setting", 10, 5, 25),
+    ("QC : Quality Check", 20, 3, 15),
+    ("MT : Machine Trouble", 8, 10, 90),
+    ("WM : Waiting Material", 12, 5, 45),
+    ("BT : Break Time", 15, 30, 60),
+    ("BR : Briefing", 5, 10, 20),
+]
+_NO_PLAN = "NP : No Plan"
+
+
+def _is_working(local_time):
+    return (
+        local_time.isoweekday() != 7
+        and shift_calendar.calendar.shift_of(local_time) != shift_calendar._NO_SHIFT
+    )
+
+
+def _next_working(local_time):
+    while not _is_working(local_time):
+        local_time += timedelta(minutes=30)
+    return local_time
+
+
+def _operator_of(local_time, mesin, mesin_count, operator_count):
+    # Operators move to another machine every shift, never two machines at once
+    shift_date, shift = shift_calendar.calendar.shift_date_of(local_time)
+    rotation = ((shift_date - START.date()).days * 3 + shift) * mesin_count
+    return f"OP-{(rotation + mesin) % operator_count}"
+
+
+def _mesin_events(mesin, mesin_count, operator_count, days, rng):
+    """Local-time events of one machine, in order."""
+    events = []
+    local_time, end = START, START + timedelta(days=days)
+    tooling = 0
+    running = stopped_for_no_plan = False
+
+    def add(type, category=None, **fields):
+        events.append(
+            {
+                "type": type,
+                "tooling_id": f"TL-{mesin}-{tooling}",
+                "mesin_id": f"MC-{mesin}",
+                "operator_id": _operator_of(local_time, mesin, mesin_count, operator_count),
+                "category_downtime": category,
+                "timestamp": local_time,
+                **fields,
+            }
+        )
+
+    while local_time < end:
+        if not _is_working(local_time):
+            if running:
+                add("first_stop", _NO_PLAN, output=0)
+            elif events and not stopped_for_no_plan:
+                add("continue_stop", _NO_PLAN)
+            running, stopped_for_no_plan = False, True
+            local_time = _next_working(local_time)
+            continue
+
+        add("start")
+        running, stopped_for_no_plan = True, False
+        minutes = rng.randint(20, 120)
+        local_time += timedelta(minutes=minutes)
+
+        category, _, low, high = rng.choices(_DOWNTIMES, weights=[d[1] for d in _DOWNTIMES])[0]
+        output = minutes * rng.randint(1, 3)
+        add(
+            "first_stop",
+            category,
+            output=output,
+            reject=rng.choice([0, 0, 0, 1, 2]),
+            rework=rng.choice([0, 0, 0, 0, 1]),
+            coil_no=f"C{rng.randint(1000, 9999)}" if rng.random() < 0.3 else "",
+            lot_no=f"L{rng.randint(100, 999)}" if rng.random() < 0.3 else "",
+        )
+        running = False
+        if category.startswith("TP"):
+            tooling = (tooling + 1) % _TOOLINGS_PER_MESIN
+        local_time += timedelta(minutes=rng.randint(low, high))
+
+        if rng.random() < 0.2:
+            category, _, low, high = rng.choice(_DOWNTIMES)
+            add("continue_stop", category)
+            local_time += timedelta(minutes=rng.randint(low, high))
+
+    return events
+
+
+def generate(session, mesin_count, operator_count, days, seed=0):
+    """Create the master data and apply every event. Returns (events, rejected events)."""
+    if operator_count < mesin_count:
+        raise ValueError("Every machine needs its own operator in a shift")
+
+    with session.begin():
+        session.execute(
+            models.Mesin.__table__.insert(),
+            [{"id": f"MC-{i}", "name": f"MC {i}", "tonase": 110} for i in range(mesin_count)],
+        )
+        session.execute(
+            models.Operator.__table__.insert(),
+            [{"id": f"OP-{i}", "name": f"Operator {i}"} for i in range(operator_count)],
+        )
+        session.execute(
+            models.Tooling.__table__.insert(),
+            [
+                {
+                    "id": f"TL-{i}-{tooling}",
+                    "kode_tooling": f"K{i}-{tooling}",
+                    "common_tooling_name": f"Tool {i}-{tooling}",
+                    "std_jam": 100,
+                }
+                for i in range(mesin_count)
+                for tooling in range(_TOOLINGS_PER_MESIN)
+            ],
+        )
+
+    rng = random.Random(seed)
+    events = [
+        event
+        for mesin in range(mesin_count)
+        for event in _mesin_events(mesin, mesin_count, operator_count, days, rng)
+    ]
+    events.sort(key=lambda event: event["timestamp"])
+
+    # One simulated day per batch, the way a day of offline tablet events is replayed
+    rejected = 0
+    day = []
+    for index, event in enumerate(events):
+        event["timestamp"] = _TIMEZONE.localize(event["timestamp"])
+        day.append(schema.ActivityEvent(**event))
+        is_last = index + 1 == len(events)
+        if is_last or events[index + 1]["timestamp"].date() != event["timestamp"].date():
+            results, interval_starts = business_logic.apply_activity_batch(day, session)
+            report_cache.invalidate(*interval_starts)
+            rejected += sum(not is_success for is_success, _ in results)
+            day = []
+    return len(events), rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="sqlite:///synthetic_factory.db")
+    parser.add_argument("--mesin", type=int, default=10)
+    parser.add_argument("--operators", type=int, default=15)
+    parser.add_argument("--days", type=int, default=14)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.url
+    engine = database.get_engine()
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+
+    begin = time.perf_counter()
+    session = database.SessionLocal()
+    try:
+        events, rejected = generate(session, args.mesin, args.operators, args.days, args.seed)
+    finally:
+        session.close()
+    elapsed = time.perf_counter() - begin
+    print(f"{events} events, {rejected} rejected, {events / elapsed:.0f} events/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,33 @@
+import functools
 import logging
-from datetime import timedelta
+from datetime import timedelta, timezone
 
+import sqlalchemy as sa
 from fastapi import HTTPException
+from sqlalchemy.orm import joinedload
 
+import downtime_categories
+import master_cache
 import models
+import rollup
+import schema
+import status_board
 
 
-def is_operator_running(operator_id, session):
-    operator_status = (
-        session.query(models.OperatorStatus)
-        .filter(models.OperatorStatus.id == operator_id)
-        .one_or_none()
-    )
+def is_operator_running(operator_id):
+    operator_status = status_board.snapshot()[1].get(operator_id)
 
     if operator_status is None:
         return False, models.DisplayedStatus.IDLE, "", ""
 
-    if operator_status.status == models.DisplayedStatus.IDLE:
-        return False, operator_status.status, "", ""
+    if operator_status["status"] == models.DisplayedStatus.IDLE:
+        return False, operator_status["status"], "", ""
     else:
         return (
             True,
-            operator_status.status,
-            operator_status.last_tooling_id,
-            operator_status.last_mesin_id,
+            operator_status["status"],
+            operator_status["last_tooling_id"],
+            operator_status["last_mesin_id"],
         )
 
 
@@ -42,7 +46,9 @@ def check_operator(tooling_id, mesin_id, operator_id, session):
             last_mesin_id=mesin_id,
         )
         session.add(operator_status)
+        captured = status_board.capture([], [operator_status], session)
         session.commit()
+        status_board.publish(captured)
         return True, ""
 
     if operator_status.status == models.DisplayedStatus.IDLE:
@@ -89,26 +95,164 @@ def check_mesin(mesin_id, operator_id, session):
     return False, message
 
 
-def start_activity(tooling_id, mesin_id, operator_id, reject, rework, session):
-    # Insert to Start Table
-    start_entity = models.Start(tooling_id=tooling_id, mesin_id=mesin_id, operator_id=operator_id)
-    session.add(start_entity)
-    session.commit()
+def is_valid_activity(tooling_id, mesin_id, operator_id, session):
+    """Whether the mesin, tooling and operator of an activity all exist, from master_cache."""
+    return (
+        master_cache.mesin.get(mesin_id, session) is not None
+        and master_cache.tooling.get(tooling_id, session) is not None
+        and master_cache.operator.get(operator_id, session) is not None
+    )
 
-    # Get current mesin status
+
+def _lock_statuses(mesin_id, operator_ids, session):
+    """
+    Lock the status rows of the machine, of operator_ids and of the machine's last
+    operator until commit, so concurrent events of one machine apply in turn.
+    """
     mesin_status = (
-        session.query(models.MesinStatus).filter(models.MesinStatus.id == mesin_id).one_or_none()
+        session.query(models.MesinStatus)
+        .options(
+            joinedload(models.MesinStatus.last_start, innerjoin=True),
+            joinedload(models.MesinStatus.last_stop, innerjoin=True),
+        )
+        .filter(models.MesinStatus.id == mesin_id)
+        .with_for_update(of=models.MesinStatus)
+        .one_or_none()
+    )
+    if mesin_status is not None:
+        operator_ids = [*operator_ids, mesin_status.last_operator_id]
+
+    operator_statuses = (
+        session.query(models.OperatorStatus)
+        .filter(models.OperatorStatus.id.in_(set(operator_ids)))
+        .order_by(models.OperatorStatus.id)
+        .with_for_update()
+        .all()
+    )
+    return mesin_status, {
+        operator_status.id: operator_status for operator_status in operator_statuses
+    }
+
+
+# A first event of a machine or operator inserts its status row, which could not be
+# locked beforehand; a concurrent first event that inserted it first costs one retry
+_STATUS_INSERT_ATTEMPTS = 2
+
+
+def _apply_locked(mesin_id, operator_ids, apply, session):
+    """
+    Lock the statuses, apply(mesin_status, operator_statuses) and commit. apply returns
+    the machine's status and a result, returned with the captured statuses to publish.
+    When a concurrent first event inserted a status row first, the commit fails on it
+    and everything is applied once more, on top of the row it can now lock.
+    """
+    for attempt in range(1, _STATUS_INSERT_ATTEMPTS + 1):
+        mesin_status, operator_statuses = _lock_statuses(mesin_id, operator_ids, session)
+        mesin_status, result = apply(mesin_status, operator_statuses)
+        captured = status_board.capture([mesin_status], operator_statuses.values(), session)
+        try:
+            session.commit()
+        except sa.exc.IntegrityError:
+            session.rollback()
+            if attempt == _STATUS_INSERT_ATTEMPTS:
+                raise
+            logging.info(f"Status row of mesin {mesin_id} inserted concurrently, retrying")
+            continue
+        return captured, result
+
+
+def _add_event(entity, timestamp, session):
+    # Without a client timestamp, flush to get the server's one back
+    if timestamp is not None:
+        entity.timestamp = timestamp
+    session.add(entity)
+    if timestamp is None:
+        session.flush()
+    return entity
+
+
+def _add_interval(interval, kind, session):
+    """Add an interval, its shift rollup and its production_interval row."""
+    session.add(interval)
+    rollup.record_interval(interval, session)
+
+    is_utility = kind == models.IntervalKind.UTILITY
+    session.add(
+        models.ProductionInterval(
+            kind=kind,
+            mesin_id=interval.mesin_id,
+            operator_id=interval.operator_id,
+            start_operator_id=interval.start_time.operator_id,
+            tooling_id=interval.start_time.tooling_id,
+            start_timestamp=interval.start_time.timestamp,
+            stop_timestamp=interval.stop_time.timestamp,
+            downtime_category_id=(
+                downtime_categories.code_of(downtime_categories.UTILITY)
+                if is_utility
+                else interval.downtime_category_id
+            ),
+            output=interval.output if is_utility else 0,
+            reject=interval.reject,
+            rework=interval.rework,
+            coil_no=interval.coil_no if is_utility else None,
+            lot_no=interval.lot_no if is_utility else None,
+            pack_no=interval.pack_no if is_utility else None,
+        )
+    )
+
+
+def _update_operator_statuses(
+    operator_statuses,
+    old_operator_id,
+    set_old_idle,
+    tooling_id,
+    mesin_id,
+    operator_id,
+    status,
+    session,
+):
+    if set_old_idle and old_operator_id in operator_statuses:
+        operator_statuses[old_operator_id].status = models.DisplayedStatus.IDLE
+
+    operator_status_new = operator_statuses.get(operator_id)
+    if operator_status_new is None:
+        operator_status_new = models.OperatorStatus(id=operator_id)
+        session.add(operator_status_new)
+        operator_statuses[operator_id] = operator_status_new
+    operator_status_new.last_tooling_id = tooling_id
+    operator_status_new.last_mesin_id = mesin_id
+    operator_status_new.status = status
+
+
+def _apply_start(
+    mesin_status,
+    operator_statuses,
+    tooling_id,
+    mesin_id,
+    operator_id,
+    reject,
+    rework,
+    session,
+    timestamp=None,
+):
+    """Returns the machine's status and the start of the interval the event closed."""
+    if mesin_status is not None and mesin_status.status == models.Status.RUNNING:
+        raise HTTPException(status_code=403, detail="Machine is already running")
+
+    # Insert to Start Table
+    start_entity = _add_event(
+        models.Start(tooling_id=tooling_id, mesin_id=mesin_id, operator_id=operator_id),
+        timestamp,
+        session,
     )
+
     if mesin_status is None:
         # Create mesin status, insert last stop 5 seconds before starting
         first_stop_mesin = models.Stop(
             mesin_id=mesin_id,
             timestamp=start_entity.timestamp - timedelta(seconds=5),
-            downtime_category="Object Creation",
+            downtime_category_id=downtime_categories.code_of(downtime_categories.OBJECT_CREATION),
         )
-        session.add(first_stop_mesin)
-        session.commit()
-
         mesin_status = models.MesinStatus(
             id=mesin_id,
             status=models.Status.IDLE,
@@ -119,11 +263,6 @@ def start_activity(tooling_id, mesin_id, operator_id, reject, rework, session):
         )
         session.add(mesin_status)
 
-    if mesin_status.status == models.Status.RUNNING:
-        raise HTTPException(status_code=403, detail="Machine is already running")
-
-    prev_downtime_category = mesin_status.last_stop.downtime_category
-
     # Insert mesin's last downtime
     last_downtime = models.LastDowntimeMesin(
         mesin_id=mesin_id,
@@ -132,39 +271,35 @@ def start_activity(tooling_id, mesin_id, operator_id, reject, rework, session):
         stop_time=start_entity,
         reject=reject,
         rework=rework,
-        downtime_category=prev_downtime_category,
+        downtime_category_id=mesin_status.last_stop.downtime_category_id,
     )
-    session.add(last_downtime)
-    session.commit()
-
-    if mesin_status.last_operator_id != operator_id:
-        operator_status_old = (
-            session.query(models.OperatorStatus)
-            .filter(models.OperatorStatus.id == mesin_status.last_operator_id)
-            .one_or_none()
-        )
-        operator_status_old.status = models.DisplayedStatus.IDLE
+    _add_interval(last_downtime, models.IntervalKind.LAST_DOWNTIME, session)
 
-    operator_status_new = (
-        session.query(models.OperatorStatus)
-        .filter(models.OperatorStatus.id == operator_id)
-        .one_or_none()
+    _update_operator_statuses(
+        operator_statuses,
+        old_operator_id=mesin_status.last_operator_id,
+        set_old_idle=mesin_status.last_operator_id != operator_id,
+        tooling_id=tooling_id,
+        mesin_id=mesin_id,
+        operator_id=operator_id,
+        status=models.DisplayedStatus.RUNNING,
+        session=session,
     )
-    operator_status_new.last_tooling_id = tooling_id
-    operator_status_new.last_mesin_id = mesin_id
-    operator_status_new.status = models.DisplayedStatus.RUNNING
 
     # Update mesin's status and last start
     mesin_status.status = models.Status.RUNNING
     mesin_status.last_start = start_entity
     mesin_status.last_tooling_id = tooling_id
     mesin_status.last_operator_id = operator_id
-    mesin_status.category_downtime = "U : Utility"
+    mesin_status.category_downtime_id = downtime_categories.code_of(downtime_categories.UTILITY)
     mesin_status.displayed_status = models.DisplayedStatus.RUNNING
-    session.commit()
 
+    return mesin_status, last_downtime.start_time.timestamp
 
-def first_stop_activity(
+
+def _apply_first_stop(
+    mesin_status,
+    operator_statuses,
     tooling_id,
     mesin_id,
     operator_id,
@@ -176,32 +311,32 @@ def first_stop_activity(
     coil_no="",
     lot_no="",
     pack_no="",
+    timestamp=None,
 ):
-    logging.info("First stop activity")
+    """Returns the machine's status and the start of the interval the event closed."""
+    if mesin_status is not None and mesin_status.status != models.Status.RUNNING:
+        raise HTTPException(status_code=403, detail="Machine is already idle")
+    downtime_category_id = downtime_categories.code_of(downtime_category)
+
     # Insert to Stop Table
-    stop_entity = models.Stop(
-        tooling_id=tooling_id,
-        mesin_id=mesin_id,
-        operator_id=operator_id,
-        output=output,
-        downtime_category=downtime_category,
+    stop_entity = _add_event(
+        models.Stop(
+            tooling_id=tooling_id,
+            mesin_id=mesin_id,
+            operator_id=operator_id,
+            output=output,
+            downtime_category_id=downtime_category_id,
+        ),
+        timestamp,
+        session,
     )
-    session.add(stop_entity)
-    session.commit()
 
-    # Get current mesin status
-    mesin_status = (
-        session.query(models.MesinStatus).filter(models.MesinStatus.id == mesin_id).one_or_none()
-    )
     if mesin_status is None:
         logging.info(f"Creating mesin status {mesin_id}")
         # Create mesin status, insert last start 5 seconds before stopping
         first_start_mesin = models.Start(
             mesin_id=mesin_id, timestamp=stop_entity.timestamp - timedelta(seconds=5)
         )
-        session.add(first_start_mesin)
-        session.commit()
-
         mesin_status = models.MesinStatus(
             id=mesin_id,
             status=models.Status.RUNNING,
@@ -212,9 +347,6 @@ def first_stop_activity(
         )
         session.add(mesin_status)
 
-    if mesin_status.status != models.Status.RUNNING:
-        raise HTTPException(status_code=403, detail="Machine is already idle")
-
     # Insert mesin's utility table
     utility = models.UtilityMesin(
         mesin_id=mesin_id,
@@ -228,68 +360,70 @@ def first_stop_activity(
         lot_no=lot_no,
         pack_no=pack_no,
     )
-    session.add(utility)
-    session.commit()
-
-    displayed_status = get_displayed_status(downtime_category)
-
-    if (mesin_status.last_operator_id != operator_id) or (
-        mesin_status.last_operator_id == operator_id
-        and displayed_status == models.DisplayedStatus.IDLE
-    ):
-        operator_status_old = (
-            session.query(models.OperatorStatus)
-            .filter(models.OperatorStatus.id == mesin_status.last_operator_id)
-            .one_or_none()
-        )
-        operator_status_old.status = models.DisplayedStatus.IDLE
+    _add_interval(utility, models.IntervalKind.UTILITY, session)
 
-    operator_status_new = (
-        session.query(models.OperatorStatus)
-        .filter(models.OperatorStatus.id == operator_id)
-        .one_or_none()
+    displayed_status = downtime_categories.displayed_status_of(downtime_category_id)
+
+    _update_operator_statuses(
+        operator_statuses,
+        old_operator_id=mesin_status.last_operator_id,
+        set_old_idle=(
+            mesin_status.last_operator_id != operator_id
+            or displayed_status == models.DisplayedStatus.IDLE
+        ),
+        tooling_id=tooling_id,
+        mesin_id=mesin_id,
+        operator_id=operator_id,
+        status=displayed_status,
+        session=session,
     )
-    operator_status_new.last_tooling_id = tooling_id
-    operator_status_new.last_mesin_id = mesin_id
-    operator_status_new.status = displayed_status
 
     # Update mesin's status and last stop
-    mesin_status.status = update_downtime_mesin_status(downtime_category)
+    mesin_status.status = downtime_categories.status_of(downtime_category_id)
     mesin_status.last_stop = stop_entity
     mesin_status.last_tooling_id = tooling_id
     mesin_status.last_operator_id = operator_id
-    mesin_status.category_downtime = downtime_category
+    mesin_status.category_downtime_id = downtime_category_id
 
     mesin_status.displayed_status = displayed_status
 
-    session.commit()
+    return mesin_status, utility.start_time.timestamp
 
 
-def continue_stop_activity(
-    tooling_id, mesin_id, operator_id, downtime_category, reject, rework, session
+def _apply_continue_stop(
+    mesin_status,
+    operator_statuses,
+    tooling_id,
+    mesin_id,
+    operator_id,
+    downtime_category,
+    reject,
+    rework,
+    session,
+    timestamp=None,
 ):
+    """Returns the machine's status and the start of the interval the event closed."""
+    if mesin_status is not None and mesin_status.status == models.Status.RUNNING:
+        raise HTTPException(status_code=403, detail="Machine is not running")
+    downtime_category_id = downtime_categories.code_of(downtime_category)
+
     # Insert to Stop Table
-    stop_entity = models.Stop(
-        tooling_id=tooling_id,
-        mesin_id=mesin_id,
-        operator_id=operator_id,
-        downtime_category=downtime_category,
+    stop_entity = _add_event(
+        models.Stop(
+            tooling_id=tooling_id,
+            mesin_id=mesin_id,
+            operator_id=operator_id,
+            downtime_category_id=downtime_category_id,
+        ),
+        timestamp,
+        session,
     )
-    session.add(stop_entity)
-    session.commit()
 
-    # Get current mesin status
-    mesin_status = (
-        session.query(models.MesinStatus).filter(models.MesinStatus.id == mesin_id).one_or_none()
-    )
     if mesin_status is None:
         # Create mesin status, insert last start 5 seconds before stopping
         first_start_mesin = models.Start(
             mesin_id=mesin_id, timestamp=stop_entity.timestamp - timedelta(seconds=5)
         )
-        session.add(first_start_mesin)
-        session.commit()
-
         mesin_status = models.MesinStatus(
             id=mesin_id,
             status=models.Status.IDLE,
@@ -300,11 +434,6 @@ def continue_stop_activity(
         )
         session.add(mesin_status)
 
-    if mesin_status.status == models.Status.RUNNING:
-        raise HTTPException(status_code=403, detail="Machine is not running")
-
-    prev_downtime_category = mesin_status.last_stop.downtime_category
-
     # Insert mesin's continued downtime table
     continued_downtime = models.ContinuedDowntimeMesin(
         mesin_id=mesin_id,
@@ -313,61 +442,261 @@ def continue_stop_activity(
         stop_time=stop_entity,
         reject=reject,
         rework=rework,
-        downtime_category=prev_downtime_category,
+        downtime_category_id=mesin_status.last_stop.downtime_category_id,
     )
-    session.add(continued_downtime)
-    session.commit()
-
-    displayed_status = get_displayed_status(downtime_category)
-
-    if (mesin_status.last_operator_id != operator_id) or (
-        mesin_status.last_operator_id == operator_id
-        and displayed_status == models.DisplayedStatus.IDLE
-    ):
-        operator_status_old = (
-            session.query(models.OperatorStatus)
-            .filter(models.OperatorStatus.id == mesin_status.last_operator_id)
-            .one_or_none()
-        )
-        operator_status_old.status = models.DisplayedStatus.IDLE
+    _add_interval(continued_downtime, models.IntervalKind.CONTINUED_DOWNTIME, session)
 
-    operator_status_new = (
-        session.query(models.OperatorStatus)
-        .filter(models.OperatorStatus.id == operator_id)
-        .one_or_none()
+    displayed_status = downtime_categories.displayed_status_of(downtime_category_id)
+
+    _update_operator_statuses(
+        operator_statuses,
+        old_operator_id=mesin_status.last_operator_id,
+        set_old_idle=(
+            mesin_status.last_operator_id != operator_id
+            or displayed_status == models.DisplayedStatus.IDLE
+        ),
+        tooling_id=tooling_id,
+        mesin_id=mesin_id,
+        operator_id=operator_id,
+        status=displayed_status,
+        session=session,
     )
-    operator_status_new.last_tooling_id = tooling_id
-    operator_status_new.last_mesin_id = mesin_id
-    operator_status_new.status = displayed_status
 
     # Update mesin's status and last stop
-    mesin_status.status = update_downtime_mesin_status(downtime_category)
+    mesin_status.status = downtime_categories.status_of(downtime_category_id)
     mesin_status.last_stop = stop_entity
     mesin_status.last_tooling_id = tooling_id
     mesin_status.last_operator_id = operator_id
-    mesin_status.category_downtime = downtime_category
+    mesin_status.category_downtime_id = downtime_category_id
 
     mesin_status.displayed_status = displayed_status
 
-    session.commit()
+    return mesin_status, continued_downtime.start_time.timestamp
 
 
-def get_downtime_category(downtime_category):
-    return downtime_category[:2].upper()
+# The activity entry points return the start of each interval they wrote, whose report
+# tile the caller drops with report_cache.invalidate, a file operation kept out of here
+def start_activity(tooling_id, mesin_id, operator_id, reject, rework, session):
+    downtime_categories.resolve(
+        [downtime_categories.UTILITY, downtime_categories.OBJECT_CREATION], session
+    )
+    captured, interval_start = _apply_locked(
+        mesin_id,
+        [operator_id],
+        functools.partial(
+            _apply_start,
+            tooling_id=tooling_id,
+            mesin_id=mesin_id,
+            operator_id=operator_id,
+            reject=reject,
+            rework=rework,
+            session=session,
+        ),
+        session,
+    )
+    status_board.publish(captured)
+    return interval_start
 
 
-def update_downtime_mesin_status(downtime_category):
-    return (
-        models.Status.SETUP
-        if get_downtime_category(downtime_category) in ["TP", "TS", "TL"]
-        else models.Status.IDLE
+def first_stop_activity(
+    tooling_id,
+    mesin_id,
+    operator_id,
+    output,
+    downtime_category,
+    reject,
+    rework,
+    session,
+    coil_no="",
+    lot_no="",
+    pack_no="",
+):
+    logging.info("First stop activity")
+    downtime_categories.resolve([downtime_category, downtime_categories.UTILITY], session)
+    captured, interval_start = _apply_locked(
+        mesin_id,
+        [operator_id],
+        functools.partial(
+            _apply_first_stop,
+            tooling_id=tooling_id,
+            mesin_id=mesin_id,
+            operator_id=operator_id,
+            output=output,
+            downtime_category=downtime_category,
+            reject=reject,
+            rework=rework,
+            session=session,
+            coil_no=coil_no,
+            lot_no=lot_no,
+            pack_no=pack_no,
+        ),
+        session,
     )
+    status_board.publish(captured)
+    return interval_start
 
 
-def get_displayed_status(downtime_category):
-    downtime_category_initial = get_downtime_category(downtime_category)
-    return (
-        models.DisplayedStatus.IDLE
-        if downtime_category_initial in ["NP", "BT", "BR"]
-        else models.DisplayedStatus.DOWNTIME
+def continue_stop_activity(
+    tooling_id, mesin_id, operator_id, downtime_category, reject, rework, session
+):
+    downtime_categories.resolve([downtime_category], session)
+    captured, interval_start = _apply_locked(
+        mesin_id,
+        [operator_id],
+        functools.partial(
+            _apply_continue_stop,
+            tooling_id=tooling_id,
+            mesin_id=mesin_id,
+            operator_id=operator_id,
+            downtime_category=downtime_category,
+            reject=reject,
+            rework=rework,
+            session=session,
+        ),
+        session,
     )
+    status_board.publish(captured)
+    return interval_start
+
+
+def _naive_utc(timestamp):
+    # Client timestamps may carry an offset, SQLite returns naive UTC ones
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+def _apply_event(event, mesin_status, operator_statuses, session):
+    timestamp = event.timestamp
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc)
+
+    # A stale replay would close an interval that stops before it starts
+    if mesin_status is not None:
+        last_event = max(
+            _naive_utc(mesin_status.last_start.timestamp),
+            _naive_utc(mesin_status.last_stop.timestamp),
+        )
+        if _naive_utc(timestamp) < last_event:
+            raise HTTPException(
+                409, f"Event is older than the machine's last event at {last_event} UTC"
+            )
+
+    match event.type:
+        case schema.ActivityType.START:
+            return _apply_start(
+                mesin_status,
+                operator_statuses,
+                tooling_id=event.tooling_id,
+                mesin_id=event.mesin_id,
+                operator_id=event.operator_id,
+                reject=event.reject,
+                rework=event.rework,
+                session=session,
+                timestamp=timestamp,
+            )
+
+        case schema.ActivityType.FIRST_STOP:
+            return _apply_first_stop(
+                mesin_status,
+                operator_statuses,
+                tooling_id=event.tooling_id,
+                mesin_id=event.mesin_id,
+                operator_id=event.operator_id,
+                output=event.output,
+                downtime_category=event.category_downtime,
+                reject=event.reject,
+                rework=event.rework,
+                session=session,
+                coil_no=event.coil_no,
+                lot_no=event.lot_no,
+                pack_no=event.pack_no,
+                timestamp=timestamp,
+            )
+
+        case schema.ActivityType.CONTINUE_STOP:
+            return _apply_continue_stop(
+                mesin_status,
+                operator_statuses,
+                tooling_id=event.tooling_id,
+                mesin_id=event.mesin_id,
+                operator_id=event.operator_id,
+                downtime_category=event.category_downtime,
+                reject=event.reject,
+                rework=event.rework,
+                session=session,
+                timestamp=timestamp,
+            )
+        case _:
+            raise HTTPException(404, "Invalid activity type")
+
+
+def apply_activity_batch(events, session):
+    """
+    Apply a list of schema.ActivityEvent with one transaction per machine, each
+    machine's events in timestamp order. Returns (isSuccess, errorMessage) per event in
+    input order and the starts of the intervals written. A rejected event, e.g. one
+    older than the machine's last event, is skipped and the machine's following events
+    still apply on top of its last state.
+    """
+    results = [(False, "Invalid input")] * len(events)
+    applied_starts = []
+    mesin_ids = master_cache.mesin.get_many([event.mesin_id for event in events], session)
+    tooling_ids = master_cache.tooling.get_many([event.tooling_id for event in events], session)
+    operator_ids = master_cache.operator.get_many(
+        [event.operator_id for event in events], session
+    )
+
+    events_by_mesin = {}
+    categories = {downtime_categories.UTILITY, downtime_categories.OBJECT_CREATION}
+    for index, event in enumerate(events):
+        if (
+            event.mesin_id in mesin_ids
+            and event.tooling_id in tooling_ids
+            and event.operator_id in operator_ids
+        ):
+            events_by_mesin.setdefault(event.mesin_id, []).append(index)
+            if event.type != schema.ActivityType.START:
+                categories.add(event.category_downtime)
+    downtime_categories.resolve(categories, session)
+    for indexes in events_by_mesin.values():
+        # As the tablet recorded them, events with the same timestamp in input order
+        indexes.sort(key=lambda index: _naive_utc(events[index].timestamp))
+
+    def apply_events(indexes, mesin_status, operator_statuses):
+        interval_starts = []
+        for index in indexes:
+            try:
+                mesin_status, interval_start = _apply_event(
+                    events[index], mesin_status, operator_statuses, session
+                )
+            except HTTPException as exception:
+                results[index] = (False, exception.detail)
+                continue
+            interval_starts.append(interval_start)
+            results[index] = (True, "")
+        return mesin_status, interval_starts
+
+    # The machine with the latest event goes last, so it leaves the final operator statuses
+    for mesin_id, indexes in sorted(events_by_mesin.items(), key=lambda item: max(item[1])):
+        # Inserts of the whole machine go out together in its commit
+        try:
+            captured, interval_starts = _apply_locked(
+                mesin_id,
+                [events[index].operator_id for index in indexes],
+                functools.partial(apply_events, indexes),
+                session,
+            )
+        except sa.exc.SQLAlchemyError as exception:
+            logging.exception(f"Failed to apply activity batch of mesin {mesin_id}")
+            session.rollback()
+            for index in indexes:
+                if results[index][0]:
+                    results[index] = (False, str(exception.__cause__ or exception))
+            continue
+
+        status_board.publish(captured)
+        applied_starts.extend(interval_starts)
+
+    return results, applied_starts
+
@@ -1,26 +1,175 @@
+import contextlib
 import logging
 import os
+import threading
+import time
 
 import fastapi
 import sqlalchemy
+import sqlalchemy.event
 import sqlalchemy.orm
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+"""
+One engine per process for sync code and one for async endpoints, created on first
+use and shared by the API, reports, status board, ingestion and scripts. Pool sizing
+comes from DB_POOL_* variables; every pool counts its checkouts so /database/pool
+shows how close the process is to the connection limit.
+"""
+# asyncio driver used in place of the configured one for each backend
+_ASYNC_DRIVERS = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", 1800))
+_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+_lock = threading.Lock()
+_engines = {}  # "sync" or "async" -> engine
+_metrics = {}  # "sync" or "async" -> _PoolMetrics
+
+
+class _PoolMetrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked_out = 0
+        self.max_checked_out = 0
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.checkout_seconds = 0.0  # total time connections were held
+
+    def attach(self, pool):
+        sqlalchemy.event.listen(pool, "connect", self._on_connect)
+        sqlalchemy.event.listen(pool, "checkout", self._on_checkout)
+        sqlalchemy.event.listen(pool, "checkin", self._on_checkin)
+        sqlalchemy.event.listen(pool, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.monotonic()
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.max_checked_out = max(self.max_checked_out, self.checked_out)
+
+    def _on_checkin(self, dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is None:
+            return
+        with self._lock:
+            self.checked_out -= 1
+            self.checkout_seconds += time.monotonic() - checked_out_at
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def stats(self, pool):
+        with self._lock:
+            stats = {
+                "pool": pool.status(),
+                "checked_out": self.checked_out,
+                "max_checked_out": self.max_checked_out,
+                "checkouts": self.checkouts,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "mean_checkout_ms": (
+                    round(self.checkout_seconds / self.checkouts * 1000, 2)
+                    if self.checkouts
+                    else 0.0
+                ),
+            }
+        # Only QueuePool has a fixed size, SQLite files use NullPool or SingletonThreadPool
+        if hasattr(pool, "size"):
+            stats["size"] = pool.size()
+            stats["overflow"] = pool.overflow()
+        return stats
+
+
+def _engine_options(url):
+    options = {"pool_pre_ping": _POOL_PRE_PING, "pool_recycle": _POOL_RECYCLE}
+    if url.get_backend_name() != "sqlite":
+        options.update(
+            pool_size=_POOL_SIZE, max_overflow=_MAX_OVERFLOW, pool_timeout=_POOL_TIMEOUT
+        )
+    return options
+
+
+def _register(kind, create):
+    with _lock:
+        if kind not in _engines:
+            engine = create()
+            metrics = _PoolMetrics()
+            metrics.attach(engine.pool if kind == "sync" else engine.sync_engine.pool)
+            _engines[kind], _metrics[kind] = engine, metrics
+        return _engines[kind]
 
 
 def get_engine() -> sqlalchemy.engine.Engine:
-    logging.info("Connecting to %s", os.environ["DATABASE_URL"])
-    return sqlalchemy.create_engine(os.environ["DATABASE_URL"])
+    def create():
+        url = sqlalchemy.engine.make_url(os.environ["DATABASE_URL"])
+        logging.info("Connecting to %s", url.render_as_string(hide_password=True))
+        return sqlalchemy.create_engine(url, **_engine_options(url))
+
+    return _register("sync", create)
+
+
+def get_async_engine() -> sqlalchemy.ext.asyncio.AsyncEngine:
+    def create():
+        url = sqlalchemy.engine.make_url(os.environ["DATABASE_URL"])
+        backend = url.get_backend_name()
+        url = url.set(drivername=f"{backend}+{_ASYNC_DRIVERS[backend]}")
+        return create_async_engine(url, **_engine_options(url))
+
+    return _register("async", create)
+
 
+def pool_stats():
+    with _lock:
+        engines, metrics = dict(_engines), dict(_metrics)
+    return {
+        kind: metrics[kind].stats(engine.pool if kind == "sync" else engine.sync_engine.pool)
+        for kind, engine in engines.items()
+    }
 
-SessionLocal = sqlalchemy.orm.sessionmaker(autocommit=False, autoflush=False)
-_is_bound = False
 
+class _LazySessionMaker(sqlalchemy.orm.sessionmaker):
+    """sessionmaker bound to the shared engine on first use, so importing opens nothing."""
 
-# Helper function to get database session
+    def __init__(self, get_bind, **kwargs):
+        super().__init__(**kwargs)
+        self._get_bind = get_bind
+
+    def __call__(self, **local_kw):
+        if self.kw.get("bind") is None:
+            self.configure(bind=self._get_bind())
+        return super().__call__(**local_kw)
+
+
+SessionLocal = _LazySessionMaker(get_engine, autocommit=False, autoflush=False)
+
+
+@contextlib.contextmanager
+def session_scope():
+    """Session for scripts and background work, committed on success, rolled back on error."""
+    session = SessionLocal()
+    try:
+        yield session
+        session.commit()
+    except BaseException:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+# Helper function to get database session, one per request and closed when it ends
 def _get_session():
-    global _is_bound  # pylint: disable=global-statement
-    if not _is_bound:
-        _is_bound = True
-        SessionLocal.configure(bind=get_engine())
     session = SessionLocal()
     try:
         yield session
@@ -29,3 +178,17 @@ def _get_session():
 
 
 Sessioner = fastapi.Depends(_get_session)
+
+
+AsyncSessionLocal = _LazySessionMaker(
+    get_async_engine, class_=AsyncSession, autocommit=False, autoflush=False
+)
+
+
+# Async session, sync code such as business_logic runs on it through session.run_sync
+async def _get_async_session():
+    async with AsyncSessionLocal() as session:
+        yield session
+
+
+AsyncSessioner = fastapi.Depends(_get_async_session)
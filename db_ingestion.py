@@ -1,13 +1,28 @@
+import contextlib
 import csv
+import io
 import os.path
 
-from sqlalchemy.orm import sessionmaker
+import sqlalchemy as sa
+from sqlalchemy.dialects import sqlite
 
 import database
+import master_cache
 import models
-
-
-session = sessionmaker(autocommit=False, autoflush=False, bind=database.get_engine())()
+import report_cache
+
+"""
+Master data ingestion. Each file is read once, one row at a time, and every row is
+handed to the extractor of each model the file holds. Rows are upserted in batches:
+new ids are inserted, rows whose columns differ from the database are updated and the
+rest are left alone. On Postgres each batch is COPYed into a staging table and
+upserted in one statement. Rows an extractor cannot read are reported with their line.
+"""
+_BATCH_SIZE = int(os.environ.get("INGESTION_BATCH_SIZE", 5000))
+# NULL marker for COPY, so an empty string stays an empty string
+_NULL = "\\N"
+_SQLITE_MAX_PARAMETERS = 999
+_MAX_REPORTED_ERRORS = 100
 
 
 def tooling_not_null(i, offset):
@@ -21,19 +36,17 @@ def get_tooling_id(i, offset):
 def extract_tooling(i, offset):
     tooling_id = get_tooling_id(i, offset)
     if tooling_not_null(i, offset):
-        return models.Tooling(
-            **{
-                "id": tooling_id,
-                "customer": i[2 + offset],
-                "part_no": i[3 + offset],
-                "part_name": i[4 + offset],
-                "child_part_name": i[5 + offset],
-                "kode_tooling": i[6 + offset],
-                "common_tooling_name": i[7 + offset],
-                "proses": i[8 + offset],
-                "std_jam": int("".join(filter(str.isalnum, i[9 + offset]))),
-            }
-        )
+        return {
+            "id": tooling_id,
+            "customer": i[2 + offset],
+            "part_no": i[3 + offset],
+            "part_name": i[4 + offset],
+            "child_part_name": i[5 + offset],
+            "kode_tooling": i[6 + offset],
+            "common_tooling_name": i[7 + offset],
+            "proses": i[8 + offset],
+            "std_jam": int("".join(filter(str.isalnum, i[9 + offset]))),
+        }
     return None
 
 
@@ -48,13 +61,11 @@ def get_mesin_id(i, offset):
 def extract_mesin(i, offset):
     mesin_id = get_mesin_id(i, offset)
     if mesin_not_null(i, offset):
-        return models.Mesin(
-            **{
-                "id": mesin_id,
-                "name": i[0 + offset],
-                "tonase": int("".join(filter(str.isalnum, i[1]))),
-            }
-        )
+        return {
+            "id": mesin_id,
+            "name": i[0 + offset],
+            "tonase": int("".join(filter(str.isalnum, i[1]))),
+        }
     return None
 
 
@@ -69,62 +80,222 @@ def get_operator_id(i, offset):
 def extract_operator(i, offset):
     operator_id = get_operator_id(i, offset)
     if operator_not_null(i, offset):
-        return models.Operator(**{"id": operator_id, "name": i[0 + offset].title()})
+        return {"id": operator_id, "name": i[0 + offset].title()}
     return None
 
 
-def import_data(filename, model, get_id, extract_data, data_not_null, offset):
-    if not os.path.isfile(filename):
-        print(f"{filename} file not found")
-        return
-
+@contextlib.contextmanager
+def _open_csv(filename):
+    """
+    Sniff the ; or , dialect from the first line once, then give the header row and an
+    iterator of (line number, row) over the rest, read one row at a time.
+    """
     with open(filename, newline="") as csvfile:
         try:
             dialect = csv.Sniffer().sniff(csvfile.readline(), delimiters=";,")
-            csvfile.seek(0)
-            csvreader = list(csv.reader(csvfile, dialect))
-        except:
-            csvreader = list(csv.reader(csvfile, delimiter=","))
-        all_data_id = [data.id for data in session.query(model).distinct()]
-        data_to_input = {
-            id: extract_data(i, offset)
-            for i in csvreader[1:]
-            if (data_not_null(i, offset) and (id := get_id(i, offset)) not in all_data_id)
+        except csv.Error:
+            dialect = csv.excel
+        csvfile.seek(0)
+        csvreader = csv.reader(csvfile, dialect)
+        header = next(csvreader, [])
+        yield header, ((csvreader.line_num, row) for row in csvreader)
+
+
+class _Upserter:
+    """
+    Collects extracted rows of one model and upserts them a batch at a time. Counts are
+    of distinct ids: an id inserted by one batch and updated by a later one is inserted.
+    """
+
+    def __init__(self, model, session):
+        self._table = model.__table__
+        self._session = session
+        self._upsert = _UPSERTS[session.get_bind().dialect.name]
+        self._batch = {}
+        self._ids = set()
+        self._inserted = set()
+        self._updated = set()
+        self.failed = 0
+
+    def add(self, id, row):
+        self._batch[id] = row  # A later row of the same id wins, as it always has
+        if len(self._batch) >= _BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self._batch:
+            return
+        inserted, updated = self._upsert(self._table, self._batch, self._session)
+        self._ids.update(self._batch)
+        self._inserted.update(inserted)
+        self._updated.update(updated)
+        self._batch = {}
+
+    @property
+    def counts(self):
+        updated = self._updated - self._inserted
+        return {
+            "inserted": len(self._inserted),
+            "updated": len(updated),
+            "unchanged": len(self._ids) - len(self._inserted) - len(updated),
+            "failed": self.failed,
         }
-        session.add_all(list(data_to_input.values()))
 
 
-def import_tooling(filename, offset=0):
-    import_data(
-        filename=filename,
-        model=models.Tooling,
-        get_id=get_tooling_id,
-        extract_data=extract_tooling,
-        data_not_null=tooling_not_null,
-        offset=offset,
+def _upsert_sqlite(table, batch, session):
+    """
+    Diff the batch against its existing rows, then upsert only new and changed rows.
+    Returns the inserted and the updated ids.
+    """
+    columns = list(next(iter(batch.values())))
+    query = sa.select(*[table.c[column] for column in columns])
+    ids = list(batch)
+    existing = {}
+    # Older SQLite builds allow 999 bound parameters per statement
+    for begin in range(0, len(ids), _SQLITE_MAX_PARAMETERS):
+        chunk = ids[begin : begin + _SQLITE_MAX_PARAMETERS]
+        for row in session.execute(query.where(table.c.id.in_(chunk))):
+            existing[row.id] = dict(row._mapping)
+    inserted = [id for id in batch if id not in existing]
+    updated = [id for id, row in batch.items() if id in existing and existing[id] != row]
+
+    if inserted or updated:
+        statement = sqlite.insert(table)
+        session.execute(
+            statement.on_conflict_do_update(
+                index_elements=["id"],
+                set_={
+                    **{column: statement.excluded[column] for column in columns if column != "id"},
+                    "time_updated": sa.func.now(),
+                },
+            ),
+            [batch[id] for id in inserted + updated],
+        )
+    return inserted, updated
+
+
+def _upsert_postgresql(table, batch, session):
+    """
+    COPY the batch into a staging table, then upsert it in one statement.
+    Returns the inserted and the updated ids.
+    """
+    columns = list(next(iter(batch.values())))
+    staging = f"staging_{table.name}"
+    session.execute(
+        sa.text(
+            f"CREATE TEMPORARY TABLE IF NOT EXISTS {staging} "
+            f"(LIKE {table.name} INCLUDING DEFAULTS) ON COMMIT DROP"
+        )
+    )
+    session.execute(sa.text(f"TRUNCATE {staging}"))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in batch.values():
+        writer.writerow([_NULL if row[column] is None else row[column] for column in columns])
+    buffer.seek(0)
+    column_list = ", ".join(columns)
+    cursor = session.connection().connection.cursor()
+    cursor.copy_expert(
+        f"COPY {staging} ({column_list}) FROM STDIN WITH (FORMAT csv, NULL '{_NULL}')", buffer
+    )
+
+    changes = [column for column in columns if column != "id"]
+    assignments = ", ".join(f"{column} = EXCLUDED.{column}" for column in changes)
+    current = ", ".join(f"{table.name}.{column}" for column in changes)
+    excluded = ", ".join(f"EXCLUDED.{column}" for column in changes)
+    # xmax is 0 only on freshly inserted rows, unchanged rows are not returned at all
+    result = session.execute(
+        sa.text(
+            f"INSERT INTO {table.name} ({column_list}) SELECT {column_list} FROM {staging} "
+            f"ON CONFLICT (id) DO UPDATE SET {assignments}, time_updated = now() "
+            f"WHERE ({current}) IS DISTINCT FROM ({excluded}) "
+            "RETURNING id, xmax = 0"
+        )
     )
+    inserted, updated = [], []
+    for id, is_inserted in result:
+        (inserted if is_inserted else updated).append(id)
+    return inserted, updated
 
 
-def import_mesin(filename, offset=0):
-    import_data(
-        filename=filename,
-        model=models.Mesin,
-        get_id=get_mesin_id,
-        extract_data=extract_mesin,
-        data_not_null=mesin_not_null,
-        offset=offset,
-    )
+_UPSERTS = {"postgresql": _upsert_postgresql, "sqlite": _upsert_sqlite}
 
+# name -> (model, get_id, extract_data, data_not_null)
+_MODELS = {
+    "tooling": (models.Tooling, get_tooling_id, extract_tooling, tooling_not_null),
+    "mesin": (models.Mesin, get_mesin_id, extract_mesin, mesin_not_null),
+    "operator": (models.Operator, get_operator_id, extract_operator, operator_not_null),
+}
 
-def import_operator(filename, offset=0):
-    import_data(
-        filename=filename,
-        model=models.Operator,
-        get_id=get_operator_id,
-        extract_data=extract_operator,
-        data_not_null=operator_not_null,
-        offset=offset,
-    )
+
+def _empty_summary():
+    return {"counts": {}, "errors": []}
+
+
+def _merge_summary(summary, other):
+    for name, counts in other["counts"].items():
+        total = summary["counts"].setdefault(name, dict.fromkeys(counts, 0))
+        for key, count in counts.items():
+            total[key] += count
+    summary["errors"].extend(other["errors"][: _MAX_REPORTED_ERRORS - len(summary["errors"])])
+    return summary
+
+
+def _import_rows(filename, rows, targets, session):
+    """
+    Hand every row to the extractor of each (model name, column offset) target in a
+    single pass. A row a target cannot read is reported and skipped for that target.
+    """
+    upserters = {name: _Upserter(_MODELS[name][0], session) for name, _ in targets}
+    summary = _empty_summary()
+    for line, i in rows:
+        for name, offset in targets:
+            _, get_id, extract_data, data_not_null = _MODELS[name]
+            try:
+                if data_not_null(i, offset):
+                    upserters[name].add(get_id(i, offset), extract_data(i, offset))
+            except (IndexError, ValueError) as exception:
+                upserters[name].failed += 1
+                if len(summary["errors"]) < _MAX_REPORTED_ERRORS:
+                    summary["errors"].append(
+                        {"file": filename, "line": line, "model": name, "error": str(exception)}
+                    )
+
+    for name, upserter in upserters.items():
+        upserter.flush()
+        summary["counts"][name] = upserter.counts
+    return summary
+
+
+def import_data(filename, targets, session, header=None):
+    """
+    Insert new rows of filename and update the changed ones for each (model name,
+    column offset) target, reading the file once. Returns the inserted, updated,
+    unchanged and failed counts per model with the first errors, None when the
+    header is not the expected one.
+    """
+    if not os.path.isfile(filename):
+        print(f"{filename} file not found")
+        return _empty_summary()
+
+    with _open_csv(filename) as (file_header, rows):
+        if header is not None and list(map(str.strip, file_header)) != header:
+            print("Failed to read header")
+            return None
+        return _import_rows(filename, rows, targets, session)
+
+
+def import_tooling(filename, session, offset=0):
+    return import_data(filename, [("tooling", offset)], session)
+
+
+def import_mesin(filename, session, offset=0):
+    return import_data(filename, [("mesin", offset)], session)
+
+
+def import_operator(filename, session, offset=0):
+    return import_data(filename, [("operator", offset)], session)
 
 
 def import_to_db(filename):
@@ -141,35 +312,32 @@ def import_to_db(filename):
         "STD Jam (Pcs)",
         "Operator",
     ]
-    if os.path.isfile(filename):
-        with open(filename, newline="") as csvfile:
-            try:
-                dialect = csv.Sniffer().sniff(csvfile.readline(), delimiters=";,")
-                csvfile.seek(0)
-                csvreader = list(csv.reader(csvfile, dialect))
-            except:
-                csvreader = list(csv.reader(csvfile, delimiter=","))
-
-            if list(map(str.strip, csvreader[0])) != header:
-                print("Failed to read header")
-                return
-
-    # Import Tooling Data
-    import_tooling(filename)
-
-    # Import Mesin
-    import_mesin(filename)
-
-    # Import Operator Data
-    import_operator(filename, offset=10)
+    with database.session_scope() as session:
+        # Tooling, Mesin and Operator data all come from one pass over the file
+        summary = import_data(
+            filename, [("tooling", 0), ("mesin", 0), ("operator", 10)], session, header=header
+        )
+        if summary is None:
+            return None
 
-    session.commit()
+        session.commit()
 
-    import_mesin("db_mesin.csv")
-    import_operator("db_operator.csv")
-    session.commit()
+        _merge_summary(summary, import_mesin("db_mesin.csv", session))
+        _merge_summary(summary, import_operator("db_operator.csv", session))
+    master_cache.invalidate_all()
+    # Cached report tiles hold the names as they were, new rows have no history yet
+    if any(counts["updated"] for counts in summary["counts"].values()):
+        report_cache.invalidate_all()
+    return summary
 
 
 if __name__ == "__main__":
-    import_to_db("data_all.csv")
+    summary = import_to_db("data_all.csv")
     print("db ingestion complete")
+    for model, counts in (summary or _empty_summary())["counts"].items():
+        print(
+            f"  {model}: {counts['inserted']} inserted, {counts['updated']} updated, "
+            f"{counts['unchanged']} unchanged, {counts['failed']} failed"
+        )
+    for error in (summary or _empty_summary())["errors"]:
+        print(f"  {error['file']} line {error['line']}, {error['model']}: {error['error']}")
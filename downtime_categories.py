@@ -0,0 +1,102 @@
+import threading
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+
+"""
+Downtime categories as the small integer codes of the downtime_category table. The
+tablets send category names; every name is resolved to its code once per process and
+the machine and operator statuses a category leads to are worked out once per code,
+so applying an event is a dictionary lookup instead of parsing the name again.
+A name seen for the first time is added to the table and committed on its own.
+"""
+UTILITY = "U : Utility"
+OBJECT_CREATION = "Object Creation"
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+_lock = threading.Lock()
+# (code by name, name by code, (Status, DisplayedStatus) by code), replaced, never mutated
+_maps = ({}, {}, {})
+
+
+def _initial(name):
+    return name[:2].upper()
+
+
+def _status(name):
+    return models.Status.SETUP if _initial(name) in ["TP", "TS", "TL"] else models.Status.IDLE
+
+
+def _displayed_status(name):
+    return (
+        models.DisplayedStatus.IDLE
+        if _initial(name) in ["NP", "BT", "BR"]
+        else models.DisplayedStatus.DOWNTIME
+    )
+
+
+def _load(session):
+    global _maps
+    rows = session.execute(
+        sa.select(models.DowntimeCategory.id, models.DowntimeCategory.name)
+    ).all()
+    with _lock:
+        codes, names, statuses = _maps
+        codes = {**codes, **{name: code for code, name in rows}}
+        names = {**names, **{code: name for code, name in rows}}
+        statuses = {
+            **statuses,
+            **{code: (_status(name), _displayed_status(name)) for code, name in rows},
+        }
+        _maps = (codes, names, statuses)
+
+
+def resolve(names, session):
+    """
+    Make sure every name in names has a code, adding the missing ones to the table.
+    Call it before the session has anything pending: a new category is committed.
+    """
+    names = {name for name in names if name is not None}
+    if names <= _maps[0].keys():
+        return
+    _load(session)
+    missing = names - _maps[0].keys()
+    if not missing:
+        return
+
+    # Another worker may add the same name meanwhile, the unique name keeps one of them
+    statement = _INSERTS[session.get_bind().dialect.name](models.DowntimeCategory.__table__)
+    session.execute(
+        statement.values([{"name": name} for name in sorted(missing)]).on_conflict_do_nothing(
+            index_elements=["name"]
+        )
+    )
+    session.commit()
+    _load(session)
+
+
+def code_of(name):
+    """Code of a name already resolved, None for no category."""
+    return None if name is None else _maps[0][name]
+
+
+def name_of(code, session):
+    """Name of a code, which may have been added by another worker since the last load."""
+    if code is None:
+        return None
+    if code not in _maps[1]:
+        _load(session)
+    return _maps[1][code]
+
+
+def status_of(code):
+    """The machine's Status after stopping with the category of code."""
+    return _maps[2][code][0] if code is not None else _status("")
+
+
+def displayed_status_of(code):
+    """The machine's and operator's DisplayedStatus after stopping with the category of code."""
+    return _maps[2][code][1] if code is not None else _displayed_status("")
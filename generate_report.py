@@ -1,14 +1,20 @@
+import itertools
+import multiprocessing
 import os
-from datetime import datetime, time, timedelta
-import json
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
 
+import numpy
 import pandas
-import sqlalchemy as sa
-from sqlalchemy.orm import aliased
 import pytz
 
+import archive
 import database
-import models
+import report_cache
+import report_export
+import report_query
+import shift_calendar
 
 """
 All timezone-aware dates and times are stored internally in UTC. 
@@ -17,42 +23,9 @@ the timezone configuration parameter before being displayed to the client.
 """
 _TIMEZONE = pytz.timezone("Asia/Jakarta")
 
-_WORKING_SHIFT_JSON = "working_shift.json"
-
-
-def _is_time_between(begin_time, end_time, check_time=None):
-    # If check time is not given, default to current timezone time
-    check_time = check_time or datetime.now(_TIMEZONE)
-    if begin_time < end_time:
-        return check_time >= begin_time and check_time < end_time
-    else:  # crosses midnight
-        return check_time >= begin_time or check_time < end_time
-
-
-def _calculate_shift(row):
-    date_time = datetime.strptime(row, "%m/%d/%Y %H:%M:%S")
-    return _calculate_shift_from_datetime(date_time)
-
 
 def _calculate_shift_from_datetime(date_time):
-    comp_time = date_time.time()
-    if date_time.isoweekday() == 7:  # Sunday
-        return 3
-    else:
-        with open(_WORKING_SHIFT_JSON, "r") as openfile:
-            working_shift = json.load(openfile)
-
-            day_of_week = "Saturday" if date_time.isoweekday() == 6 else "Weekday"
-            duration = working_shift[day_of_week]["duration"]
-            for shift, timestamp in working_shift[day_of_week]["start"].items():
-                if _is_time_between(
-                    time(timestamp, 00),
-                    time((timestamp + duration) % 24, 00),
-                    comp_time,
-                ):
-                    return shift
-
-    return 0
+    return shift_calendar.calendar.shift_of(date_time)
 
 
 def get_curr_datetime():
@@ -90,15 +63,22 @@ def _get_csv_folder(type, date_from, shift_from, date_to, shift_to):
 
 
 def _convert_seconds(seconds):
-    m, s = divmod(int(seconds), 60)
-    h, m = divmod(m, 60)
+    seconds = seconds.astype(int)
+    h = (seconds // 3600).astype(str)
+    m = (seconds // 60 % 60).astype(str)
+    s = (seconds % 60).astype(str)
 
-    if h > 0 and m > 0 and s > 0:
-        return f"{h:d}h {m:d}min {s:d}sec"
-    elif m > 0 and s > 0:
-        return f"{m:d}min {s:d}sec"
-    else:
-        return f"{s:d}sec"
+    return pandas.Series(
+        numpy.select(
+            [
+                (seconds // 3600 > 0) & (seconds // 60 % 60 > 0) & (seconds % 60 > 0),
+                (seconds // 60 % 60 > 0) & (seconds % 60 > 0),
+            ],
+            [h + "h " + m + "min " + s + "sec", m + "min " + s + "sec"],
+            s + "sec",
+        ),
+        index=seconds.index,
+    )
 
 
 def _calculate_datetime_from_shift(date_time, shift):
@@ -106,20 +86,15 @@ def _calculate_datetime_from_shift(date_time, shift):
     month = date_time.month
     day = date_time.day
 
-    hour_from = 0
-
-    if date_time.isoweekday() != 7:  # Not Sunday
-        with open(_WORKING_SHIFT_JSON, "r") as file:
-            working_shift = json.load(file)
+    shift_hours = shift_calendar.calendar.shift_hours(date_time, shift)
+    if shift_hours is not None:  # Not Sunday
+        hour_from, duration = shift_hours
 
-            day_of_week = "Saturday" if date_time.isoweekday() == 6 else "Weekday"
-            hour_from = working_shift[day_of_week]["start"][shift]
+        # Get time in UTC (from GMT +7)
+        time_from = datetime(year, month, day, hour_from, 0) - timedelta(hours=7)
+        time_to = time_from + timedelta(hours=duration)
 
-            # Get time in UTC (from GMT +7)
-            time_from = datetime(year, month, day, hour_from, 0) - timedelta(hours=7)
-            time_to = time_from + timedelta(hours=working_shift[day_of_week]["duration"])
-
-            return time_from, time_to
+        return time_from, time_to
 
     return datetime(year, month, day, 0, 0), datetime(year, month, day, 0, 0)
 
@@ -162,132 +137,296 @@ def _calculate_datetime_range(
     return time_from, time_to
 
 
-def _generate_keterangan(row):
-    keterangan = (
-        (f"Coil No: {row['Coil No']}, " if row["Coil No"] else "")
-        + (f"Lot No: {row['Lot No']}, " if row["Lot No"] else "")
-        + (f"Pack No: {row['Pack No']}" if row["Pack No"] else "")
+def _generate_keterangan(df):
+    keterangan = pandas.Series("", index=df.index)
+    for column, separator in [("Coil No", ", "), ("Lot No", ", "), ("Pack No", "")]:
+        value = df[column].fillna("").replace("-", "")
+        keterangan += (f"{column}: " + value + separator).where(value != "", "")
+
+    return keterangan.str.removesuffix(", ")
+
+
+def _localize_timestamps(df):
+    # Convert once to Jakarta time, truncated to the seconds shown in the report
+    for column in ["Start", "Stop"]:
+        df[column] = (
+            pandas.to_datetime(df[column], utc=True).dt.tz_convert(_TIMEZONE).dt.floor("s")
+        )
+    return df
+
+
+def _fill_unknown_gaps(df, key, previous=None):
+    """
+    Insert "NK : Not Known" rows between consecutive intervals of the same key whose
+    start does not meet the previous stop, then remove No Plan rows.
+    Breaks and No Plan intervals do not open an unknown gap before them.
+    Expects df already ordered by key and Start, as report_query returns it.
+    previous holds the trailing rows of an earlier chunk, used only as gap context.
+    """
+    context = 0
+    if previous is not None:
+        context = len(previous)
+        df = pandas.concat([previous, df], ignore_index=True)
+
+    # Decided once per category and looked up by each row's code, -1 (no category) is the
+    # trailing False
+    desc = df["Desc"].astype("category")
+    opens_no_gap = numpy.array(
+        [name[:2] in ("NP", "BT") for name in desc.cat.categories] + [False], dtype=bool
     )
+    previous_stop = df.groupby(key, sort=False, observed=True)["Stop"].shift()
+    is_gap = (
+        previous_stop.notna()
+        & (df["Start"] != previous_stop)
+        & ~opens_no_gap[desc.cat.codes.to_numpy()]
+    )
+    df, previous_stop, is_gap = df[context:], previous_stop[context:], is_gap[context:]
+    gaps = pandas.DataFrame(
+        {
+            key: df.loc[is_gap, key],
+            "Start": previous_stop[is_gap],
+            "Stop": df.loc[is_gap, "Start"],
+            "Desc": "NK : Not Known",
+        }
+    )
+
+    df = df[df["Desc"] != "NP : No Plan"]
+    if gaps.empty:
+        # Most chunks have no gap, and concatenating an empty frame would change dtypes
+        return df.reset_index(drop=True)
+    df = pandas.concat([df, gaps], ignore_index=True)
+    return df.sort_values(by=[key, "Start"], kind="stable").reset_index(drop=True)
+
+
+def _format_report(df, header, typed=False):
+    if typed:
+        return _type_report(df, header)
+
+    df["Tanggal"] = df["Start"].dt.strftime("%m/%d/%Y")
+    df["StartTime"] = df["Start"].dt.strftime("%H:%M:%S")
+    df["StopTime"] = df["Stop"].dt.strftime("%H:%M:%S")
+    df["Shift"] = shift_calendar.assign_shifts(df["Start"])
+    df["Duration"] = _convert_seconds((df["Stop"] - df["Start"]).dt.total_seconds())
+    df["Keterangan"] = _generate_keterangan(df)
+    # Unknown gaps only carry their Desc and Duration, the other columns keep the 0
+    # the report has always shown for them
+    is_gap = (df["Desc"] == "NK : Not Known").to_numpy()
+    if is_gap.any():
+        df.loc[is_gap, ["Shift", "Tanggal", "StartTime", "StopTime", "Keterangan"]] = 0
+
+    # A categorical only takes 0 once it is one of its categories, and fillna(0)
+    # over the whole frame rejects categoricals even without missing values
+    categorical = df.select_dtypes("category").columns
+    for column in categorical[df[categorical].isna().any().to_numpy()]:
+        df[column] = df[column].cat.add_categories([0]).fillna(0)
+    df = df.fillna({column: 0 for column in df.columns.difference(categorical)})
+    df["Qty"] = df["Qty"].astype(int)
+    df["Reject"] = df["Reject"].astype(int)
+    df["Rework"] = df["Rework"].astype(int)
+
+    return df[header]
+
 
-    if keterangan[-2::] == ", ":
-        keterangan = keterangan[:-2]
-    return keterangan
+def _type_report(df, header):
+    """Report columns with native types: dates, local timestamps, durations and counts."""
+    df["Tanggal"] = df["Start"].dt.date
+    df["StartTime"] = df["Start"]
+    df["StopTime"] = df["Stop"]
+    df["Shift"] = shift_calendar.assign_shifts(df["Start"])
+    df["Duration"] = df["Stop"] - df["Start"]
+    df["Keterangan"] = _generate_keterangan(df)
 
+    for column in ["Qty", "Reject", "Rework"]:
+        df[column] = df[column].fillna(0).astype(int)
 
-engine = database.get_engine()
-session = sa.orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)()
+    return df[header]
 
-col_order = [
+
+_STREAM_CHUNK_SIZE = 5000
+
+# Large reports are processed per machine or operator on this many processes
+_PARTITION_WORKERS = int(os.environ.get("REPORT_PARTITION_WORKERS", 1))
+_PARTITION_MIN_ROWS = int(os.environ.get("REPORT_PARTITION_MIN_ROWS", 20000))
+# A few partitions per worker even out machines with more rows than others
+_PARTITIONS_PER_WORKER = 4
+_partition_lock = threading.Lock()
+_partition_executors = {}  # workers -> ProcessPoolExecutor
+
+mesin_header = [
     "MC",
-    "Operator",
+    "Shift",
+    "Tanggal",
+    "StartTime",
+    "StopTime",
     "Kode Tooling",
     "Common Tooling Name",
-    "Start",
-    "Stop",
+    "Operator",
+    "Qty",
+    "Reject",
+    "Rework",
     "Desc",
+    "Duration",
+    "Keterangan",
+]
+
+operator_header = [
+    "Operator",
+    "Shift",
+    "Tanggal",
+    "StartTime",
+    "StopTime",
+    "MC",
+    "Kode Tooling",
+    "Common Tooling Name",
     "Qty",
     "Reject",
     "Rework",
+    "Desc",
+    "Duration",
+    "Keterangan",
 ]
 
 
-def query_continued_downtime(time_from, time_to):
-    continued_downtime_start = aliased(models.Stop)
-    continued_downtime_stop = aliased(models.Stop)
-
-    query = (
-        session.query(models.ContinuedDowntimeMesin)
-        .join(models.Mesin)
-        .join(continued_downtime_start, models.ContinuedDowntimeMesin.start_time)
-        .join(continued_downtime_stop, models.ContinuedDowntimeMesin.stop_time)
-        .join(models.Operator, models.Operator.id == continued_downtime_start.operator_id)
-        .join(models.Tooling, models.Tooling.id == continued_downtime_start.tooling_id)
-        .with_entities(
-            models.Mesin.name.label("MC"),
-            models.Operator.name.label("Operator"),
-            models.Tooling.kode_tooling.label("Kode Tooling"),
-            models.Tooling.common_tooling_name.label("Common Tooling Name"),
-            continued_downtime_start.timestamp.label("Start"),
-            continued_downtime_stop.timestamp.label("Stop"),
-            models.ContinuedDowntimeMesin.downtime_category.label("Desc"),
-            models.ContinuedDowntimeMesin.reject.label("Reject"),
-            models.ContinuedDowntimeMesin.rework.label("Rework"),
-        )
-        .filter(continued_downtime_start.timestamp >= time_from)
-        .filter(continued_downtime_start.timestamp < time_to)
-        .statement
-    )
+def _report_layout(view):
+    return ("MC", mesin_header) if view == "mesin" else ("Operator", operator_header)
 
-    df = pandas.read_sql(sql=query, con=engine)
-    df["Qty"] = 0
-    return df[col_order]
-
-
-def query_last_downtime(time_from, time_to):
-    last_downtime_start = aliased(models.Stop)
-    last_downtime_stop = aliased(models.Start)
-
-    query = (
-        session.query(models.LastDowntimeMesin)
-        .join(models.Mesin)
-        .join(last_downtime_start, models.LastDowntimeMesin.start_time)
-        .join(last_downtime_stop, models.LastDowntimeMesin.stop_time)
-        .join(models.Operator, models.Operator.id == last_downtime_start.operator_id)
-        .join(models.Tooling, models.Tooling.id == last_downtime_start.tooling_id)
-        .with_entities(
-            models.Mesin.name.label("MC"),
-            models.Operator.name.label("Operator"),
-            models.Tooling.kode_tooling.label("Kode Tooling"),
-            models.Tooling.common_tooling_name.label("Common Tooling Name"),
-            last_downtime_start.timestamp.label("Start"),
-            last_downtime_stop.timestamp.label("Stop"),
-            models.LastDowntimeMesin.downtime_category.label("Desc"),
-            models.LastDowntimeMesin.reject.label("Reject"),
-            models.LastDowntimeMesin.rework.label("Rework"),
-        )
-        .filter(last_downtime_start.timestamp >= time_from)
-        .filter(last_downtime_start.timestamp < time_to)
-        .statement
+
+def _process_partition(df, view, typed=False):
+    key, header = _report_layout(view)
+    df = _localize_timestamps(df)
+    if view == "operator":
+        df = _fill_unknown_gaps(df, key=key)
+    return _format_report(df, header, typed)
+
+
+def _partition_by_key(df, key, partitions, sort_keys):
+    """
+    Split df into up to `partitions` frames of whole keys with similar row counts. Keys
+    are dealt out in report order, the query's or sorted, so the frames concatenate in it.
+    """
+    codes, uniques = pandas.factorize(df[key], use_na_sentinel=False)
+    if sort_keys:
+        order = pandas.Series(uniques).sort_values(kind="stable").index.to_numpy()
+    else:
+        order = numpy.arange(len(uniques))
+    counts = numpy.bincount(codes, minlength=len(uniques))[order]
+    groups = numpy.empty(len(uniques), dtype=int)
+    groups[order] = (numpy.cumsum(counts) - counts) * partitions // len(df)
+    rows = groups[codes]
+    return [df[rows == group] for group in numpy.unique(groups)]
+
+
+def _get_partition_executor(workers):
+    with _partition_lock:
+        if workers not in _partition_executors:
+            # Spawned, not forked, so workers do not inherit the web server's threads and pools
+            _partition_executors[workers] = ProcessPoolExecutor(
+                max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _partition_executors[workers]
+
+
+def process_report(df, view, workers=1, typed=False):
+    """
+    Report rows from the query rows of view, formatted as text or typed for the
+    columnar formats. With more than one worker, large reports are split by machine
+    or operator and processed in parallel, in the same order.
+    """
+    if workers <= 1 or len(df) < _PARTITION_MIN_ROWS:
+        return _process_partition(df, view, typed)
+
+    key, _ = _report_layout(view)
+    partitions = _partition_by_key(
+        df, key, workers * _PARTITIONS_PER_WORKER, sort_keys=view == "operator"
     )
+    if len(partitions) == 1:
+        return _process_partition(df, view, typed)
+    results = _get_partition_executor(workers).map(
+        _process_partition, partitions, itertools.repeat(view), itertools.repeat(typed)
+    )
+    return pandas.concat(list(results), ignore_index=True)
 
-    df = pandas.read_sql(sql=query, con=engine)
-    df["Qty"] = 0
-    return df[col_order]
-
-
-def query_utility(time_from, time_to):
-    utility_start = aliased(models.Start)
-    utility_stop = aliased(models.Stop)
-
-    query = (
-        session.query(models.UtilityMesin)
-        .join(models.Mesin)
-        .join(utility_start, models.UtilityMesin.start_time)
-        .join(utility_stop, models.UtilityMesin.stop_time)
-        .join(models.Operator, models.Operator.id == utility_start.operator_id)
-        .join(models.Tooling, models.Tooling.id == utility_start.tooling_id)
-        .with_entities(
-            models.Mesin.name.label("MC"),
-            models.Operator.name.label("Operator"),
-            models.Tooling.kode_tooling.label("Kode Tooling"),
-            models.Tooling.common_tooling_name.label("Common Tooling Name"),
-            utility_start.timestamp.label("Start"),
-            utility_stop.timestamp.label("Stop"),
-            models.UtilityMesin.output.label("Qty"),
-            models.UtilityMesin.reject.label("Reject"),
-            models.UtilityMesin.rework.label("Rework"),
-        )
-        .filter(utility_start.timestamp >= time_from)
-        .filter(utility_start.timestamp < time_to)
-        .statement
+
+def _query_report_source(view, time_from, time_to):
+    with database.get_engine().connect() as conn:
+        result = report_query.execute_report_query(conn, view, time_from, time_to)
+        return report_query.to_frame(list(result.keys()), result.fetchall())
+
+
+def _query_live_report(view, time_from, time_to):
+    return report_cache.read_report_source(view, time_from, time_to, _query_report_source)
+
+
+def query_report(view, time_from, time_to):
+    return archive.read_report_source(view, time_from, time_to, _query_live_report)
+
+
+def _query_report_chunks(view, time_from, time_to, chunk_size):
+    with database.get_engine().connect() as conn:
+        horizon = archive.horizon(conn)
+    if horizon is not None and time_from < horizon:
+        # Archived months are merged into the view's order in memory
+        df = query_report(view, time_from, time_to)
+        for begin in range(0, len(df), chunk_size):
+            yield df.iloc[begin : begin + chunk_size].reset_index(drop=True)
+        return
+
+    # Server-side cursor, only chunk_size rows are held in memory at a time
+    with database.get_engine().connect().execution_options(stream_results=True) as conn:
+        result = report_query.execute_report_query(conn, view, time_from, time_to)
+        columns = list(result.keys())
+        for rows in result.partitions(chunk_size):
+            yield report_query.to_frame(columns, rows)
+
+
+def _fill_unknown_gaps_chunks(chunks, key):
+    """
+    _fill_unknown_gaps over consecutive chunks. Rows that a gap opened by the next
+    chunk could still sort before are held back and merged into the next chunk.
+    """
+    previous = held = None
+    for df in chunks:
+        tail = df[-1:]
+        df = _fill_unknown_gaps(df, key=key, previous=previous)
+        if held is not None and not held.empty:
+            # Same order as sorting the whole report at once: real rows before gaps on ties
+            df = pandas.concat([held, df], ignore_index=True)
+            is_gap = df["Desc"] == "NK : Not Known"
+            df = df.iloc[numpy.lexsort((is_gap, df["Start"], df[key]))]
+
+        hold = (df[key] == tail[key].iloc[0]) & (df["Start"] >= tail["Start"].iloc[0])
+        held, previous = df[hold], tail
+        yield df[~hold].copy()
+
+    if held is not None:
+        yield held.copy()
+
+
+def _stream_frames(view, time_from, time_to, chunk_size, typed):
+    key, header = _report_layout(view)
+    chunks = (
+        _localize_timestamps(df)
+        for df in _query_report_chunks(view, time_from, time_to, chunk_size)
     )
+    if view == "operator":
+        chunks = _fill_unknown_gaps_chunks(chunks, key=key)
 
-    df = pandas.read_sql(sql=query, con=engine)
-    df["Desc"] = "U : Utility"
-    return df[col_order]
+    for df in chunks:
+        yield _format_report(df, header, typed)
 
 
-def get_mesin_report(date_time_from=None, shift_from=None, date_time_to=None, shift_to=None):
+def stream_report(
+    view,
+    date_time_from=None,
+    shift_from=None,
+    date_time_to=None,
+    shift_to=None,
+    format=report_export.CSV,
+):
+    """
+    Same rows as get_mesin_report/get_operator_report, as a generator of chunks in
+    format, written while the rows are fetched. Nothing is written to data/report.
+    """
     date_from, shift_from, date_to, shift_to = _fill_default_datetime(
         date_time_from, shift_from, date_time_to, shift_to
     )
@@ -299,202 +438,34 @@ def get_mesin_report(date_time_from=None, shift_from=None, date_time_to=None, sh
         shift_to=shift_to,
     )
 
-    df = (
-        pandas.concat(
-            [
-                query_utility(time_from, time_to),
-                query_continued_downtime(time_from, time_to),
-                query_last_downtime(time_from, time_to),
-            ],
-            axis=0,
-        )
-        .sort_values(by=["MC", "Start"])
-        .reset_index(drop=True)
-    )
-
-    df["Tanggal"] = (
-        pandas.to_datetime(df.Start, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%m/%d/%Y")
-    )
-    df["StartTime"] = (
-        pandas.to_datetime(df.Start, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%H:%M:%S")
+    _, header = _report_layout(view)
+    frames = _stream_frames(
+        view, time_from, time_to, _STREAM_CHUNK_SIZE, typed=format != report_export.CSV
     )
-    df["StopTime"] = (
-        pandas.to_datetime(df.Stop, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%H:%M:%S")
-    )
-
-    df["Start"] = (
-        pandas.to_datetime(df.Start, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%m/%d/%Y %H:%M:%S")
-    )
-    df["Stop"] = (
-        pandas.to_datetime(df.Stop, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%m/%d/%Y %H:%M:%S")
-    )
-    df["Shift"] = df["Start"].apply(lambda x: _calculate_shift(x))
-
-    df["Duration"] = pandas.to_datetime(df.Stop) - pandas.to_datetime(df.Start)
-    df["Duration"] = df["Duration"].dt.total_seconds()
-    df["Duration"] = df["Duration"].apply(lambda x: _convert_seconds(x))
-
-    df = df.fillna(0)
-    df["Qty"] = df["Qty"].astype(int)
-    df["Reject"] = df["Reject"].astype(int)
-    df["Rework"] = df["Rework"].astype(int)
-
-    df.drop(["Start", "Stop"], axis=1, inplace=True)
-    header = [
-        "MC",
-        "Shift",
-        "Tanggal",
-        "StartTime",
-        "StopTime",
-        "Kode Tooling",
-        "Common Tooling Name",
-        "Operator",
-        "Qty",
-        "Reject",
-        "Rework",
-        "Desc",
-        "Duration",
-        "Keterangan",
-    ]
-    df = df[header]
-    print(df)
-
-    df.to_csv(
-        _get_csv_folder(
-            "mesin",
-            date_from=date_from,
-            shift_from=shift_from,
-            date_to=date_to,
-            shift_to=shift_to,
-            sep=";",
-        )
-    )
-    return df, _get_csv_filename(
-        "mesin",
+    filename = _get_csv_filename(
+        view,
         date_from=date_from,
         shift_from=shift_from,
         date_to=date_to,
         shift_to=shift_to,
     )
-
-
-def query_continued_downtime_operator(time_from, time_to):
-    continued_downtime_start = aliased(models.Stop)
-    continued_downtime_stop = aliased(models.Stop)
-
-    query = (
-        session.query(models.ContinuedDowntimeMesin)
-        .join(models.Operator)
-        .join(continued_downtime_start, models.ContinuedDowntimeMesin.start_time)
-        .join(continued_downtime_stop, models.ContinuedDowntimeMesin.stop_time)
-        .join(models.Mesin)
-        .join(models.Tooling, models.Tooling.id == continued_downtime_start.tooling_id)
-        .with_entities(
-            models.Operator.name.label("Operator"),
-            models.Mesin.name.label("MC"),
-            models.Tooling.kode_tooling.label("Kode Tooling"),
-            models.Tooling.common_tooling_name.label("Common Tooling Name"),
-            continued_downtime_start.timestamp.label("Start"),
-            continued_downtime_stop.timestamp.label("Stop"),
-            models.ContinuedDowntimeMesin.downtime_category.label("Desc"),
-            models.ContinuedDowntimeMesin.reject.label("Reject"),
-            models.ContinuedDowntimeMesin.rework.label("Rework"),
-        )
-        .filter(continued_downtime_start.timestamp >= time_from)
-        .filter(continued_downtime_start.timestamp < time_to)
-        .statement
+    return report_export.write_chunks(frames, header, format), report_export.filename(
+        filename, format
     )
 
-    df = pandas.read_sql(sql=query, con=engine)
-    df["Qty"] = 0
-    df["Keterangan"] = ""
-    return df
-
 
-def query_last_downtime_operator(time_from, time_to):
-    last_downtime_start = aliased(models.Stop)
-    last_downtime_stop = aliased(models.Start)
-
-    query = (
-        session.query(models.LastDowntimeMesin)
-        .join(models.Operator)
-        .join(last_downtime_start, models.LastDowntimeMesin.start_time)
-        .join(last_downtime_stop, models.LastDowntimeMesin.stop_time)
-        .join(models.Mesin)
-        .join(models.Tooling, models.Tooling.id == last_downtime_start.tooling_id)
-        .with_entities(
-            models.Operator.name.label("Operator"),
-            models.Mesin.name.label("MC"),
-            models.Tooling.kode_tooling.label("Kode Tooling"),
-            models.Tooling.common_tooling_name.label("Common Tooling Name"),
-            last_downtime_start.timestamp.label("Start"),
-            last_downtime_stop.timestamp.label("Stop"),
-            models.LastDowntimeMesin.downtime_category.label("Desc"),
-            models.LastDowntimeMesin.reject.label("Reject"),
-            models.LastDowntimeMesin.rework.label("Rework"),
-        )
-        .filter(last_downtime_start.timestamp >= time_from)
-        .filter(last_downtime_start.timestamp < time_to)
-        .statement
-    )
-
-    df = pandas.read_sql(sql=query, con=engine)
-    df["Qty"] = 0
-    df["Keterangan"] = ""
-    return df
+def _no_progress(stage, fraction):
+    pass
 
 
-def query_utility_operator(time_from, time_to):
-    utility_start = aliased(models.Start)
-    utility_stop = aliased(models.Stop)
-
-    query = (
-        session.query(models.UtilityMesin)
-        .join(models.Operator)
-        .join(utility_start, models.UtilityMesin.start_time)
-        .join(utility_stop, models.UtilityMesin.stop_time)
-        .join(models.Mesin)
-        .join(models.Tooling, models.Tooling.id == utility_start.tooling_id)
-        .with_entities(
-            models.Operator.name.label("Operator"),
-            models.Mesin.name.label("MC"),
-            models.Tooling.kode_tooling.label("Kode Tooling"),
-            models.Tooling.common_tooling_name.label("Common Tooling Name"),
-            utility_start.timestamp.label("Start"),
-            utility_stop.timestamp.label("Stop"),
-            models.UtilityMesin.output.label("Qty"),
-            models.UtilityMesin.reject.label("Reject"),
-            models.UtilityMesin.rework.label("Rework"),
-            models.UtilityMesin.coil_no.label("Coil No"),
-            models.UtilityMesin.lot_no.label("Lot No"),
-            models.UtilityMesin.pack_no.label("Pack No"),
-        )
-        .filter(utility_start.timestamp >= time_from)
-        .filter(utility_start.timestamp < time_to)
-        .statement
-    )
-
-    df = pandas.read_sql(sql=query, con=engine)
-    df["Desc"] = "U : Utility"
-    df["Coil No"] = df["Coil No"].fillna("").replace("-", "")
-    df["Lot No"] = df["Lot No"].fillna("").replace("-", "")
-    df["Pack No"] = df["Pack No"].fillna("").replace("-", "")
-    df["Keterangan"] = df.apply(lambda row: _generate_keterangan(row), axis=1)
-    df.drop(["Coil No", "Lot No", "Pack No"], axis=1)
-    return df
-
-
-def get_operator_report(date_time_from=None, shift_from=None, date_time_to=None, shift_to=None):
+def get_mesin_report(
+    date_time_from=None,
+    shift_from=None,
+    date_time_to=None,
+    shift_to=None,
+    progress=_no_progress,
+    typed=False,
+):
     date_from, shift_from, date_to, shift_to = _fill_default_datetime(
         date_time_from, shift_from, date_time_to, shift_to
     )
@@ -506,108 +477,70 @@ def get_operator_report(date_time_from=None, shift_from=None, date_time_to=None,
         shift_to=shift_to,
     )
 
-    df = (
-        pandas.concat(
-            [
-                query_utility_operator(time_from, time_to),
-                query_continued_downtime_operator(time_from, time_to),
-                query_last_downtime_operator(time_from, time_to),
-            ],
-            axis=0,
+    progress("querying", 0.1)
+    df = query_report("mesin", time_from, time_to)
+    progress("formatting", 0.6)
+    df = process_report(df, "mesin", _PARTITION_WORKERS, typed)
+
+    # Only the text report is kept as CSV in data/report
+    if not typed:
+        progress("saving", 0.8)
+        df.to_csv(
+            _get_csv_folder(
+                "mesin",
+                date_from=date_from,
+                shift_from=shift_from,
+                date_to=date_to,
+                shift_to=shift_to,
+            ),
+            sep=";",
         )
-        .sort_values(by=["Operator", "Start"])
-        .reset_index(drop=True)
+    return df, _get_csv_filename(
+        "mesin",
+        date_from=date_from,
+        shift_from=shift_from,
+        date_to=date_to,
+        shift_to=shift_to,
     )
 
-    df["Tanggal"] = (
-        pandas.to_datetime(df.Start, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%m/%d/%Y")
-    )
-    df["StartTime"] = (
-        pandas.to_datetime(df.Start, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%H:%M:%S")
-    )
-    df["StopTime"] = (
-        pandas.to_datetime(df.Stop, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%H:%M:%S")
-    )
 
-    df["Start"] = (
-        pandas.to_datetime(df.Start, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%m/%d/%Y %H:%M:%S")
+def get_operator_report(
+    date_time_from=None,
+    shift_from=None,
+    date_time_to=None,
+    shift_to=None,
+    progress=_no_progress,
+    typed=False,
+):
+    date_from, shift_from, date_to, shift_to = _fill_default_datetime(
+        date_time_from, shift_from, date_time_to, shift_to
     )
-    df["Stop"] = (
-        pandas.to_datetime(df.Stop, utc=True)
-        .map(lambda x: x.tz_convert("Asia/Jakarta"))
-        .dt.strftime("%m/%d/%Y %H:%M:%S")
+
+    time_from, time_to = _calculate_datetime_range(
+        date_from=date_from,
+        shift_from=shift_from,
+        date_to=date_to,
+        shift_to=shift_to,
     )
-    df["Shift"] = df["Start"].apply(lambda x: _calculate_shift(x))
-
-    for index, row in df.iterrows():
-        if index == 0:
-            continue
-
-        # Remove No Plan and BreakTime from Operator's Downtime
-        if (
-            (df.loc[index]["Operator"] == df.loc[index - 1]["Operator"])
-            and (df.loc[index]["Start"] != df.loc[index - 1]["Stop"])
-            and (df.loc[index]["Desc"][:2] != "NP" and df.loc[index]["Desc"][:2] != "BT")
-        ):
-            insert_row = {
-                "Operator": df.loc[index]["Operator"],
-                "Start": df.loc[index - 1]["Stop"],
-                "Stop": df.loc[index]["Start"],
-                "Desc": "NK : Not Known",
-            }
-            df = pandas.concat([df, pandas.DataFrame([insert_row])])
-    df.drop(df.loc[df["Desc"] == "NP : No Plan"].index, inplace=True)
-    df = df.sort_values(by=["Operator", "Start"]).reset_index(drop=True)
-
-    df["Duration"] = pandas.to_datetime(df.Stop) - pandas.to_datetime(df.Start)
-    df["Duration"] = df["Duration"].dt.total_seconds()
-    df["Duration"] = df["Duration"].apply(lambda x: _convert_seconds(x))
-
-    df = df.sort_values(by=["Operator", "Start"]).reset_index(drop=True)
-
-    df = df.fillna(0)
-    df["Qty"] = df["Qty"].astype(int)
-    df["Reject"] = df["Reject"].astype(int)
-    df["Rework"] = df["Rework"].astype(int)
 
-    df.drop(["Start", "Stop"], axis=1, inplace=True)
-    header = [
-        "Operator",
-        "Shift",
-        "Tanggal",
-        "StartTime",
-        "StopTime",
-        "MC",
-        "Kode Tooling",
-        "Common Tooling Name",
-        "Qty",
-        "Reject",
-        "Rework",
-        "Desc",
-        "Duration",
-        "Keterangan",
-    ]
-    df = df[header]
-    print(df)
-
-    df.to_csv(
-        _get_csv_folder(
-            "operator",
-            date_from=date_from,
-            shift_from=shift_from,
-            date_to=date_to,
-            shift_to=shift_to,
+    progress("querying", 0.1)
+    df = query_report("operator", time_from, time_to)
+    progress("formatting", 0.6)
+    df = process_report(df, "operator", _PARTITION_WORKERS, typed)
+
+    # Only the text report is kept as CSV in data/report
+    if not typed:
+        progress("saving", 0.8)
+        df.to_csv(
+            _get_csv_folder(
+                "operator",
+                date_from=date_from,
+                shift_from=shift_from,
+                date_to=date_to,
+                shift_to=shift_to,
+            ),
             sep=";",
         )
-    )
     return df, _get_csv_filename(
         "operator",
         date_from=date_from,
@@ -5,9 +5,6 @@ import sqlalchemy as sa
 import database
 import models
 
-engine = database.get_engine()
-session = sa.orm.sessionmaker(autocommit=False, autoflush=False, bind=engine)()
-
 
 def get_directory():
     directory = f"data/IDs/"
@@ -17,12 +14,12 @@ def get_directory():
 
 
 def get_id_query(model):
-    return session.query(model).with_entities(model.id).statement
+    return sa.select(model.id)
 
 
 def get_csv(model, category):
     query = get_id_query(model)
-    df = pandas.read_sql(sql=query, con=engine)
+    df = pandas.read_sql(sql=query, con=database.get_engine())
     filepath = f"{get_directory()}/{category}_ids.csv"
     df.to_csv(filepath, index=False)
 
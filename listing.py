@@ -0,0 +1,191 @@
+import base64
+import binascii
+import json
+import os
+from datetime import timezone
+
+import fastapi
+import sqlalchemy as sa
+from fastapi.encoders import jsonable_encoder
+
+import database
+import models
+
+"""
+Listings of the master, event and interval tables, a page at a time. Pages follow
+the primary key instead of an offset, so every page is an index range scan however
+deep into a table it is, and rows are selected as plain columns, not ORM objects.
+The cursor of the next page is opaque to clients, it is the id of the last row of
+the current page. Events are not paged by timestamp: on SQLite the server default
+timestamps and the ones SQLAlchemy binds are formatted differently, so a timestamp
+cursor would skip events of the same second.
+"""
+_PAGE_SIZE = int(os.environ.get("LISTING_PAGE_SIZE", 500))
+_MAX_PAGE_SIZE = int(os.environ.get("LISTING_MAX_PAGE_SIZE", 5000))
+
+_start = models.Start.__table__
+_stop = models.Stop.__table__
+_downtime_category = models.DowntimeCategory.__table__
+
+
+class _Listing:
+    def __init__(self, select_from, columns, key, time=None, filters=None):
+        self.select_from = select_from
+        self.columns = columns
+        self.key = key
+        self.time = time
+        self.filters = filters or {}
+
+
+def _master(table):
+    return _Listing(table, list(table.c), table.c.id)
+
+
+def _with_downtime_category(table, select_from, columns):
+    # Rows carry the category's name next to its code
+    if "downtime_category_id" not in table.c:
+        return select_from, columns
+    return (
+        select_from.outerjoin(
+            _downtime_category, _downtime_category.c.id == table.c.downtime_category_id
+        ),
+        [*columns, _downtime_category.c.name.label("downtime_category")],
+    )
+
+
+def _events(table):
+    return _Listing(
+        *_with_downtime_category(table, table, list(table.c)),
+        table.c.id,
+        time=table.c.timestamp,
+        filters={name: table.c[name] for name in ("mesin_id", "operator_id", "tooling_id")},
+    )
+
+
+def _intervals(table, start_events, stop_events):
+    # The interval's own times come with it, its time range filter is on when it started
+    start_time = start_events.alias("interval_start")
+    stop_time = stop_events.alias("interval_stop")
+    return _Listing(
+        *_with_downtime_category(
+            table,
+            table.join(start_time, table.c.start_time_id == start_time.c.id).join(
+                stop_time, table.c.stop_time_id == stop_time.c.id
+            ),
+            [
+                *table.c,
+                start_time.c.timestamp.label("start_timestamp"),
+                stop_time.c.timestamp.label("stop_timestamp"),
+            ],
+        ),
+        table.c.id,
+        time=start_time.c.timestamp,
+        filters={name: table.c[name] for name in ("mesin_id", "operator_id")},
+    )
+
+
+LISTINGS = {
+    "tooling": _master(models.Tooling.__table__),
+    "mesin": _master(models.Mesin.__table__),
+    "operator": _master(models.Operator.__table__),
+    "start": _events(_start),
+    "stop": _events(_stop),
+    "utility_mesin": _intervals(models.UtilityMesin.__table__, _start, _stop),
+    "last_downtime_mesin": _intervals(models.LastDowntimeMesin.__table__, _stop, _start),
+    "continued_downtime_mesin": _intervals(
+        models.ContinuedDowntimeMesin.__table__, _stop, _stop
+    ),
+}
+
+
+def _encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def _decode_cursor(listing, cursor):
+    try:
+        key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise fastapi.HTTPException(400, "Invalid cursor.")
+    if not isinstance(key, listing.key.type.python_type):
+        raise fastapi.HTTPException(400, "Invalid cursor.")
+    return key
+
+
+def _as_utc(time):
+    # Taken as UTC when it carries no offset, like activity timestamps
+    if time.tzinfo is None:
+        return time.replace(tzinfo=timezone.utc)
+    return time.astimezone(timezone.utc)
+
+
+def build_query(name, params):
+    """The query for the first page of params, without the page size."""
+    listing = LISTINGS[name]
+    query = sa.select(*listing.columns).select_from(listing.select_from)
+
+    filters = {
+        column: value
+        for column, value in [
+            ("mesin_id", params.mesin_id),
+            ("operator_id", params.operator_id),
+            ("tooling_id", params.tooling_id),
+        ]
+        if value is not None
+    }
+    unsupported = sorted(set(filters) - set(listing.filters))
+    if listing.time is None and (params.time_from or params.time_to):
+        unsupported.append("time_from/time_to")
+    if unsupported:
+        raise fastapi.HTTPException(
+            400, f"/{name.replace('_', '-')}/ can not be filtered by {', '.join(unsupported)}."
+        )
+
+    for column, value in filters.items():
+        query = query.where(listing.filters[column] == value)
+    if params.time_from is not None:
+        query = query.where(listing.time >= _as_utc(params.time_from))
+    if params.time_to is not None:
+        query = query.where(listing.time < _as_utc(params.time_to))
+    return query.order_by(listing.key)
+
+
+def _page_query(name, query, key):
+    return query if key is None else query.where(LISTINGS[name].key > key)
+
+
+def page(name, params):
+    """Rows of one page and the cursor of the next one, None on the last page."""
+    limit = min(params.limit or _PAGE_SIZE, _MAX_PAGE_SIZE)
+    key = None if params.cursor is None else _decode_cursor(LISTINGS[name], params.cursor)
+    query = _page_query(name, build_query(name, params), key).limit(limit + 1)
+    with database.get_engine().connect() as conn:
+        rows = [dict(row) for row in conn.execute(query).mappings()]
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, _encode_cursor(rows[-1]["id"])
+
+
+def iterate_ndjson(name, params):
+    """
+    Every row from the cursor on as newline-delimited JSON, for bulk pulls. Each page
+    is read on its own short connection, so a slow client holds no connection open.
+    """
+    # Validated here, not once the response has started
+    query = build_query(name, params)
+    key = None if params.cursor is None else _decode_cursor(LISTINGS[name], params.cursor)
+
+    def lines(key):
+        while True:
+            with database.get_engine().connect() as conn:
+                rows = conn.execute(_page_query(name, query, key).limit(_MAX_PAGE_SIZE))
+                rows = [dict(row) for row in rows.mappings()]
+            if not rows:
+                return
+            yield "".join(json.dumps(jsonable_encoder(row)) + "\n" for row in rows)
+            if len(rows) < _MAX_PAGE_SIZE:
+                return
+            key = rows[-1]["id"]
+
+    return lines(key)
@@ -1,26 +1,31 @@
-import os
 import io
 
 import fastapi
 import uvicorn
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
-from fastapi_sqlalchemy import DBSessionMiddleware, db
 
 
 import business_logic
 import models
 import schema
-from database import Sessioner
+from database import AsyncSessioner, Sessioner, pool_stats
 import generate_report
 import db_ingestion
 import get_id
+import listing
+import master_cache
+import report_cache
+import report_export
+import report_jobs
+import rollup
+import status_board
 
 load_dotenv(".env")
 
 app = fastapi.FastAPI()
 
-app.add_middleware(DBSessionMiddleware, db_url=os.environ["DATABASE_URL"])
-
 
 @app.get("/")
 async def root():
@@ -32,45 +37,128 @@ def add_tooling(tooling: schema.Tooling, session=Sessioner):
     tooling = models.Tooling(**dict(tooling))
     session.add(tooling)
     session.commit()
+    master_cache.tooling.invalidate(tooling.id)
     return tooling
 
 
-@app.post("/report/mesin")
-def get_report(request: schema.ReportRequest):
-    df, filename = generate_report.get_mesin_report(
-        date_time_from=request.date_from,
-        shift_from=request.shift_from,
-        date_time_to=request.date_to,
-        shift_to=request.shift_to,
-    )
+# Reports are built on the report processes, not on this worker's threads
+async def _report_response(view, request):
+    format = request.format.value
+    report_range = {
+        "date_time_from": request.date_from,
+        "shift_from": request.shift_from,
+        "date_time_to": request.date_to,
+        "shift_to": request.shift_to,
+    }
+    # XLSX is written once every row is known, so it is never streamed
+    if request.stream and format != report_export.XLSX:
+        filename, content = await report_jobs.stream(view, format, **report_range)
+    else:
+        content, filename = await report_jobs.export(view, format, **report_range)
+        content = io.StringIO(content) if isinstance(content, str) else io.BytesIO(content)
+
     response = fastapi.responses.StreamingResponse(
-        io.StringIO(df.to_csv(index=False)), media_type="text/csv"
+        content, media_type=report_export.MEDIA_TYPES[format]
     )
-
     response.headers["Content-Disposition"] = f"attachment; filename={filename}"
     return response
 
 
+@app.post("/report/mesin")
+async def get_report(request: schema.ReportRequest):
+    return await _report_response("mesin", request)
+
+
 @app.post("/report/operator")
-def get_report(request: schema.ReportRequest):
-    df, filename = generate_report.get_operator_report(
-        date_time_from=request.date_from,
-        shift_from=request.shift_from,
-        date_time_to=request.date_to,
-        shift_to=request.shift_to,
+async def get_report(request: schema.ReportRequest):
+    return await _report_response("operator", request)
+
+
+def _report_job_response(job):
+    content = {column: value for column, value in job.items() if column != "key"}
+    if job["status"] == report_jobs.DONE:
+        content["download"] = app.url_path_for("download_report_job", job_id=job["id"])
+    return content
+
+
+@app.post("/report/jobs", status_code=202)
+def submit_report_job(request: schema.ReportJobRequest):
+    # Resolve the defaults now, so the same export asked for later in the day is the same job
+    date_from = request.date_from or request.date_to or generate_report.get_curr_datetime()
+    job = report_jobs.submit(
+        request.view.value,
+        date_from=date_from,
+        shift_from=request.shift_from or 1,
+        date_to=request.date_to or date_from,
+        shift_to=request.shift_to or 3,
+        format=request.format.value,
     )
-    response = fastapi.responses.StreamingResponse(
-        io.StringIO(df.to_csv(index=False)), media_type="text/csv"
+    return _report_job_response(job)
+
+
+@app.get("/report/jobs/{job_id}")
+def get_report_job(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise fastapi.HTTPException(404, f"No report job with id {job_id} found.")
+    return _report_job_response(job)
+
+
+@app.get("/report/jobs/{job_id}/download")
+def download_report_job(job_id: str):
+    job = report_jobs.get(job_id)
+    if job is None:
+        raise fastapi.HTTPException(404, f"No report job with id {job_id} found.")
+    if job["status"] != report_jobs.DONE:
+        raise fastapi.HTTPException(409, f"Report job {job_id} is {job['status']}.")
+    return fastapi.responses.FileResponse(
+        report_jobs.path(job),
+        media_type=report_export.MEDIA_TYPES[job["format"]],
+        filename=job["filename"],
     )
 
-    response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-    return response
+
+@app.on_event("shutdown")
+def shutdown_report_jobs():
+    report_jobs.shutdown()
+
+
+@app.post("/summary/shift")
+def get_shift_summary(request: schema.SummaryRequest, session=Sessioner):
+    date_from = request.date_from or request.date_to or generate_report.get_curr_datetime()
+    date_to = request.date_to or date_from
+    details = rollup.summarize(
+        session,
+        date_from=date_from,
+        shift_from=request.shift_from or 1,
+        date_to=date_to,
+        shift_to=request.shift_to or 3,
+        group_by=[dimension.value for dimension in request.group_by],
+    )
+    return {"details": details}
+
+
+@app.post("/summary/shift/rebuild")
+def rebuild_shift_summary(session=Sessioner):
+    return {"rows": rollup.rebuild(session)}
 
 
 @app.post("/db-ingestion")
 def import_to_db():
-    db_ingestion.import_to_db("data_all.csv")
-    return True
+    summary = db_ingestion.import_to_db("data_all.csv")
+    if summary is None:
+        raise fastapi.HTTPException(400, "Failed to read header of data_all.csv")
+    return summary
+
+
+@app.get("/master-cache/stats")
+def get_master_cache_stats():
+    return master_cache.stats()
+
+
+@app.get("/database/pool")
+def get_database_pool():
+    return pool_stats()
 
 
 @app.get("/get-id")
@@ -81,64 +169,83 @@ def get_all_ids():
     return True
 
 
+def _etag_response(request, etag, content):
+    if request.headers.get("if-none-match") == etag:
+        return fastapi.Response(status_code=304, headers={"ETag": etag})
+    return fastapi.responses.JSONResponse(jsonable_encoder(content), headers={"ETag": etag})
+
+
 @app.get("/mesin-status-all/")
-def get_mesin_status(session=Sessioner):
-    mesin_status_idle = (
-        session.query(models.MesinStatus)
-        .filter(models.MesinStatus.displayed_status == models.DisplayedStatus.IDLE)
-        .with_entities(
-            models.MesinStatus.id.label("Mesin"),
-            models.MesinStatus.last_tooling_id.label("Tooling"),
-            models.MesinStatus.displayed_status.label("Status"),
-            models.MesinStatus.category_downtime.label("Categori Downtime"),
-        )
-        .order_by(models.MesinStatus.id.asc())
-        .all()
+async def get_mesin_status(request: fastapi.Request):
+    mesin, _, etag = await run_in_threadpool(status_board.snapshot)
+    mesin_status = [
+        {
+            "Mesin": row["id"],
+            "Tooling": row["last_tooling_id"],
+            "Operator": row["last_operator_id"],
+            "Status": row["displayed_status"],
+            "Categori Downtime": row["category_downtime"],
+        }
+        for id, row in sorted(mesin.items())
+        if row["displayed_status"] != models.DisplayedStatus.IDLE
+    ]
+    mesin_status_idle = [
+        {
+            "Mesin": row["id"],
+            "Tooling": row["last_tooling_id"],
+            "Status": row["displayed_status"],
+            "Categori Downtime": row["category_downtime"],
+        }
+        for id, row in sorted(mesin.items())
+        if row["displayed_status"] == models.DisplayedStatus.IDLE
+    ]
+    return _etag_response(request, etag, {"details": mesin_status + mesin_status_idle})
+
+
+@app.get("/status-board")
+async def get_status_board(request: fastapi.Request):
+    mesin, operator, etag = await run_in_threadpool(status_board.snapshot)
+    return _etag_response(request, etag, status_board.content(mesin, operator))
+
+
+@app.get("/status-board/stream")
+async def stream_status_board(request: fastapi.Request):
+    return fastapi.responses.StreamingResponse(
+        status_board.stream_events(request.is_disconnected), media_type="text/event-stream"
     )
-    mesin_status = (
-        session.query(models.MesinStatus)
-        .filter(models.MesinStatus.displayed_status != models.DisplayedStatus.IDLE)
-        .with_entities(
-            models.MesinStatus.id.label("Mesin"),
-            models.MesinStatus.last_tooling_id.label("Tooling"),
-            models.MesinStatus.last_operator_id.label("Operator"),
-            models.MesinStatus.displayed_status.label("Status"),
-            models.MesinStatus.category_downtime.label("Categori Downtime"),
-        )
-        .order_by(models.MesinStatus.id.asc())
-        .all()
-    )
-    return {"details": mesin_status + mesin_status_idle}
 
 
 @app.get("/tooling/{tooling_id}", response_model=schema.Tooling)
-def get_tooling(tooling_id: str, session=Sessioner):
-    tooling = session.query(models.Tooling).filter(models.Tooling.id == tooling_id).one_or_none()
+async def get_tooling(tooling_id: str, session=AsyncSessioner):
+    tooling = await session.run_sync(
+        lambda session: master_cache.tooling.get(tooling_id, session)
+    )
     if tooling is None:
         raise fastapi.HTTPException(404, f"No Tooling with id {tooling_id} found.")
     return tooling
 
 
 @app.get("/mesin/{mesin_id}", response_model=schema.Mesin)
-def get_mesin(mesin_id: str, session=Sessioner):
-    mesin = session.query(models.Mesin).filter(models.Mesin.id == mesin_id).one_or_none()
+async def get_mesin(mesin_id: str, session=AsyncSessioner):
+    mesin = await session.run_sync(
+        lambda session: master_cache.mesin.get(mesin_id, session)
+    )
     if mesin is None:
         raise fastapi.HTTPException(404, f"No Machine with id {mesin_id} found.")
     return mesin
 
 
 @app.get("/operator/{operator_id}", response_model=schema.Operator)
-def get_operator(operator_id: str, session=Sessioner):
-    operator = (
-        session.query(models.Operator).filter(models.Operator.id == operator_id).one_or_none()
+async def get_operator(operator_id: str, session=AsyncSessioner):
+    operator = await session.run_sync(
+        lambda session: master_cache.operator.get(operator_id, session)
     )
     if operator is None:
         raise fastapi.HTTPException(404, f"No Operator with id {operator_id} found.")
     return operator
 
 
-@app.post("/operator-status")
-def check_operator_status(request: schema.CheckOperatorStatus, session=Sessioner):
+def _check_operator_status(session, request):
     mesin_status_ok, mesin_error_msg = business_logic.check_mesin(
         mesin_id=request.mesin_id, operator_id=request.operator_id, session=session
     )
@@ -159,20 +266,23 @@ def check_operator_status(request: schema.CheckOperatorStatus, session=Sessioner
     }
 
 
-@app.post("/activity")
-def post_activity(activity: schema.Activity, session=Sessioner):
-    if (
-        session.query(models.Mesin).filter(models.Mesin.id == activity.mesin_id).first() is None
-        or session.query(models.Tooling).filter(models.Tooling.id == activity.tooling_id).first()
-        is None
-        or session.query(models.Operator).filter(models.Operator.id == activity.operator_id).first()
-        is None
+@app.post("/operator-status")
+async def check_operator_status(request: schema.CheckOperatorStatus, session=AsyncSessioner):
+    return await session.run_sync(_check_operator_status, request)
+
+
+def _post_activity(session, activity):
+    if not business_logic.is_valid_activity(
+        tooling_id=activity.tooling_id,
+        mesin_id=activity.mesin_id,
+        operator_id=activity.operator_id,
+        session=session,
     ):
         raise fastapi.HTTPException(404, "Invalid input")
 
     match activity.type:
         case schema.ActivityType.START:
-            business_logic.start_activity(
+            return business_logic.start_activity(
                 tooling_id=activity.tooling_id,
                 mesin_id=activity.mesin_id,
                 operator_id=activity.operator_id,
@@ -182,7 +292,7 @@ def post_activity(activity: schema.Activity, session=Sessioner):
             )
 
         case schema.ActivityType.FIRST_STOP:
-            business_logic.first_stop_activity(
+            return business_logic.first_stop_activity(
                 tooling_id=activity.tooling_id,
                 mesin_id=activity.mesin_id,
                 operator_id=activity.operator_id,
@@ -197,7 +307,7 @@ def post_activity(activity: schema.Activity, session=Sessioner):
             )
 
         case schema.ActivityType.CONTINUE_STOP:
-            business_logic.continue_stop_activity(
+            return business_logic.continue_stop_activity(
                 tooling_id=activity.tooling_id,
                 mesin_id=activity.mesin_id,
                 operator_id=activity.operator_id,
@@ -209,55 +319,87 @@ def post_activity(activity: schema.Activity, session=Sessioner):
         case _:
             raise fastapi.HTTPException(404, "Invalid activity type")
 
+
+# business_logic is sync, it runs on the async session's connection through run_sync.
+# Dropping the report tiles it touched is file I/O, so that runs on the thread pool.
+@app.post("/activity")
+async def post_activity(activity: schema.Activity, session=AsyncSessioner):
+    interval_start = await session.run_sync(_post_activity, activity)
+    await run_in_threadpool(report_cache.invalidate, interval_start)
     return {"isSuccess": True}
 
 
+@app.post("/activity/batch")
+async def post_activity_batch(batch: schema.ActivityBatch, session=AsyncSessioner):
+    results, interval_starts = await session.run_sync(
+        lambda session: business_logic.apply_activity_batch(batch.events, session)
+    )
+    await run_in_threadpool(report_cache.invalidate, *interval_starts)
+    return {
+        "isSuccess": all(is_success for is_success, _ in results),
+        "results": [
+            {"isSuccess": is_success, "errorMessage": error_message}
+            for is_success, error_message in results
+        ],
+    }
+
+
 @app.get("/mesin/status/{mesin_id}")
-def get_mesin_status(mesin_id: str, session=Sessioner):
+async def get_mesin_status(mesin_id: str):
     status = models.Status.IDLE
-    mesin_status = (
-        session.query(models.MesinStatus).filter(models.MesinStatus.id == mesin_id).one_or_none()
-    )
+    mesin_status = (await run_in_threadpool(status_board.snapshot))[0].get(mesin_id)
     if mesin_status is not None:
-        status = mesin_status.status
+        status = mesin_status["status"]
     return {"status": status}
 
 
 # ----- GET APIs ----- #
+_ListingParams = fastapi.Depends(schema.ListingQuery)
+
+
+def _listing_response(name, request, params):
+    if params.format == schema.ListingFormat.NDJSON:
+        return fastapi.responses.StreamingResponse(
+            listing.iterate_ndjson(name, params), media_type="application/x-ndjson"
+        )
+
+    rows, cursor = listing.page(name, params)
+    response = fastapi.responses.JSONResponse(jsonable_encoder(rows))
+    if cursor is not None:
+        next_url = request.url.include_query_params(cursor=cursor)
+        response.headers["Link"] = f'<{next_url}>; rel="next"'
+        response.headers["X-Next-Cursor"] = cursor
+    return response
+
+
 @app.get("/tooling/")
-def get_tooling(session=Sessioner):
-    toolings = session.query(models.Tooling).all()
-    return toolings
+def get_tooling(request: fastapi.Request, params=_ListingParams):
+    return _listing_response("tooling", request, params)
 
 
 @app.get("/mesin/")
-def get_mesin(session=Sessioner):
-    mesin = session.query(models.Mesin).all()
-    return mesin
+def get_mesin(request: fastapi.Request, params=_ListingParams):
+    return _listing_response("mesin", request, params)
 
 
 @app.get("/operator/")
-def get_operator(session=Sessioner):
-    operators = session.query(models.Operator).all()
-    return operators
+def get_operator(request: fastapi.Request, params=_ListingParams):
+    return _listing_response("operator", request, params)
 
 
 @app.get("/utility-mesin/")
-def get_utility_mesin(session=Sessioner):
-    utility_mesin = session.query(models.UtilityMesin).all()
-    return utility_mesin
+def get_utility_mesin(request: fastapi.Request, params=_ListingParams):
+    return _listing_response("utility_mesin", request, params)
 
 
 @app.get("/last-downtime-mesin/")
-def get_last_downtime_mesin(session=Sessioner):
-    last_downtime_mesin = session.query(models.LastDowntimeMesin).all()
-    return last_downtime_mesin
+def get_last_downtime_mesin(request: fastapi.Request, params=_ListingParams):
+    return _listing_response("last_downtime_mesin", request, params)
 
 
 @app.get("/continued-downtime-mesin/")
-def get_continued_downtime_mesin(session=Sessioner):
-    continued_downtime_mesin = session.query(models.ContinuedDowntimeMesin).all()
-    return continued_downtime_mesin
+def get_continued_downtime_mesin(request: fastapi.Request, params=_ListingParams):
+    return _listing_response("continued_downtime_mesin", request, params)
 
 
 @app.get("/utility-operator/")
@@ -279,19 +421,19 @@ def get_continued_downtime_operator(session=Sessioner):
 
 
 @app.get("/operator-status-all/")
-def get_operator_status_all(session=Sessioner):
-    operator_status = session.query(models.OperatorStatus).all()
+async def get_operator_status_all():
+    operator_status = list((await run_in_threadpool(status_board.snapshot))[1].values())
     return operator_status
 
 
 @app.get("/operator/status/{operator_id}")
-def get_operator_status(operator_id: str, session=Sessioner):
+async def get_operator_status(operator_id: str):
     (
         is_running,
         operator_status,
         tooling_id,
         mesin_id,
-    ) = business_logic.is_operator_running(operator_id, session)
+    ) = await run_in_threadpool(business_logic.is_operator_running, operator_id)
     return {
         "isRunning": is_running,
         "operatorStatus": operator_status,
@@ -301,15 +443,13 @@ def get_operator_status(operator_id: str, session=Sessioner):
 
 
 @app.get("/start/")
-def get_start(session=Sessioner):
-    start = session.query(models.Start).all()
-    return start
+def get_start(request: fastapi.Request, params=_ListingParams):
+    return _listing_response("start", request, params)
 
 
 @app.get("/stop/")
-def get_stop(session=Sessioner):
-    stop = session.query(models.Stop).all()
-    return stop
+def get_stop(request: fastapi.Request, params=_ListingParams):
+    return _listing_response("stop", request, params)
 
 
 if __name__ == "__main__":
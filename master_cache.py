@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import models
+
+"""
+Read-through cache of Tooling, Mesin and Operator rows by id. Master data only
+changes through /add-tooling/ and db_ingestion, which invalidate it explicitly;
+the TTL bounds how long a change made by another process stays invisible.
+Only existing ids are cached, so a newly ingested id is usable right away.
+"""
+_TTL_SECONDS = float(os.environ.get("MASTER_CACHE_TTL_SECONDS", 300))
+_MAX_ENTRIES = int(os.environ.get("MASTER_CACHE_MAX_ENTRIES", 10000))
+
+
+def _row(entity):
+    return {column.name: getattr(entity, column.name) for column in entity.__table__.columns}
+
+
+class MasterCache:
+    def __init__(self, model, ttl_seconds=_TTL_SECONDS, max_entries=_MAX_ENTRIES):
+        self._model = model
+        self._ttl_seconds = ttl_seconds
+        self._max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # id -> (expires at, row), least recently used first
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _lookup(self, id, now):
+        entry = self._entries.get(id)
+        if entry is None or entry[0] < now:
+            return None
+        self._entries.move_to_end(id)
+        return entry[1]
+
+    def get_many(self, ids, session):
+        """Rows of the existing ids among ids, keyed by id. Misses cost one IN query."""
+        now = time.monotonic()
+        rows, missing = {}, set()
+        with self._lock:
+            for id in set(ids):
+                row = self._lookup(id, now)
+                if row is None:
+                    missing.add(id)
+                else:
+                    rows[id] = row
+            self._hits += len(rows)
+            self._misses += len(missing)
+
+        if missing:
+            loaded = {
+                entity.id: _row(entity)
+                for entity in session.query(self._model).filter(self._model.id.in_(missing))
+            }
+            with self._lock:
+                for id, row in loaded.items():
+                    self._entries[id] = (now + self._ttl_seconds, row)
+                    self._entries.move_to_end(id)
+                while len(self._entries) > self._max_entries:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+            rows.update(loaded)
+        return rows
+
+    def get(self, id, session):
+        """Row of id as a dict, None when it does not exist."""
+        return self.get_many([id], session).get(id)
+
+    def invalidate(self, id=None):
+        with self._lock:
+            if id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(id, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self._hits,
+                "misses": self._misses,
+                "evictions": self._evictions,
+            }
+
+
+tooling = MasterCache(models.Tooling)
+mesin = MasterCache(models.Mesin)
+operator = MasterCache(models.Operator)
+
+_CACHES = {"tooling": tooling, "mesin": mesin, "operator": operator}
+
+
+def invalidate_all():
+    for cache in _CACHES.values():
+        cache.invalidate()
+
+
+def stats():
+    return {name: cache.stats() for name, cache in _CACHES.items()}
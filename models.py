@@ -44,13 +44,28 @@ class Operator(Base):
     time_updated = sa.Column(sa.DateTime(timezone=True), onupdate=sa.sql.func.now())
 
 
+class DowntimeCategory(Base):
+    """Downtime categories by small integer code, the event and interval tables store the code."""
+
+    __tablename__ = "downtime_category"
+    id = sa.Column(
+        sa.SmallInteger().with_variant(sa.Integer, "sqlite"), primary_key=True, autoincrement=True
+    )
+    name = sa.Column(sa.String, nullable=False, unique=True)
+
+
 class Start(Base):
     __tablename__ = "start"
+    __table_args__ = (sa.Index("ix_start_mesin_id_timestamp", "mesin_id", "timestamp"),)
+    # Fetch the server timestamp on insert, business_logic reads it before commit
+    __mapper_args__ = {"eager_defaults": True}
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     tooling_id = sa.Column(sa.String, sa.ForeignKey("tooling.id"))
     mesin_id = sa.Column(sa.String, sa.ForeignKey("mesin.id"))
     operator_id = sa.Column(sa.String, sa.ForeignKey("operator.id"))
-    timestamp = sa.Column(sa.DateTime(timezone=True), server_default=sa.sql.func.now())
+    timestamp = sa.Column(
+        sa.DateTime(timezone=True), server_default=sa.sql.func.now(), index=True
+    )
     # tooling = sa.orm.relationship("Tooling", backref="start", uselist=True)
     # mesin = sa.orm.relationship("Mesin", backref="start", uselist=True)
     # operator = sa.orm.relationship("Operator", backref="start", uselist=True)
@@ -58,13 +73,18 @@ class Start(Base):
 
 class Stop(Base):
     __tablename__ = "stop"
+    __table_args__ = (sa.Index("ix_stop_mesin_id_timestamp", "mesin_id", "timestamp"),)
+    # Fetch the server timestamp on insert, business_logic reads it before commit
+    __mapper_args__ = {"eager_defaults": True}
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     tooling_id = sa.Column(sa.String, sa.ForeignKey("tooling.id"))
     mesin_id = sa.Column(sa.String, sa.ForeignKey("mesin.id"))
     operator_id = sa.Column(sa.String, sa.ForeignKey("operator.id"))
-    timestamp = sa.Column(sa.DateTime(timezone=True), server_default=sa.sql.func.now())
+    timestamp = sa.Column(
+        sa.DateTime(timezone=True), server_default=sa.sql.func.now(), index=True
+    )
     output = sa.Column(sa.Integer, nullable=True)
-    downtime_category = sa.Column(sa.String)
+    downtime_category_id = sa.Column(sa.SmallInteger, sa.ForeignKey("downtime_category.id"))
     # tooling = sa.orm.relationship("Tooling", backref="stop", uselist=True)
     # mesin = sa.orm.relationship("Mesin", backref="stop", uselist=True)
     # operator = sa.orm.relationship("Operator", backref="stop", uselist=True)
@@ -75,8 +95,8 @@ class UtilityMesin(Base):
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     mesin_id = sa.Column(sa.String, sa.ForeignKey("mesin.id"), nullable=False)
     operator_id = sa.Column(sa.String, sa.ForeignKey("operator.id"), nullable=False)
-    start_time_id = sa.Column(sa.Integer, sa.ForeignKey("start.id"), nullable=False)
-    stop_time_id = sa.Column(sa.Integer, sa.ForeignKey("stop.id"), nullable=False)
+    start_time_id = sa.Column(sa.Integer, sa.ForeignKey("start.id"), nullable=False, index=True)
+    stop_time_id = sa.Column(sa.Integer, sa.ForeignKey("stop.id"), nullable=False, index=True)
     start_time = sa.orm.relationship("Start", backref="utility_mesin_start", uselist=False)
     stop_time = sa.orm.relationship("Stop", backref="utility_mesin_stop", uselist=False)
     output = sa.Column(sa.Integer)
@@ -92,13 +112,13 @@ class LastDowntimeMesin(Base):
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     mesin_id = sa.Column(sa.String, sa.ForeignKey("mesin.id"), nullable=False)
     operator_id = sa.Column(sa.String, sa.ForeignKey("operator.id"), nullable=False)
-    start_time_id = sa.Column(sa.Integer, sa.ForeignKey("stop.id"), nullable=False)
-    stop_time_id = sa.Column(sa.Integer, sa.ForeignKey("start.id"), nullable=False)
+    start_time_id = sa.Column(sa.Integer, sa.ForeignKey("stop.id"), nullable=False, index=True)
+    stop_time_id = sa.Column(sa.Integer, sa.ForeignKey("start.id"), nullable=False, index=True)
     start_time = sa.orm.relationship("Stop", backref="last_downtime_mesin_start", uselist=False)
     stop_time = sa.orm.relationship("Start", backref="last_downtime_mesin_stop", uselist=False)
     reject = sa.Column(sa.Integer, nullable=True)
     rework = sa.Column(sa.Integer, nullable=True)
-    downtime_category = sa.Column(sa.String)
+    downtime_category_id = sa.Column(sa.SmallInteger, sa.ForeignKey("downtime_category.id"))
 
 
 class ContinuedDowntimeMesin(Base):
@@ -106,8 +126,8 @@ class ContinuedDowntimeMesin(Base):
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     operator_id = sa.Column(sa.String, sa.ForeignKey("operator.id"), nullable=False)
     mesin_id = sa.Column(sa.String, sa.ForeignKey("mesin.id"), nullable=False)
-    start_time_id = sa.Column(sa.Integer, sa.ForeignKey("stop.id"), nullable=False)
-    stop_time_id = sa.Column(sa.Integer, sa.ForeignKey("stop.id"), nullable=False)
+    start_time_id = sa.Column(sa.Integer, sa.ForeignKey("stop.id"), nullable=False, index=True)
+    stop_time_id = sa.Column(sa.Integer, sa.ForeignKey("stop.id"), nullable=False, index=True)
     start_time = sa.orm.relationship(
         "Stop",
         foreign_keys=[start_time_id],
@@ -119,7 +139,7 @@ class ContinuedDowntimeMesin(Base):
     )
     reject = sa.Column(sa.Integer, nullable=True)
     rework = sa.Column(sa.Integer, nullable=True)
-    downtime_category = sa.Column(sa.String)
+    downtime_category_id = sa.Column(sa.SmallInteger, sa.ForeignKey("downtime_category.id"))
 
 
 @strawberry.enum
@@ -154,7 +174,9 @@ class MesinStatus(Base):
     last_stop = sa.orm.relationship("Stop", backref="mesin_status", uselist=False)
     last_tooling = sa.orm.relationship("Tooling", backref="curr_mesin", uselist=False)
     last_operator = sa.orm.relationship("Operator", backref="curr_mesin", uselist=False)
-    category_downtime = sa.Column(sa.String, nullable=True)
+    category_downtime_id = sa.Column(
+        sa.SmallInteger, sa.ForeignKey("downtime_category.id"), nullable=True
+    )
     displayed_status = sa.Column(
         sa.Enum(DisplayedStatus, name="displayed_status"),
         default=DisplayedStatus.IDLE,
@@ -184,3 +206,65 @@ class OperatorStatus(Base):
     last_mesin_id = sa.Column(sa.String, sa.ForeignKey("mesin.id"), nullable=False)
     last_tooling = sa.orm.relationship("Tooling", backref="curr_operator", uselist=False)
     last_mesin = sa.orm.relationship("Mesin", backref="curr_operator", uselist=False)
+
+
+class ShiftRollup(Base):
+    """Intervals summed per machine, operator, tooling, shift and downtime category."""
+
+    __tablename__ = "shift_rollup"
+    shift_date = sa.Column(sa.Date, primary_key=True)
+    shift = sa.Column(sa.Integer, primary_key=True)
+    mesin_id = sa.Column(sa.String, sa.ForeignKey("mesin.id"), primary_key=True)
+    operator_id = sa.Column(sa.String, sa.ForeignKey("operator.id"), primary_key=True)
+    # Empty when the interval's starting event has no tooling
+    tooling_id = sa.Column(sa.String, primary_key=True)
+    downtime_category = sa.Column(sa.String, primary_key=True)
+    duration = sa.Column(sa.Integer, nullable=False, default=0)
+    output = sa.Column(sa.Integer, nullable=False, default=0)
+    reject = sa.Column(sa.Integer, nullable=False, default=0)
+    rework = sa.Column(sa.Integer, nullable=False, default=0)
+    interval_count = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+@strawberry.enum
+class IntervalKind(Enum):
+    """Interval table a production interval comes from"""
+
+    UTILITY = "UTILITY"
+    LAST_DOWNTIME = "LAST_DOWNTIME"
+    CONTINUED_DOWNTIME = "CONTINUED_DOWNTIME"
+
+
+class ProductionInterval(Base):
+    """
+    Every utility, last downtime and continued downtime interval with its start and
+    stop copied in, written with the interval, so reports read one table by time.
+    """
+
+    __tablename__ = "production_interval"
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    kind = sa.Column(sa.Enum(IntervalKind, name="interval_kind"), nullable=False)
+    mesin_id = sa.Column(sa.String, sa.ForeignKey("mesin.id"), nullable=False)
+    # The interval's operator, and the starting event's one the mesin report shows
+    operator_id = sa.Column(sa.String, sa.ForeignKey("operator.id"), nullable=False)
+    start_operator_id = sa.Column(sa.String, sa.ForeignKey("operator.id"))
+    # The starting event's tooling
+    tooling_id = sa.Column(sa.String, sa.ForeignKey("tooling.id"))
+    start_timestamp = sa.Column(sa.DateTime(timezone=True), nullable=False, index=True)
+    stop_timestamp = sa.Column(sa.DateTime(timezone=True), nullable=False)
+    downtime_category_id = sa.Column(sa.SmallInteger, sa.ForeignKey("downtime_category.id"))
+    output = sa.Column(sa.Integer)
+    reject = sa.Column(sa.Integer, nullable=True)
+    rework = sa.Column(sa.Integer, nullable=True)
+    coil_no = sa.Column(sa.String, nullable=True)
+    lot_no = sa.Column(sa.String, nullable=True)
+    pack_no = sa.Column(sa.String, nullable=True)
+
+
+class ArchivePart(Base):
+    """Report source rows of a month moved to Parquet files by archive.py, one per view."""
+
+    __tablename__ = "archive_part"
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    month = sa.Column(sa.Date, nullable=False, index=True)
+    time_created = sa.Column(sa.DateTime(timezone=True), server_default=sa.sql.func.now())
@@ -0,0 +1,218 @@
+import bisect
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy
+import pandas
+import pytz
+
+import report_query
+import shift_calendar
+
+"""
+Report source rows persisted per closed tile of time. Tiles are bounded by every
+shift start, shift end and local midnight, so a closed (date, shift) is served from
+disk and only the still-open part of a range is queried live. A late /activity write
+removes the tile its interval starts in, renamed master data removes every tile.
+"""
+_TIMEZONE = pytz.timezone("Asia/Jakarta")
+
+_CACHE_DIRECTORY = os.environ.get("REPORT_CACHE_DIRECTORY", "data/report/cache")
+_MAX_BYTES = int(os.environ.get("REPORT_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+_MAX_ENTRIES = int(os.environ.get("REPORT_CACHE_MAX_ENTRIES", 10000))
+
+_INVALIDATED_MARKER = "invalidated"
+_FILENAME_FORMAT = "%Y%m%dT%H%M%S"
+
+
+def _to_utc(date_time):
+    # Naive datetimes are already UTC, as the report ranges and SQLite timestamps are
+    if date_time.tzinfo is not None:
+        date_time = date_time.astimezone(timezone.utc).replace(tzinfo=None)
+    return date_time
+
+
+def _local_to_utc(date_time):
+    return _TIMEZONE.localize(date_time).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def _local_date(date_time):
+    return pytz.utc.localize(date_time).astimezone(_TIMEZONE).date()
+
+
+def _tile_boundaries(time_from, time_to):
+    """Sorted naive UTC tile boundaries covering at least a day around [time_from, time_to]."""
+    boundaries = set()
+    day = _local_date(time_from) - timedelta(days=1)
+    while day <= _local_date(time_to) + timedelta(days=1):
+        midnight = datetime(day.year, day.month, day.day)
+        boundaries.add(_local_to_utc(midnight))
+        for _, hour, duration in shift_calendar.calendar.day_shifts(midnight):
+            begin = midnight + timedelta(hours=hour)
+            boundaries.add(_local_to_utc(begin))
+            boundaries.add(_local_to_utc(begin + timedelta(hours=duration)))
+        day += timedelta(days=1)
+    return sorted(boundaries)
+
+
+def _tile_path(view, begin, end):
+    return os.path.join(
+        _CACHE_DIRECTORY,
+        view,
+        f"{begin.strftime(_FILENAME_FORMAT)}_{end.strftime(_FILENAME_FORMAT)}.pkl",
+    )
+
+
+def _marker_path():
+    return os.path.join(_CACHE_DIRECTORY, _INVALIDATED_MARKER)
+
+
+def _invalidated_since(started):
+    try:
+        return os.stat(_marker_path()).st_mtime >= started
+    except FileNotFoundError:
+        return False
+
+
+def _read_tile(path):
+    try:
+        df = pandas.read_pickle(path)
+    except (FileNotFoundError, EOFError):
+        return None
+    os.utime(path)  # mtime doubles as the LRU clock
+    return df
+
+
+def _store_tiles(view, tiles, df, started):
+    """Split rows fetched for consecutive tiles by their start and persist each tile."""
+    starts = pandas.to_datetime(df["Start"], utc=True).dt.tz_localize(None).values
+    begins = numpy.array([begin for begin, _ in tiles], dtype="datetime64[ns]")
+    positions = numpy.searchsorted(begins, starts, side="right") - 1
+
+    os.makedirs(os.path.join(_CACHE_DIRECTORY, view), exist_ok=True)
+    paths = []
+    for position, (begin, end) in enumerate(tiles):
+        path = _tile_path(view, begin, end)
+        df[positions == position].to_pickle(path + ".tmp")
+        os.replace(path + ".tmp", path)
+        paths.append(path)
+
+    # A write may have landed while the rows were queried, drop what we just stored
+    if _invalidated_since(started):
+        for path in paths:
+            _remove(path)
+        return
+
+    _evict()
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def _evict():
+    entries = []
+    for view in report_query.VIEWS:
+        directory = os.path.join(_CACHE_DIRECTORY, view)
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".pkl"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    entries.sort()
+    total = sum(size for _, size, _ in entries)
+    while entries and (total > _MAX_BYTES or len(entries) > _MAX_ENTRIES):
+        _, size, path = entries.pop(0)
+        _remove(path)
+        total -= size
+
+
+def _mark_invalidated():
+    os.makedirs(_CACHE_DIRECTORY, exist_ok=True)
+    with open(_marker_path(), "a"):
+        os.utime(_marker_path())
+
+
+def invalidate(*timestamps):
+    """Drop the cached tiles containing the timestamps, for every report view."""
+    tiles = set()
+    for timestamp in timestamps:
+        if timestamp is None:
+            continue
+        timestamp = _to_utc(timestamp)
+        boundaries = _tile_boundaries(timestamp, timestamp)
+        position = bisect.bisect_right(boundaries, timestamp)
+        tiles.add((boundaries[position - 1], boundaries[position]))
+    if not tiles:
+        return
+
+    _mark_invalidated()
+    for begin, end in tiles:
+        for view in report_query.VIEWS:
+            _remove(_tile_path(view, begin, end))
+
+
+def invalidate_all():
+    """Drop every cached tile, e.g. once master names changed or rows were archived."""
+    _mark_invalidated()
+    for view in report_query.VIEWS:
+        directory = os.path.join(_CACHE_DIRECTORY, view)
+        if not os.path.isdir(directory):
+            continue
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".pkl"):
+                _remove(entry.path)
+
+
+def read_report_source(view, time_from, time_to, loader):
+    """
+    Report source rows for [time_from, time_to). Closed tiles come from disk when
+    cached, everything else through loader(view, time_from, time_to) with one query
+    per run of consecutive tiles. Rows are returned in the view's sort order.
+    """
+    time_from, time_to = _to_utc(time_from), _to_utc(time_to)
+    if time_from >= time_to:
+        return loader(view, time_from, time_to)
+    now = datetime.utcnow()
+
+    canonical = _tile_boundaries(time_from, time_to)
+    edges = [time_from] + [b for b in canonical if time_from < b < time_to] + [time_to]
+    canonical = set(canonical)
+
+    # Group tiles into runs of one cached "hit", or consecutive "miss" or "live" tiles
+    runs = []
+    for begin, end in zip(edges[:-1], edges[1:]):
+        if begin in canonical and end in canonical and end <= now:
+            kind = "hit" if os.path.isfile(_tile_path(view, begin, end)) else "miss"
+        else:
+            kind = "live"
+
+        if kind != "hit" and runs and runs[-1][0] == kind:
+            runs[-1][1].append((begin, end))
+        else:
+            runs.append((kind, [(begin, end)]))
+
+    frames = []
+    for kind, tiles in runs:
+        df = _read_tile(_tile_path(view, *tiles[0])) if kind == "hit" else None
+        if df is None:
+            started = time.time()
+            df = loader(view, tiles[0][0], tiles[-1][1])
+            if kind != "live":
+                _store_tiles(view, tiles, df, started)
+        frames.append(df)
+
+    logging.info(
+        "Report cache %s: %d hit, %d queried",
+        view,
+        sum(kind == "hit" for kind, _ in runs),
+        sum(kind != "hit" for kind, _ in runs),
+    )
+    return report_query.combine_frames(view, frames)
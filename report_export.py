@@ -0,0 +1,122 @@
+import io
+import os
+
+import fastapi
+import pandas
+
+"""
+Reports written as CSV, Parquet, an Arrow IPC stream or XLSX. The columnar formats take
+the typed report, so dates, local timestamps, durations and counts keep their types
+instead of being formatted as text. pyarrow and openpyxl are imported on first use.
+"""
+CSV, PARQUET, ARROW, XLSX = "csv", "parquet", "arrow", "xlsx"
+
+MEDIA_TYPES = {
+    CSV: "text/csv",
+    PARQUET: "application/vnd.apache.parquet",
+    ARROW: "application/vnd.apache.arrow.stream",
+    XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+_EXTENSIONS = {CSV: "csv", PARQUET: "parquet", ARROW: "arrows", XLSX: "xlsx"}
+
+_TIMEZONE = "Asia/Jakarta"
+_INTEGER_COLUMNS = ["Shift", "Qty", "Reject", "Rework"]
+_TIMESTAMP_COLUMNS = ["StartTime", "StopTime"]
+# Excel sheets hold 1,048,576 rows, one of them is the header
+_XLSX_MAX_ROWS = 1048575
+
+
+def filename(csv_filename, format):
+    return f"{os.path.splitext(csv_filename)[0]}.{_EXTENSIONS[format]}"
+
+
+def _arrow_schema(header):
+    import pyarrow
+
+    types = {
+        "Tanggal": pyarrow.date32(),
+        "Duration": pyarrow.duration("ms"),
+        **{column: pyarrow.int64() for column in _INTEGER_COLUMNS},
+        **{column: pyarrow.timestamp("ms", tz=_TIMEZONE) for column in _TIMESTAMP_COLUMNS},
+    }
+    return pyarrow.schema([(column, types.get(column, pyarrow.string())) for column in header])
+
+
+def _arrow_table(df, schema):
+    import pyarrow
+
+    # An explicit schema keeps chunks with an all-empty column the same type as the rest
+    return pyarrow.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def _write_xlsx(df):
+    if len(df) > _XLSX_MAX_ROWS:
+        raise fastapi.HTTPException(
+            413, f"{len(df)} rows do not fit in an XLSX sheet, use parquet or arrow."
+        )
+
+    # Excel has no time zones, write the local wall-clock time
+    df = df.copy()
+    for column in _TIMESTAMP_COLUMNS:
+        df[column] = df[column].dt.tz_localize(None)
+
+    buffer = io.BytesIO()
+    with pandas.ExcelWriter(buffer, engine="openpyxl") as writer:
+        df.to_excel(writer, index=False, sheet_name="Report")
+        if "Duration" in df.columns:
+            # pandas writes durations as a fraction of a day with a "0" format
+            column = df.columns.get_loc("Duration") + 1
+            sheet = writer.sheets["Report"]
+            for (cell,) in sheet.iter_rows(min_row=2, min_col=column, max_col=column):
+                cell.number_format = "[h]:mm:ss"
+    return buffer.getvalue()
+
+
+def write(df, format):
+    """The whole report in format, as str for CSV and bytes otherwise."""
+    if format == CSV:
+        return df.to_csv(index=False)
+    if format == XLSX:
+        return _write_xlsx(df)
+    return b"".join(write_chunks([df], list(df.columns), format))
+
+
+def write_chunks(frames, header, format):
+    """Encode consecutive report frames as they come, for a streamed response."""
+    if format == CSV:
+        write_header = True
+        for df in frames:
+            yield df.to_csv(index=False, header=write_header)
+            write_header = False
+        if write_header:
+            yield pandas.DataFrame(columns=header).to_csv(index=False)
+        return
+
+    if format == XLSX:
+        # A workbook is a zip archive, it can only be written once every row is known
+        frames = list(frames)
+        yield _write_xlsx(
+            pandas.concat(frames, ignore_index=True) if frames else pandas.DataFrame(columns=header)
+        )
+        return
+
+    import pyarrow
+    import pyarrow.parquet
+
+    schema = _arrow_schema(header)
+    sink = io.BytesIO()
+    if format == PARQUET:
+        writer = pyarrow.parquet.ParquetWriter(sink, schema, compression="snappy")
+    else:
+        writer = pyarrow.ipc.new_stream(
+            sink, schema, options=pyarrow.ipc.IpcWriteOptions(compression="zstd")
+        )
+
+    # Every frame becomes a Parquet row group or an Arrow record batch
+    for df in frames:
+        writer.write_table(_arrow_table(df, schema))
+        yield sink.getvalue()
+        sink.seek(0)
+        sink.truncate()
+    writer.close()
+    yield sink.getvalue()
@@ -0,0 +1,397 @@
+import asyncio
+import functools
+import hashlib
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from multiprocessing.managers import SyncManager
+
+import sqlalchemy as sa
+
+import generate_report
+import report_export
+
+"""
+Report exports run as background jobs on a bounded process pool, so a month or
+quarter report neither holds an HTTP request open nor a web worker busy. The /report
+endpoints build their reports on the same pool, so no report competes with the
+shop-floor requests for the web worker's interpreter. Jobs live
+in a local SQLite file next to their output, shared by every web worker: an export
+asked for while the same one is queued or running joins that job instead of
+starting another. A job that made no progress for REPORT_JOB_TIMEOUT_SECONDS, e.g.
+because its web worker restarted, is failed so it can be asked for again.
+"""
+_DIRECTORY = os.environ.get("REPORT_JOBS_DIRECTORY", "data/report/jobs")
+_WORKERS = int(os.environ.get("REPORT_JOB_WORKERS", 2))
+_TIMEOUT_SECONDS = float(os.environ.get("REPORT_JOB_TIMEOUT_SECONDS", 3600))
+_RETENTION_SECONDS = float(os.environ.get("REPORT_JOB_RETENTION_SECONDS", 24 * 3600))
+# Report processes yield the CPU to the web workers when cores are short
+_NICENESS = int(os.environ.get("REPORT_JOB_NICENESS", 10))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+_ACTIVE = (QUEUED, RUNNING)
+
+_REPORTS = {
+    "mesin": generate_report.get_mesin_report,
+    "operator": generate_report.get_operator_report,
+}
+
+_metadata = sa.MetaData()
+
+jobs = sa.Table(
+    "report_job",
+    _metadata,
+    sa.Column("id", sa.String, primary_key=True),
+    sa.Column("key", sa.String, nullable=False),
+    sa.Column("view", sa.String, nullable=False),
+    sa.Column("date_from", sa.Date, nullable=False),
+    sa.Column("shift_from", sa.Integer, nullable=False),
+    sa.Column("date_to", sa.Date, nullable=False),
+    sa.Column("shift_to", sa.Integer, nullable=False),
+    sa.Column("format", sa.String, nullable=False, server_default=report_export.CSV),
+    sa.Column("status", sa.String, nullable=False),
+    sa.Column("stage", sa.String, nullable=False),
+    sa.Column("progress", sa.Float, nullable=False),
+    sa.Column("filename", sa.String),
+    sa.Column("error", sa.Text),
+    sa.Column("created_at", sa.DateTime, nullable=False),
+    sa.Column("updated_at", sa.DateTime, nullable=False),
+    # At most one queued or running job per distinct export, even across web workers
+    sa.Index(
+        "ix_report_job_active_key",
+        "key",
+        unique=True,
+        sqlite_where=sa.text("status IN ('queued', 'running')"),
+    ),
+)
+
+# Streamed chunks waiting for the web worker, and how often a blocked side rechecks
+_STREAM_QUEUE_SIZE = 2
+_STREAM_POLL_SECONDS = 1
+
+_lock = threading.Lock()
+_engine = None
+_executor = None
+_manager = None
+
+
+def _on_connect(dbapi_connection, connection_record):
+    # Web workers and report processes all write to the file, let readers not block them
+    dbapi_connection.execute("PRAGMA journal_mode=WAL")
+
+
+def _get_engine():
+    global _engine  # pylint: disable=global-statement
+    with _lock:
+        if _engine is None:
+            os.makedirs(_DIRECTORY, exist_ok=True)
+            _engine = sa.create_engine(
+                f"sqlite:///{os.path.join(_DIRECTORY, 'jobs.db')}",
+                connect_args={"timeout": 30},
+            )
+            sa.event.listen(_engine, "connect", _on_connect)
+            _metadata.create_all(_engine)
+            _add_format_column(_engine)
+        return _engine
+
+
+def _add_format_column(engine):
+    # Job files written before jobs had a format only hold CSV exports
+    columns = {column["name"] for column in sa.inspect(engine).get_columns(jobs.name)}
+    if "format" not in columns:
+        with engine.begin() as conn:
+            conn.execute(
+                sa.text(
+                    f"ALTER TABLE {jobs.name} ADD COLUMN format VARCHAR NOT NULL "
+                    f"DEFAULT '{report_export.CSV}'"
+                )
+            )
+
+
+def _get_executor():
+    global _executor  # pylint: disable=global-statement
+    with _lock:
+        if _executor is None:
+            # Spawned, not forked, so workers do not inherit the web server's threads and pools
+            _executor = ProcessPoolExecutor(
+                max_workers=_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=os.nice,
+                initargs=(_NICENESS,),
+            )
+        return _executor
+
+
+def _get_manager():
+    global _manager  # pylint: disable=global-statement
+    with _lock:
+        if _manager is None:
+            # Queues a report process can be handed after it started, to stream through
+            _manager = SyncManager(ctx=multiprocessing.get_context("spawn"))
+            _manager.start(os.nice, (_NICENESS,))
+        return _manager
+
+
+def _discard_executor(executor):
+    global _executor  # pylint: disable=global-statement
+    with _lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _path(job_id, format):
+    return os.path.join(_DIRECTORY, report_export.filename(job_id, format))
+
+
+def _key(view, date_from, shift_from, date_to, shift_to, format):
+    request = f"{view}|{date_from}|{shift_from}|{date_to}|{shift_to}|{format}"
+    return hashlib.sha1(request.encode()).hexdigest()
+
+
+def _update(job_id, **values):
+    """Update a job that is still queued or running, a timed out job stays failed."""
+    with _get_engine().begin() as conn:
+        conn.execute(
+            jobs.update()
+            .where(jobs.c.id == job_id, jobs.c.status.in_(_ACTIVE))
+            .values(updated_at=datetime.utcnow(), **values)
+        )
+
+
+def _expire(conn, now):
+    conn.execute(
+        jobs.update()
+        .where(
+            jobs.c.status.in_(_ACTIVE),
+            jobs.c.updated_at < now - timedelta(seconds=_TIMEOUT_SECONDS),
+        )
+        .values(status=FAILED, error="Report job timed out", updated_at=now)
+    )
+
+
+def _remove_old(conn, now):
+    old = jobs.c.status.notin_(_ACTIVE) & (
+        jobs.c.updated_at < now - timedelta(seconds=_RETENTION_SECONDS)
+    )
+    for job_id, format in conn.execute(sa.select(jobs.c.id, jobs.c.format).where(old)):
+        try:
+            os.remove(_path(job_id, format))
+        except FileNotFoundError:
+            pass
+    conn.execute(jobs.delete().where(old))
+
+
+def _export(view, format, report_range, progress=None):
+    """Entry point in the report process, the report in format with its filename."""
+    options = {} if progress is None else {"progress": progress}
+    df, filename = _REPORTS[view](**report_range, typed=format != report_export.CSV, **options)
+    if progress is not None:
+        progress("writing", 0.9)
+    return report_export.write(df, format), report_export.filename(filename, format)
+
+
+def _put(chunks, cancelled, item):
+    """Put item for the web worker, False once it stopped reading."""
+    while not cancelled.is_set():
+        try:
+            chunks.put(item, timeout=_STREAM_POLL_SECONDS)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _stream(chunks, cancelled, view, format, report_range):
+    """Entry point in the report process, puts the filename, every chunk, then None."""
+    try:
+        content, filename = generate_report.stream_report(view, format=format, **report_range)
+        if not _put(chunks, cancelled, filename):
+            return
+        for chunk in content:
+            if not _put(chunks, cancelled, chunk):
+                return
+    except Exception as exception:
+        _put(chunks, cancelled, exception)
+        return
+    _put(chunks, cancelled, None)
+
+
+def _run(job_id, view, date_from, shift_from, date_to, shift_to, format):
+    """Entry point in the report process."""
+
+    def progress(stage, fraction):
+        _update(job_id, status=RUNNING, stage=stage, progress=fraction)
+
+    progress("starting", 0.0)
+    try:
+        report_range = {
+            "date_time_from": date_from,
+            "shift_from": shift_from,
+            "date_time_to": date_to,
+            "shift_to": shift_to,
+        }
+        content, filename = _export(view, format, report_range, progress)
+        output = _path(job_id, format)
+        with open(output + ".tmp", "w" if isinstance(content, str) else "wb") as file:
+            file.write(content)
+        os.replace(output + ".tmp", output)
+    except Exception as exception:
+        logging.exception("Report job %s failed", job_id)
+        _update(job_id, status=FAILED, error=str(exception))
+        return
+    _update(job_id, status=DONE, stage="done", progress=1.0, filename=filename)
+
+
+def _on_done(job_id, executor, future):
+    # _run reports its own errors, this catches a report process that died
+    exception = None if future.cancelled() else future.exception()
+    if future.cancelled() or exception is not None:
+        _update(job_id, status=FAILED, error=str(exception or "Report job cancelled"))
+    if isinstance(exception, BrokenProcessPool):
+        _discard_executor(executor)
+
+
+def submit(view, date_from, shift_from, date_to, shift_to, format=report_export.CSV):
+    """The queued or running job for this export, a new one when there is none."""
+    key = _key(view, date_from, shift_from, date_to, shift_to, format)
+    active = sa.select(jobs).where(jobs.c.key == key, jobs.c.status.in_(_ACTIVE))
+    now = datetime.utcnow()
+    job = {
+        "id": uuid.uuid4().hex,
+        "key": key,
+        "view": view,
+        "date_from": date_from,
+        "shift_from": shift_from,
+        "date_to": date_to,
+        "shift_to": shift_to,
+        "format": format,
+        "status": QUEUED,
+        "stage": QUEUED,
+        "progress": 0.0,
+        "created_at": now,
+        "updated_at": now,
+    }
+
+    engine = _get_engine()
+    with engine.begin() as conn:
+        _expire(conn, now)
+        _remove_old(conn, now)
+        existing = conn.execute(active).mappings().first()
+        if existing is not None:
+            return dict(existing)
+    try:
+        with engine.begin() as conn:
+            conn.execute(jobs.insert().values(**job))
+    except sa.exc.IntegrityError:
+        # Another web worker queued the same export in between
+        with engine.begin() as conn:
+            existing = conn.execute(active).mappings().first()
+        if existing is not None:
+            return dict(existing)
+        raise
+
+    executor = _get_executor()
+    try:
+        future = executor.submit(
+            _run, job["id"], view, date_from, shift_from, date_to, shift_to, format
+        )
+    except BrokenProcessPool as exception:
+        _discard_executor(executor)
+        _update(job["id"], status=FAILED, error=str(exception))
+    else:
+        future.add_done_callback(lambda future: _on_done(job["id"], executor, future))
+    # Read back, so a new job has every column a job looked up later has
+    return get(job["id"])
+
+
+def _discard_if_broken(executor, future):
+    if not future.cancelled() and isinstance(future.exception(), BrokenProcessPool):
+        _discard_executor(executor)
+
+
+def _submit(function, *args):
+    executor = _get_executor()
+    try:
+        future = executor.submit(function, *args)
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        raise
+    future.add_done_callback(functools.partial(_discard_if_broken, executor))
+    return future
+
+
+async def export(view, format, **report_range):
+    """A report built and written in format on the report processes, with its filename."""
+    return await asyncio.wrap_future(_submit(_export, view, format, report_range))
+
+
+def _next_chunk(chunks, future):
+    while True:
+        try:
+            item = chunks.get(timeout=_STREAM_POLL_SECONDS)
+        except queue.Empty:
+            if future.done():
+                future.result()  # The report process died
+                raise RuntimeError("Report process ended without finishing the report")
+            continue
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+async def _iterate_chunks(chunks, cancelled, future):
+    try:
+        while (chunk := await asyncio.to_thread(_next_chunk, chunks, future)) is not None:
+            yield chunk
+    finally:
+        # The client may be gone, let the report process stop instead of waiting on put
+        await asyncio.to_thread(cancelled.set)
+
+
+def _stream_queue():
+    manager = _get_manager()
+    return manager.Queue(maxsize=_STREAM_QUEUE_SIZE), manager.Event()
+
+
+async def stream(view, format, **report_range):
+    """
+    A report written in format on the report processes while its rows are fetched:
+    its filename and an async iterator of its chunks.
+    """
+    # The first stream starts the manager process, so even this stays off the event loop
+    chunks, cancelled = await asyncio.to_thread(_stream_queue)
+    future = _submit(_stream, chunks, cancelled, view, format, report_range)
+    try:
+        filename = await asyncio.to_thread(_next_chunk, chunks, future)
+    except BaseException:
+        await asyncio.to_thread(cancelled.set)
+        raise
+    return filename, _iterate_chunks(chunks, cancelled, future)
+
+
+def get(job_id):
+    with _get_engine().begin() as conn:
+        _expire(conn, datetime.utcnow())
+        job = conn.execute(sa.select(jobs).where(jobs.c.id == job_id)).mappings().first()
+    return None if job is None else dict(job)
+
+
+def path(job):
+    return _path(job["id"], job["format"])
+
+
+def shutdown():
+    global _manager  # pylint: disable=global-statement
+    with _lock:
+        executor, manager, _manager = _executor, _manager, None
+    if executor is not None:
+        _discard_executor(executor)
+    if manager is not None:
+        manager.shutdown()
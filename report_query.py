@@ -0,0 +1,186 @@
+import functools
+
+import pandas
+import sqlalchemy as sa
+from pandas.api.types import union_categoricals
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.visitors import InternalTraversal
+
+import models
+
+# The mesin report takes the operator from the starting event, the operator report
+# from the interval itself. Both are sorted server-side by their own key.
+VIEWS = {
+    "mesin": {"operator_id": "start_operator_id", "sort_key": ["MC", "Start"]},
+    "operator": {"operator_id": "operator_id", "sort_key": ["Operator", "Start"]},
+}
+
+# Few distinct values repeated on every row, held as categoricals with sorted categories
+# so sorting by them is still alphabetical
+CATEGORICAL_COLUMNS = ["MC", "Operator", "Kode Tooling", "Desc"]
+TIMESTAMP_COLUMNS = ["Start", "Stop"]
+
+_TIMESTAMP = sa.DateTime(timezone=True)
+
+
+class _RawTimestamp(sa.types.TypeDecorator):
+    """
+    A timestamp fetched as the driver returns it, text on SQLite, left to be parsed a
+    whole column at a time by to_frame instead of row by row by SQLAlchemy.
+    """
+
+    impl = _TIMESTAMP
+    cache_ok = True
+
+    def result_processor(self, dialect, coltype):
+        return None
+
+
+class _CodepointOrder(sa.sql.expression.ColumnElement):
+    """
+    A string sort key ordered by code point, as pandas orders the same names once
+    report frames are combined or sorted again. SQLite compares text that way already,
+    Postgres only under the "C" collation.
+    """
+
+    inherit_cache = True
+    _traverse_internals = [("column", InternalTraversal.dp_clauseelement)]
+
+    def __init__(self, column):
+        self.column = column
+        self.type = column.type
+
+
+@compiles(_CodepointOrder)
+def _compile_codepoint_order(element, compiler, **kw):
+    return compiler.process(element.column, **kw)
+
+
+@compiles(_CodepointOrder, "postgresql")
+def _compile_codepoint_order_postgresql(element, compiler, **kw):
+    return f'{compiler.process(element.column, **kw)} COLLATE "C"'
+
+
+def _select_source(view):
+    interval = models.ProductionInterval
+    operator_id = getattr(interval, VIEWS[view]["operator_id"])
+    return (
+        sa.select(
+            models.Mesin.name.label("MC"),
+            models.Operator.name.label("Operator"),
+            models.Tooling.kode_tooling.label("Kode Tooling"),
+            models.Tooling.common_tooling_name.label("Common Tooling Name"),
+            sa.type_coerce(interval.start_timestamp, _RawTimestamp()).label("Start"),
+            sa.type_coerce(interval.stop_timestamp, _RawTimestamp()).label("Stop"),
+            models.DowntimeCategory.name.label("Desc"),
+            interval.output.label("Qty"),
+            interval.reject.label("Reject"),
+            interval.rework.label("Rework"),
+            interval.coil_no.label("Coil No"),
+            interval.lot_no.label("Lot No"),
+            interval.pack_no.label("Pack No"),
+        )
+        .select_from(interval)
+        .join(models.Mesin, models.Mesin.id == interval.mesin_id)
+        .join(models.Operator, models.Operator.id == operator_id)
+        .join(models.Tooling, models.Tooling.id == interval.tooling_id)
+        .outerjoin(
+            models.DowntimeCategory, models.DowntimeCategory.id == interval.downtime_category_id
+        )
+        .where(interval.start_timestamp >= sa.bindparam("time_from", type_=_TIMESTAMP))
+        .where(interval.start_timestamp < sa.bindparam("time_to", type_=_TIMESTAMP))
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def report_statement(view):
+    """
+    Every production interval whose start falls in [:time_from, :time_to), ordered
+    by the view's sort key the way pandas sorts it.
+    Built once per view, so every execution hits the engine's compiled statement cache.
+    """
+    query = _select_source(view)
+    return query.order_by(
+        *[
+            query.selected_columns[key]
+            if key in TIMESTAMP_COLUMNS
+            else _CodepointOrder(query.selected_columns[key])
+            for key in VIEWS[view]["sort_key"]
+        ]
+    )
+
+
+def build_report_query(view, time_from, time_to):
+    """report_statement with its range bound, for pandas.read_sql or EXPLAIN."""
+    return report_statement(view).params(time_from=time_from, time_to=time_to)
+
+
+def execute_report_query(conn, view, time_from, time_to):
+    return conn.execute(report_statement(view), {"time_from": time_from, "time_to": time_to})
+
+
+def to_frame(columns, rows):
+    """
+    Report source frame from result rows of report_statement, with categoricals for
+    the repeated names and timestamps parsed to UTC a whole column at a time.
+    """
+    df = pandas.DataFrame(rows, columns=columns)
+    for column in CATEGORICAL_COLUMNS:
+        df[column] = df[column].astype("category")
+    for column in TIMESTAMP_COLUMNS:
+        df[column] = pandas.to_datetime(df[column], format="ISO8601", utc=True)
+    return df
+
+
+def concat_frames(frames):
+    """
+    pandas.concat of report source frames that keeps the categoricals categorical,
+    also for frames read before they were, e.g. from older cached report tiles.
+    """
+    frames = list(frames)
+    for column in TIMESTAMP_COLUMNS:
+        frames = [df.assign(**{column: pandas.to_datetime(df[column], utc=True)}) for df in frames]
+    for column in CATEGORICAL_COLUMNS:
+        categories = union_categoricals(
+            [df[column].astype("category") for df in frames], sort_categories=True
+        ).categories
+        frames = [
+            df.assign(**{column: df[column].astype("category").cat.set_categories(categories)})
+            for df in frames
+        ]
+    return pandas.concat(frames, ignore_index=True)
+
+
+def combine_frames(view, frames):
+    """Report source frames with no row in common as one, in the view's sort order."""
+    # Empty frames only carry the columns, keep one in case every frame is empty
+    frames = [df for df in frames if len(df)] or frames[:1]
+    if len(frames) == 1:
+        return frames[0]
+    df = concat_frames(frames)
+    return df.sort_values(by=VIEWS[view]["sort_key"], kind="stable").reset_index(drop=True)
+
+
+def build_interval_query():
+    """
+    Every utility, continued downtime and last downtime interval with the ids the
+    shift rollup is keyed by, unordered.
+    """
+    interval = models.ProductionInterval
+    return (
+        sa.select(
+            interval.mesin_id.label("mesin_id"),
+            interval.operator_id.label("operator_id"),
+            interval.tooling_id.label("tooling_id"),
+            interval.start_timestamp.label("start"),
+            interval.stop_timestamp.label("stop"),
+            models.DowntimeCategory.name.label("downtime_category"),
+            interval.output.label("output"),
+            interval.reject.label("reject"),
+            interval.rework.label("rework"),
+        )
+        .select_from(interval)
+        .outerjoin(
+            models.DowntimeCategory, models.DowntimeCategory.id == interval.downtime_category_id
+        )
+    )
@@ -0,0 +1,142 @@
+from datetime import timezone
+
+import pandas
+import pytz
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql, sqlite
+
+import archive
+import database
+import downtime_categories
+import models
+import report_query
+import shift_calendar
+
+"""
+Intervals summed per (shift date, shift, machine, operator, tooling, downtime category).
+/activity adds every interval to its row as it is written, so summaries read a few rows
+per shift instead of scanning the raw interval tables. An interval is booked on the
+shift its start falls in, like the reports do.
+"""
+_TIMEZONE = pytz.timezone("Asia/Jakarta")
+
+DIMENSIONS = ["shift_date", "shift", "mesin_id", "operator_id", "tooling_id", "downtime_category"]
+MEASURES = ["duration", "output", "reject", "rework", "interval_count"]
+
+_INSERTS = {"postgresql": postgresql.insert, "sqlite": sqlite.insert}
+
+
+def _local_time(timestamp):
+    # Naive timestamps come from SQLite and are already UTC
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.astimezone(_TIMEZONE).replace(tzinfo=None, microsecond=0)
+
+
+def record_interval(interval, session):
+    """Add one utility or downtime interval to its rollup row, in the caller's transaction."""
+    start = _local_time(interval.start_time.timestamp)
+    stop = _local_time(interval.stop_time.timestamp)
+    shift_date, shift = shift_calendar.calendar.shift_date_of(start)
+
+    if isinstance(interval, models.UtilityMesin):
+        downtime_category, output = downtime_categories.UTILITY, interval.output or 0
+    else:
+        downtime_category = downtime_categories.name_of(interval.downtime_category_id, session)
+        downtime_category, output = downtime_category or "", 0
+
+    table = models.ShiftRollup.__table__
+    statement = _INSERTS[session.get_bind().dialect.name](table).values(
+        shift_date=shift_date,
+        shift=shift,
+        mesin_id=interval.mesin_id,
+        operator_id=interval.operator_id,
+        tooling_id=interval.start_time.tooling_id or "",
+        downtime_category=downtime_category,
+        duration=int((stop - start).total_seconds()),
+        output=output,
+        reject=interval.reject or 0,
+        rework=interval.rework or 0,
+        interval_count=1,
+    )
+    session.execute(
+        statement.on_conflict_do_update(
+            index_elements=DIMENSIONS,
+            set_={column: table.c[column] + statement.excluded[column] for column in MEASURES},
+        )
+    )
+
+
+def rebuild(session):
+    """
+    Recompute the rollup from the interval tables, returns the number of rows. Rows of
+    shifts before the archived history ends are kept, their intervals are archived.
+    """
+    horizon = archive.horizon(session.connection())
+    first_date = None if horizon is None else _local_time(horizon).date()
+
+    df = pandas.read_sql(sql=report_query.build_interval_query(), con=session.connection())
+    for column in ["start", "stop"]:
+        df[column] = (
+            pandas.to_datetime(df[column], utc=True)
+            .dt.tz_convert(_TIMEZONE)
+            .dt.tz_localize(None)
+            .dt.floor("s")
+        )
+
+    # Shifts start on whole hours, so every start within the same hour shares its shift
+    hours = df["start"].dt.floor("h")
+    unique_hours = hours.drop_duplicates()
+    shifts = pandas.DataFrame(
+        [shift_calendar.calendar.shift_date_of(hour) for hour in unique_hours],
+        columns=["shift_date", "shift"],
+        index=unique_hours,
+    )
+    df["shift_date"] = hours.map(shifts["shift_date"])
+    df["shift"] = hours.map(shifts["shift"])
+
+    df["duration"] = (df["stop"] - df["start"]).dt.total_seconds()
+    df["interval_count"] = 1
+    df[["tooling_id", "downtime_category"]] = df[["tooling_id", "downtime_category"]].fillna("")
+    df[MEASURES] = df[MEASURES].fillna(0).astype(int)
+    df = df.groupby(DIMENSIONS, as_index=False)[MEASURES].sum()
+    if first_date is not None:
+        df = df[df["shift_date"] >= first_date]
+
+    rows = session.query(models.ShiftRollup)
+    if first_date is not None:
+        rows = rows.filter(models.ShiftRollup.shift_date >= first_date)
+    rows.delete()
+    if len(df):
+        session.execute(models.ShiftRollup.__table__.insert(), df.to_dict("records"))
+    session.commit()
+    return len(df)
+
+
+def summarize(session, date_from, shift_from, date_to, shift_to, group_by):
+    """Rollup measures from (date_from, shift_from) to (date_to, shift_to) inclusive."""
+    table = models.ShiftRollup.__table__
+    dimensions = [table.c[column] for column in group_by]
+    query = (
+        sa.select(*dimensions, *[sa.func.sum(table.c[column]).label(column) for column in MEASURES])
+        .where(
+            sa.or_(
+                table.c.shift_date > date_from,
+                sa.and_(table.c.shift_date == date_from, table.c.shift >= shift_from),
+            )
+        )
+        .where(
+            sa.or_(
+                table.c.shift_date < date_to,
+                sa.and_(table.c.shift_date == date_to, table.c.shift <= shift_to),
+            )
+        )
+        .group_by(*dimensions)
+        .order_by(*dimensions)
+    )
+    return [dict(row) for row in session.execute(query).mappings()]
+
+
+if __name__ == "__main__":
+    with database.session_scope() as session:
+        print(f"shift rollup rebuilt with {rebuild(session)} rows")
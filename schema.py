@@ -1,6 +1,6 @@
 from enum import Enum
-from typing import Union
-from datetime import date
+from typing import List, Union
+from datetime import date, datetime
 
 from pydantic import BaseModel, Field
 from pydantic_sqlalchemy import sqlalchemy_to_pydantic
@@ -36,14 +36,83 @@ class Activity(BaseModel):
     pack_no: Union[str, None] = ""
 
 
+class ActivityEvent(Activity):
+    # When the tablet recorded the event, taken as UTC when it carries no offset
+    timestamp: datetime
+
+
+class ActivityBatch(BaseModel):
+    events: List[ActivityEvent]
+
+
+class ReportFormat(str, Enum):
+    CSV = "csv"
+    PARQUET = "parquet"
+    ARROW = "arrow"
+    XLSX = "xlsx"
+
+
 class ReportRequest(BaseModel):
     date_from: Union[date, None] = None
     shift_from: Union[int, None] = 1
     date_to: Union[date, None] = None
     shift_to: Union[int, None] = 3
+    stream: Union[bool, None] = False
+    format: ReportFormat = ReportFormat.CSV
 
 
 class CheckOperatorStatus(BaseModel):
     tooling_id: str
     mesin_id: str
     operator_id: str
+
+
+class SummaryDimension(str, Enum):
+    SHIFT_DATE = "shift_date"
+    SHIFT = "shift"
+    MESIN_ID = "mesin_id"
+    OPERATOR_ID = "operator_id"
+    TOOLING_ID = "tooling_id"
+    DOWNTIME_CATEGORY = "downtime_category"
+
+
+class SummaryRequest(BaseModel):
+    date_from: Union[date, None] = None
+    shift_from: Union[int, None] = 1
+    date_to: Union[date, None] = None
+    shift_to: Union[int, None] = 3
+    group_by: List[SummaryDimension] = [
+        SummaryDimension.MESIN_ID,
+        SummaryDimension.DOWNTIME_CATEGORY,
+    ]
+
+
+class ReportView(str, Enum):
+    MESIN = "mesin"
+    OPERATOR = "operator"
+
+
+class ReportJobRequest(BaseModel):
+    view: ReportView
+    date_from: Union[date, None] = None
+    shift_from: Union[int, None] = 1
+    date_to: Union[date, None] = None
+    shift_to: Union[int, None] = 3
+    format: ReportFormat = ReportFormat.CSV
+
+
+class ListingFormat(str, Enum):
+    JSON = "json"
+    NDJSON = "ndjson"
+
+
+class ListingQuery(BaseModel):
+    # Query parameters of the GET listings, the cursor comes from the previous page
+    limit: Union[int, None] = Field(None, ge=1)
+    cursor: Union[str, None] = None
+    time_from: Union[datetime, None] = None
+    time_to: Union[datetime, None] = None
+    mesin_id: Union[str, None] = None
+    operator_id: Union[str, None] = None
+    tooling_id: Union[str, None] = None
+    format: ListingFormat = ListingFormat.JSON
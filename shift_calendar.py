@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+from datetime import timedelta
+
+import numpy
+import pandas
+
+_WORKING_SHIFT_JSON = "working_shift.json"
+
+_SECONDS_PER_DAY = 24 * 60 * 60
+
+# Sunday has no configured shifts, everything on it is booked as shift 3
+_SUNDAY_SHIFT = 3
+_NO_SHIFT = 0
+
+_WEEKDAY = 0
+_SATURDAY = 1
+_SUNDAY = 2
+
+_DAY_TYPE_NAMES = {_WEEKDAY: "Weekday", _SATURDAY: "Saturday"}
+
+
+def _day_type(isoweekday):
+    if isoweekday == 7:
+        return _SUNDAY
+    return _SATURDAY if isoweekday == 6 else _WEEKDAY
+
+
+def _build_interval_table(day_config):
+    """
+    Turn one day type of working_shift.json into sorted breakpoints (seconds of day)
+    and the shift label of each segment between consecutive breakpoints.
+    Shifts crossing midnight are split in two, earlier shifts in the file win on overlap.
+    """
+    duration = day_config["duration"] * 60 * 60
+    intervals = []
+    for shift, hour in day_config["start"].items():
+        begin = hour * 60 * 60
+        end = (begin + duration) % _SECONDS_PER_DAY
+        if begin < end:
+            intervals.append((begin, end, int(shift)))
+        else:  # crosses midnight
+            intervals.append((begin, _SECONDS_PER_DAY, int(shift)))
+            intervals.append((0, end, int(shift)))
+
+    breakpoints = sorted({0, _SECONDS_PER_DAY} | {p for i in intervals for p in i[:2]})
+    labels = []
+    for segment_start in breakpoints[:-1]:
+        label = _NO_SHIFT
+        for begin, end, shift in intervals:
+            if begin <= segment_start < end:
+                label = shift
+                break
+        labels.append(label)
+
+    return numpy.array(breakpoints[:-1], dtype=numpy.int64), numpy.array(labels, dtype=numpy.int64)
+
+
+class ShiftCalendar:
+    """
+    Shift configuration loaded once from working_shift.json and reloaded only when
+    the file's mtime changes. All times are local (Asia/Jakarta) wall-clock times.
+    """
+
+    def __init__(self, path=_WORKING_SHIFT_JSON):
+        self._path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._config = None
+        self._tables = None
+
+    def _load(self):
+        mtime = os.stat(self._path).st_mtime_ns
+        if mtime == self._mtime:
+            return self._config, self._tables
+
+        with self._lock:
+            if mtime != self._mtime:
+                with open(self._path, "r") as openfile:
+                    config = json.load(openfile)
+                self._tables = {
+                    day_type: _build_interval_table(config[name])
+                    for day_type, name in _DAY_TYPE_NAMES.items()
+                }
+                self._config = config
+                self._mtime = mtime
+        return self._config, self._tables
+
+    def shift_of(self, date_time):
+        """Shift label of a single local datetime, 0 when it falls outside every shift."""
+        day_type = _day_type(date_time.isoweekday())
+        if day_type == _SUNDAY:
+            return _SUNDAY_SHIFT
+
+        _, tables = self._load()
+        breakpoints, labels = tables[day_type]
+        comp_time = date_time.time()
+        seconds = comp_time.hour * 3600 + comp_time.minute * 60 + comp_time.second
+        return int(labels[numpy.searchsorted(breakpoints, seconds, side="right") - 1])
+
+    def shift_hours(self, date_time, shift):
+        """(start hour, duration in hours) of a shift on the day of date_time, None on Sunday."""
+        day_type = _day_type(date_time.isoweekday())
+        if day_type == _SUNDAY:
+            return None
+
+        config, _ = self._load()
+        day_config = config[_DAY_TYPE_NAMES[day_type]]
+        return day_config["start"][str(shift)], day_config["duration"]
+
+    def day_shifts(self, date_time):
+        """[(shift, start hour, duration in hours)] configured for the day of date_time."""
+        day_type = _day_type(date_time.isoweekday())
+        if day_type == _SUNDAY:
+            return []
+
+        config, _ = self._load()
+        day_config = config[_DAY_TYPE_NAMES[day_type]]
+        return [
+            (int(shift), hour, day_config["duration"])
+            for shift, hour in day_config["start"].items()
+        ]
+
+    def shift_date_of(self, date_time):
+        """
+        (date the shift started on, shift) of a single local datetime, so the part of
+        a night shift after midnight is booked on the day the shift began.
+        """
+        shift = self.shift_of(date_time)
+        shift_hours = self.shift_hours(date_time, shift) if shift != _NO_SHIFT else None
+        if shift_hours is not None and date_time.hour < shift_hours[0]:
+            return date_time.date() - timedelta(days=1), shift
+        return date_time.date(), shift
+
+    def assign_shifts(self, timestamps):
+        """
+        Label a whole column of local timestamps in one pass.
+        Accepts anything pandas.DatetimeIndex understands; timezone-aware values are
+        labelled by their wall-clock time. Returns an int64 numpy array, NaT maps to 0.
+        """
+        index = pandas.DatetimeIndex(timestamps)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+
+        missing = index.isna()
+        values = index.values.astype("datetime64[s]")
+        days = values.astype("datetime64[D]")
+        seconds = (values - days).astype(numpy.int64)
+        # 1970-01-01 was a Thursday (isoweekday 4)
+        isoweekday = (days.astype(numpy.int64) + 3) % 7 + 1
+
+        _, tables = self._load()
+        shifts = numpy.full(len(index), _SUNDAY_SHIFT, dtype=numpy.int64)
+        for day_type, (breakpoints, labels) in tables.items():
+            mask = (isoweekday == 6) if day_type == _SATURDAY else (isoweekday < 6)
+            segment = numpy.searchsorted(breakpoints, seconds[mask], side="right") - 1
+            shifts[mask] = labels[segment]
+        shifts[missing] = _NO_SHIFT
+        return shifts
+
+
+calendar = ShiftCalendar()
+
+
+def assign_shifts(timestamps):
+    return calendar.assign_shifts(timestamps)
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+
+import database
+import downtime_categories
+import models
+
+"""
+Process-level snapshot of every MesinStatus and OperatorStatus row, so status polls
+and andon screens are served from memory. business_logic publishes the rows it
+changed after each commit; the whole board is reloaded from the database once it is
+older than STATUS_BOARD_REFRESH_SECONDS, which picks up writes of other workers.
+The ETag is a hash of the content, so it agrees across workers.
+"""
+_REFRESH_SECONDS = float(os.environ.get("STATUS_BOARD_REFRESH_SECONDS", 5))
+_STREAM_POLL_SECONDS = 1
+_STREAM_KEEPALIVE_SECONDS = 15
+
+_MESIN_COLUMNS = [
+    "id",
+    "status",
+    "displayed_status",
+    "last_tooling_id",
+    "last_operator_id",
+]
+_OPERATOR_COLUMNS = ["id", "status", "last_tooling_id", "last_mesin_id"]
+
+
+def _row(entity, columns):
+    return {column: getattr(entity, column) for column in columns}
+
+
+def _mesin_row(entity, session):
+    return {
+        **_row(entity, _MESIN_COLUMNS),
+        "category_downtime": downtime_categories.name_of(entity.category_downtime_id, session),
+    }
+
+
+def _etag(mesin, operator):
+    content = json.dumps([mesin, operator], sort_keys=True, default=lambda value: value.value)
+    return '"' + hashlib.sha1(content.encode()).hexdigest() + '"'
+
+
+class StatusBoard:
+    def __init__(self, refresh_seconds=_REFRESH_SECONDS):
+        self._refresh_seconds = refresh_seconds
+        self._lock = threading.Lock()
+        self._loaded_at = None
+        # Replaced, never mutated, so readers can keep a reference without copying
+        self._board = ({}, {}, None)
+
+    def _load(self):
+        session = database.SessionLocal()
+        try:
+            mesin = {
+                row.id: dict(row._mapping)
+                for row in session.query(
+                    *[getattr(models.MesinStatus, column) for column in _MESIN_COLUMNS],
+                    models.DowntimeCategory.name.label("category_downtime"),
+                ).outerjoin(
+                    models.DowntimeCategory,
+                    models.DowntimeCategory.id == models.MesinStatus.category_downtime_id,
+                )
+            }
+            operator = {
+                row.id: dict(row._mapping)
+                for row in session.query(
+                    *[getattr(models.OperatorStatus, column) for column in _OPERATOR_COLUMNS]
+                )
+            }
+        finally:
+            session.close()
+        return mesin, operator
+
+    def snapshot(self):
+        """(mesin rows by id, operator rows by id, etag), reloaded when stale."""
+        loaded_at = self._loaded_at
+        if loaded_at is None or time.monotonic() - loaded_at > self._refresh_seconds:
+            with self._lock:
+                if self._loaded_at == loaded_at:
+                    started = time.monotonic()
+                    mesin, operator = self._load()
+                    self._board = (mesin, operator, _etag(mesin, operator))
+                    self._loaded_at = started
+        return self._board
+
+    def publish(self, mesin_rows, operator_rows):
+        """Apply rows captured by capture() once their transaction has committed."""
+        if not mesin_rows and not operator_rows:
+            return
+        with self._lock:
+            mesin, operator, _ = self._board
+            mesin = {**mesin, **{row["id"]: row for row in mesin_rows}}
+            operator = {**operator, **{row["id"]: row for row in operator_rows}}
+            self._board = (mesin, operator, _etag(mesin, operator))
+
+
+def capture(mesin_statuses, operator_statuses, session):
+    """Plain copies of status entities, taken before commit expires their attributes."""
+    return (
+        [_mesin_row(entity, session) for entity in mesin_statuses if entity is not None],
+        [_row(entity, _OPERATOR_COLUMNS) for entity in operator_statuses],
+    )
+
+
+board = StatusBoard()
+
+
+def snapshot():
+    return board.snapshot()
+
+
+def publish(captured):
+    board.publish(*captured)
+
+
+def content(mesin, operator):
+    return {
+        "mesin": [mesin[id] for id in sorted(mesin)],
+        "operator": [operator[id] for id in sorted(operator)],
+    }
+
+
+async def stream_events(is_disconnected):
+    """Server-Sent Events carrying the whole board every time it changes."""
+    etag, idle = None, 0
+    while not await is_disconnected():
+        # A stale board is reloaded from the database, keep that off the event loop
+        mesin, operator, current = await run_in_threadpool(board.snapshot)
+        if current != etag:
+            etag, idle = current, 0
+            data = json.dumps(jsonable_encoder(content(mesin, operator)))
+            yield f"id: {etag}\nevent: status\ndata: {data}\n\n"
+        elif idle >= _STREAM_KEEPALIVE_SECONDS:
+            idle = 0
+            yield ": keepalive\n\n"
+        await asyncio.sleep(_STREAM_POLL_SECONDS)
+        idle += _STREAM_POLL_SECONDS